@@ -10,6 +10,7 @@ API сервер для управления Autologist системой
 # --- Блок для поддержки деплоя на Vercel без firebase_key.json ---
 import os
 import json
+import logging
 import tempfile
 
 if os.environ.get('FIREBASE_KEY_JSON'):
@@ -27,18 +28,45 @@ if os.environ.get('FIREBASE_KEY_JSON'):
 # --- Конец блока ---
 
 
+# Flask нужен сразу (маршруты объявляются декораторами), google.cloud.firestore -
+# при первом обращении к данным: запрос статики на холодном старте его не загружает
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
-import json
-import os
+import signal
 import subprocess
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta, timezone
 import threading
 import time
 
+from autologist.chatstats import FirestoreChatStatsStore, chat_summary
+from autologist.contacts import FirestoreContactStore
+from autologist.keywords import MATCH_MODES
+from autologist.normalize import to_e164
+from autologist.offload import API_TIMEOUT_SECONDS, BackendError, BackendPool
+from autologist.queries import MessageQuery
+from autologist.rollups import PERIODS, FirestoreRollupStore, load_statistics, previous_buckets
+from autologist.routes import FirestoreRouteStore, RouteArea, RouteQuery
+from autologist.sharding import canonical_chat_id
+from autologist.timebuckets import current_buckets
+
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
 
+_firestore_client = None
+
+
+def firestore_client():
+    """Клиент Firestore, один на процесс; модуль импортируется при первом вызове"""
+    global _firestore_client
+    if _firestore_client is None:
+        from google.cloud import firestore
+        _firestore_client = firestore.Client()
+    return _firestore_client
+
+
 class AutologistAPI:
     def __init__(self):
         self.parser_process = None
@@ -53,8 +81,7 @@ class AutologistAPI:
     def load_chats_config(self):
         """Загрузка конфигурации чатов из Firestore"""
         try:
-            from google.cloud import firestore
-            db = firestore.Client()
+            db = firestore_client()
             chats_ref = db.collection('monitored_chats')
             chats = [doc.to_dict() for doc in chats_ref.stream()]
             return chats
@@ -74,17 +101,60 @@ class AutologistAPI:
             return False
     
     def get_parser_status(self):
-        """Проверка статуса парсера (заглушка для Vercel)"""
-        # На сервере Vercel невозможно мониторить процессы, всегда возвращаем 'stopped'
-        return {'status': 'stopped'}
+        """
+        Статус парсера по пульсу воркеров (parser_heartbeats в Firestore,
+        без Firestore - data/heartbeats.json). Воркер без свежего пульса - stalled.
+        """
+        from autologist.heartbeat import FirestoreHeartbeatStore, LocalHeartbeatStore, parser_health
+
+        try:
+            heartbeats = FirestoreHeartbeatStore(firestore_client()).read()
+        except Exception as e:
+            print(f"[STAT] Пульс из Firestore недоступен, читаем локальный: {e}")
+            heartbeats = LocalHeartbeatStore().read()
+        status = parser_health(heartbeats)
+        if self.parser_process is not None:
+            exit_code = self.parser_process.poll()
+            status['process'] = {'pid': self.parser_process.pid, 'running': exit_code is None,
+                                 'exit_code': exit_code}
+        self.stats['parser_status'] = status['status']
+        self.stats['last_update'] = datetime.now().isoformat()
+        return status
+    
+    def _local_control(self):
+        """Процессом парсера можно управлять только при PARSER_CONTROL=local (не на Vercel)"""
+        return os.getenv('PARSER_CONTROL', '').lower() == 'local'
     
     def start_parser(self):
-        """Запуск парсера (заглушка для Vercel)"""
-        return {'success': False, 'message': 'Запуск парсера недоступен на сервере Vercel'}
+        """Запуск парсера (или воркеров по PARSER_SESSIONS) дочерним процессом"""
+        if not self._local_control():
+            return {'success': False, 'message': 'Запуск парсера недоступен на сервере Vercel (нужен PARSER_CONTROL=local)'}
+        if self.parser_process is not None and self.parser_process.poll() is None:
+            return {'success': False, 'message': f'Парсер уже запущен (PID {self.parser_process.pid})'}
+        script = 'parsers/run_sharded.py' if os.getenv('PARSER_SESSIONS') else 'parsers/telegram_parser_v2.py'
+        os.makedirs('logs', exist_ok=True)
+        log_file = open('logs/parser_process.log', 'a', encoding='utf-8')
+        self.parser_process = subprocess.Popen([sys.executable, script], stdout=log_file, stderr=subprocess.STDOUT)
+        log_file.close()
+        return {'success': True, 'message': f'Парсер запущен (PID {self.parser_process.pid})',
+                'pid': self.parser_process.pid}
     
-    def stop_parser(self):
-        """Остановка парсера (заглушка для Vercel)"""
-        return {'success': False, 'message': 'Остановка парсера недоступна на сервере Vercel'}
+    def stop_parser(self, timeout=15):
+        """Остановка парсера: SIGINT (сброс спула и индексов), по таймауту - kill"""
+        if not self._local_control():
+            return {'success': False, 'message': 'Остановка парсера недоступна на сервере Vercel (нужен PARSER_CONTROL=local)'}
+        if self.parser_process is None or self.parser_process.poll() is not None:
+            return {'success': False, 'message': 'Парсер не запущен из этого сервера'}
+        if os.name == 'nt':
+            self.parser_process.terminate()
+        else:
+            self.parser_process.send_signal(signal.SIGINT)
+        try:
+            self.parser_process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.parser_process.kill()
+            self.parser_process.wait()
+        return {'success': True, 'message': 'Парсер остановлен', 'exit_code': self.parser_process.returncode}
 
     def get_all_user_chats(self):
         """Получить все чаты пользователя из Telegram"""
@@ -110,7 +180,12 @@ class AutologistAPI:
             async def fetch_real_chats():
                 try:
                     client = TelegramClient('autologist_session', config['api_id'], config['api_hash'])
-                    await client.start()  # Запросит код и будет ждать ввода в терминале
+                    # client.start() без сессии ждал бы ввода кода в терминале и держал запрос API
+                    await client.connect()
+                    if not await client.is_user_authorized():
+                        print("Сессия Telegram не авторизована: войдите через парсер")
+                        await client.disconnect()
+                        return self._get_test_chats()
                     all_chats = []
                     monitored_chats = self.load_chats_config()
                     monitored_ids = [str(chat['chat_id']) for chat in monitored_chats]
@@ -155,7 +230,8 @@ class AutologistAPI:
             
             # Базовые ключевые слова по умолчанию
             default_keywords = [
-                "груз", "перевозка", "доставка", "транспорт", "тонн", "маршрут"
+                "груз", "перевозка", "доставка", "транспорт", "тонн", "маршрут",
+                "погрузка", "выгрузка", "фрахт"
             ]
             
             new_chat = {
@@ -163,6 +239,8 @@ class AutologistAPI:
                 'username': username,
                 'chat_id': str(chat_id),
                 'keywords': keywords if keywords else default_keywords,
+                # Поиск по основам слов: "перевозка" находит "перевозки", "груз" не находит "грузин"
+                'match_mode': 'stem',
                 'enabled': True
             }
             
@@ -198,15 +276,20 @@ class AutologistAPI:
         except Exception as e:
             return {'success': False, 'message': f'Ошибка удаления чата: {str(e)}'}
 
-    def update_chat_keywords(self, chat_id, keywords):
-        """Обновить ключевые слова для чата"""
+    def update_chat_keywords(self, chat_id, keywords, match_mode=None):
+        """Обновить ключевые слова для чата (и режим поиска: substring или stem)"""
         try:
+            if match_mode is not None and match_mode not in MATCH_MODES:
+                return {'success': False, 'message': f'match_mode должен быть одним из {MATCH_MODES}'}
+            
             monitored_chats = self.load_chats_config()
             
             # Находим чат и обновляем ключевые слова
             for chat in monitored_chats:
                 if chat['chat_id'] == chat_id:
                     chat['keywords'] = keywords
+                    if match_mode is not None:
+                        chat['match_mode'] = match_mode
                     break
             else:
                 return {'success': False, 'message': 'Чат не найден'}
@@ -246,79 +329,300 @@ class AutologistAPI:
 autologist_api = AutologistAPI()
 
 # Статические файлы
+# Страницы кэшируются с проверкой по ETag (на CDN - ненадолго), файлы с хешем в имени - на год.
+# Без сборки (python scripts/build_assets.py) страницы отдаются из frontend как есть.
+HTML_CACHE_CONTROL = 'public, max-age=0, must-revalidate, s-maxage=300'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Сколько секунд браузер может кэшировать ответы GET API; остальные ответы API - no-store
+API_CACHE_SECONDS = {
+    '/api/statistics': 60,
+    '/api/analytics': 300,
+    '/api/routes/search': 60,
+    '/api/contacts/': 60,
+}
+
+asset_manifest = None
+
+
+def get_asset_manifest():
+    global asset_manifest
+    if asset_manifest is None:
+        from autologist.assets import load_manifest
+        asset_manifest = load_manifest() or {}
+    return asset_manifest
+
+
+def send_static(filename, cache_control):
+    """Файл сборки (заранее сжатый, если клиент принимает) или исходник из frontend"""
+    from autologist.assets import ASSETS_DIR, choose_encoding
+
+    info = get_asset_manifest().get('files', {}).get(filename)
+    if info is None:
+        response = send_from_directory('frontend', filename)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), info.get('encodings', []))
+    if encoding:
+        import mimetypes
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        suffix = '.br' if encoding == 'br' else '.gz'
+        # ETag по содержимому: одинаковый на всех экземплярах, у сжатых вариантов свой
+        response = send_from_directory(ASSETS_DIR, filename + suffix, mimetype=mimetype,
+                                       etag=f"{info['etag']}-{encoding}")
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(ASSETS_DIR, filename, etag=info['etag'])
+    if info.get('encodings'):
+        response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
 @app.route('/')
 def index():
-    return send_from_directory('frontend', 'dashboard.html')
+    return send_static('dashboard.html', HTML_CACHE_CONTROL)
+
+@app.route('/assets/<path:filename>')
+def asset_files(filename):
+    if f"assets/{filename}" not in get_asset_manifest().get('files', {}):
+        return jsonify({'success': False, 'message': 'Файл не найден'}), 404
+    return send_static(f"assets/{filename}", IMMUTABLE_CACHE_CONTROL)
 
 @app.route('/frontend/<path:filename>')
 def frontend_files(filename):
-    return send_from_directory('frontend', filename)
+    return send_static(filename, HTML_CACHE_CONTROL)
 
 @app.route('/config/<path:filename>')
 def config_files(filename):
-    return send_from_directory('config', filename)
+    response = send_from_directory('config', filename)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.after_request
+def api_cache_headers(response):
+    """Cache-Control для ответов API, если маршрут не задал его сам"""
+    if request.path.startswith('/api/') and 'Cache-Control' not in response.headers:
+        seconds = next((value for prefix, value in API_CACHE_SECONDS.items() if request.path.startswith(prefix)), 0)
+        if request.method == 'GET' and response.status_code == 200 and seconds:
+            response.headers['Cache-Control'] = f'private, max-age={seconds}'
+        else:
+            response.headers['Cache-Control'] = 'no-store'
+    return response
 
 # API endpoints
 
-from google.cloud import firestore
-from datetime import datetime, timedelta
+# Чтение Firestore и Telegram - в общем ограниченном пуле, а не в потоке сервера
+backend = BackendPool()
+
+# Таймаут вызова по маршруту (секунды); остальные - API_TIMEOUT_SECONDS
+ROUTE_TIMEOUTS = {
+    '/api/status': 5,
+    '/api/parser/status': 5,
+    '/api/chats/monitored': 5,
+    '/api/chats': 5,
+    '/api/statistics': 5,
+    '/api/messages': 8,
+    '/api/messages/recent': 5,
+    '/api/contacts/<phone>': 8,
+    '/api/routes/search': 10,
+    '/api/search': 15,
+    '/api/analytics': 20,
+    '/api/chats/all': 30,
+    '/api/chats/add': 30,
+}
+
+
+def offload(fn, *args):
+    """
+    Вызов в пуле с таймаутом маршрута. Одинаковые параллельные GET запросы
+    (метод, путь и параметры) ждут один вызов и получают общий результат,
+    поэтому fn не должна зависеть ни от чего, кроме запроса, и его результат
+    нельзя менять после вызова.
+    """
+    rule = request.url_rule.rule if request.url_rule else request.path
+    key = (request.method, request.full_path) if request.method == 'GET' else None
+    return backend.call(fn, *args, key=key, timeout=ROUTE_TIMEOUTS.get(rule, API_TIMEOUT_SECONDS))
+
+
+def collect_status():
+    """Общий статус системы из Firestore"""
+    parser_status = autologist_api.get_parser_status()
+    status = {
+        'parser_status': parser_status.get('status', 'stopped'),
+        'total_chats': -1,
+        'active_chats': -1,
+        'total_messages': -1,
+        'today_messages': -1,
+        'error_count': sum(worker.get('errors') or 0 for worker in parser_status.get('workers', [])),
+        'parser': parser_status,
+        'firebase': {'status': 'connected'},
+        'ai': {'status': 'disabled'}
+    }
+    try:
+        db = firestore_client()
+    except Exception as e:
+        logger.error(f"❌ [STAT] Нет подключения к Firestore: {e}")
+        status['firebase'] = {'status': 'error', 'error': str(e)}
+        return status
+    try:
+        # Считаем количество сообщений агрегацией на стороне Firestore
+        status['total_messages'] = MessageQuery().count(db)
+    except Exception as e:
+        logger.error(f"❌ [STAT] Ошибка получения total_messages из Firestore: {e}")
+    try:
+        # Подсчет по готовой корзине дня - запрос на равенство по индексу
+        status['today_messages'] = MessageQuery(day=current_buckets()['day']).count(db)
+    except Exception as e:
+        logger.error(f"❌ [STAT] Ошибка получения today_messages из Firestore: {e}")
+    try:
+        chats = [doc.to_dict() for doc in db.collection('monitored_chats').stream()]
+        status['total_chats'] = len(chats)
+        status['active_chats'] = len([c for c in chats if c.get('enabled', True)])
+    except Exception as e:
+        logger.error(f"❌ [STAT] Ошибка получения monitored_chats из Firestore: {e}")
+    return status
 
 @app.route('/api/status')
 def get_status():
     """Получение общего статуса системы из Firestore"""
-    parser_status = autologist_api.get_parser_status()
     try:
-        db = firestore.Client()
-        # Считаем количество сообщений в Firestore
-        total_messages = len([doc for doc in db.collection('messages').stream()])
+        return jsonify(offload(collect_status))
+    except BackendError as e:
+        print(f"[API ERROR] /api/status: {e}")
+        return jsonify({'error': str(e)}), e.status
+
+@app.route('/api/statistics')
+def get_statistics():
+    """
+    Статистика грузов по дням, неделям или месяцам из готовых документов statistics.
+    ?period=day|week|month&limit=7 - последние limit корзин; ?bucket=2025-W44 - одна корзина
+    """
+    try:
+        period = request.args.get('period', 'day')
+        if period not in PERIODS:
+            return jsonify({'error': f'period должен быть одним из {PERIODS}'}), 400
+        limit = min(request.args.get('limit', 7, type=int), 31)
+        bucket = request.args.get('bucket')
+        buckets = [bucket] if bucket else previous_buckets(period, limit)
+        return jsonify(offload(lambda: load_statistics(FirestoreRollupStore(firestore_client()), period, buckets)))
     except Exception as e:
-        print(f"[STAT] Ошибка получения total_messages из Firestore: {e}")
-        total_messages = -1
+        print(f"[API ERROR] /api/statistics: {e}")
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
+
+@app.route('/api/contacts/<phone>')
+def get_contact(phone):
+    """
+    Все объявления отправителя по телефону (в любом формате: 8 701..., +7 (701)...).
+    ?days=7 - только за последние дни, ?limit=100
+    """
     try:
-        today = datetime.utcnow().date()
-        today_start = datetime(today.year, today.month, today.day)
-        today_end = today_start + timedelta(days=1)
-        today_messages = len([
-            doc for doc in db.collection('messages')
-            .where('timestamp', '>=', today_start.isoformat())
-            .where('timestamp', '<', today_end.isoformat())
-            .stream()
-        ])
+        normalized_phone = to_e164(phone)
+        if not normalized_phone:
+            return jsonify({'error': 'Некорректный номер телефона'}), 400
+        days = request.args.get('days', type=int)
+        limit = min(request.args.get('limit', 100, type=int), 500)
+        since = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+        contact, messages = offload(FirestoreContactStore(firestore_client()).lookup, normalized_phone, since, limit)
+        if contact is None:
+            return jsonify({'error': 'Контакт не найден', 'phone': normalized_phone}), 404
+        return jsonify({'contact': contact, 'messages': messages})
     except Exception as e:
-        print(f"[STAT] Ошибка получения today_messages из Firestore: {e}")
-        today_messages = -1
+        print(f"[API ERROR] /api/contacts: {e}")
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
+
+@app.route('/api/routes/search')
+def search_routes():
+    """
+    Поиск актуальных заявок по маршруту через индекс routes.
+    ?from=Казань&from_radius_km=200&to=Московская область&hours=24&limit=50
+    from / to - город, регион (RU-MOS, "Подмосковье") или страна; радиус - только для города
+    """
     try:
-        chats_ref = db.collection('monitored_chats')
-        chats = [doc.to_dict() for doc in chats_ref.stream()]
-        total_chats = len(chats)
-        active_chats = len([c for c in chats if c.get('enabled', True)])
+        origin_name, destination_name = request.args.get('from'), request.args.get('to')
+        if not origin_name and not destination_name:
+            return jsonify({'error': 'Нужен хотя бы один из параметров from / to'}), 400
+        hours = max(1, min(request.args.get('hours', 24, type=int), 24 * 30))
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        try:
+            origin = RouteArea('from', origin_name, request.args.get('from_radius_km', type=float)) \
+                if origin_name else None
+            destination = RouteArea('to', destination_name, request.args.get('to_radius_km', type=float)) \
+                if destination_name else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = RouteQuery(origin, destination, since=datetime.now(timezone.utc) - timedelta(hours=hours),
+                           limit=limit)
+        cargos = offload(lambda: FirestoreRouteStore(firestore_client()).search(query))
+        return jsonify({
+            'from': origin.describe() if origin else None,
+            'to': destination.describe() if destination else None,
+            'count': len(cargos),
+            'cargos': cargos
+        })
     except Exception as e:
-        print(f"[STAT] Ошибка получения monitored_chats из Firestore: {e}")
-        total_chats = -1
-        active_chats = -1
-    return jsonify({
-        'parser_status': parser_status.get('status', 'stopped'),
-        'total_chats': total_chats,
-        'active_chats': active_chats,
-        'total_messages': total_messages,
-        'today_messages': today_messages,
-        'error_count': 0,
-        'parser': parser_status,
-        'firebase': {'status': 'connected'},
-        'ai': {'status': 'disabled'}
-    })
+        print(f"[API ERROR] /api/routes/search: {e}")
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
+
+analytics_cache = None
+
+@app.route('/api/analytics')
+def get_analytics():
+    """
+    Распределения ставки за тонну по маршрутам, выбросы и тренд по дням.
+    ?days=30&currency=USD&window=7; результат кэшируется до изменения статистики
+    """
+    global analytics_cache
+    try:
+        from autologist.analytics import AnalyticsCache, analyze, data_version, load_messages
+        days = max(1, min(request.args.get('days', 30, type=int), 365))
+        currency = request.args.get('currency', 'USD').upper()
+        window = max(1, min(request.args.get('window', 7, type=int), 31))
+        if analytics_cache is None:
+            analytics_cache = AnalyticsCache()
+
+        def compute():
+            db = firestore_client()
+            version = data_version(FirestoreRollupStore(db), days)
+            return analytics_cache.get_or_compute(
+                (days, currency, window), version,
+                lambda: analyze(load_messages(db, days), currency, window))
+
+        return jsonify(offload(compute))
+    except Exception as e:
+        print(f"[API ERROR] /api/analytics: {e}")
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
 
-@app.route('/api/chats')
-def get_chats():
-    """Получение списка чатов"""
+def list_chats():
+    """Список чатов со статистикой"""
     chats = autologist_api.load_chats_config()
     
-    # Добавляем статистику для каждого чата
+    # Счетчики ведет парсер (chat_stats/{chat_id}): все чаты читаются одним get_all
+    try:
+        stats = FirestoreChatStatsStore(firestore_client()).get_many([chat['chat_id'] for chat in chats])
+    except Exception as e:
+        print(f"[API WARNING] Статистика чатов недоступна: {e}")
+        stats = {}
+    
     for chat in chats:
-        chat['message_count'] = 0  # TODO: подсчет сообщений по чату
-        chat['last_message'] = None  # TODO: последнее сообщение
+        doc = stats.get(canonical_chat_id(chat['chat_id']))
+        chat['message_count'] = doc.get('total', 0) if doc else 0
+        chat['last_message'] = {'text': doc.get('last_message'), 'at': doc.get('last_message_at')} \
+            if doc and doc.get('last_message_at') else None
+        chat['stats'] = chat_summary(doc)
     
-    return jsonify(chats)
+    return chats
+
+@app.route('/api/chats')
+def get_chats():
+    """Получение списка чатов"""
+    try:
+        return jsonify(offload(list_chats))
+    except BackendError as e:
+        print(f"[API ERROR] /api/chats: {e}")
+        return jsonify({'error': str(e)}), e.status
 
 @app.route('/api/chats/<chat_id>/toggle', methods=['POST'])
 def toggle_chat(chat_id):
@@ -342,6 +646,15 @@ def toggle_chat(chat_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/parser/status')
+def parser_status():
+    """Состояние воркеров парсера по пульсу: скорость, задержка, очереди, ошибки"""
+    try:
+        return jsonify(offload(autologist_api.get_parser_status))
+    except Exception as e:
+        print(f"[API ERROR] /api/parser/status: {e}")
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
+
 @app.route('/api/parser/start', methods=['POST'])
 def start_parser():
     """Запуск парсера"""
@@ -374,18 +687,17 @@ def verify_telegram_code():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Ошибка: {str(e)}'})
 
-from google.cloud import firestore
-
 @app.route('/api/messages')
 def get_messages():
     """Получение списка сообщений из Firestore"""
     try:
-        db = firestore.Client()
         limit = request.args.get('limit', 50, type=int)
-        messages_ref = db.collection('messages').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
-        docs = messages_ref.stream()
-        messages = [doc.to_dict() for doc in docs]
-        return jsonify(messages)
+        # Необязательный фильтр по чатам: ?chat_id=1,2,3
+        chat_ids = [c for c in request.args.get('chat_id', '').split(',') if c]
+        # Необязательный фильтр по корзине: ?day=2025-10-30, ?week=2025-W44, ?month=2025-10
+        buckets = {name: request.args.get(name) for name in ('day', 'week', 'month')}
+        query = MessageQuery(chat_ids=chat_ids, limit=limit, **buckets)
+        return jsonify(offload(lambda: query.fetch(firestore_client())))
     except Exception as e:
         print(f"[API ERROR] /api/messages: {e}")
         return jsonify([]), 200
@@ -394,55 +706,52 @@ def get_messages():
 def get_recent_messages():
     """Получение последних сообщений из Firestore"""
     try:
-        db = firestore.Client()
-        messages_ref = db.collection('messages').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(20)
-        docs = messages_ref.stream()
-        messages = [doc.to_dict() for doc in docs]
-        return jsonify(messages)
+        return jsonify(offload(lambda: MessageQuery(limit=20).fetch(firestore_client())))
     except Exception as e:
         print(f"[API ERROR] /api/messages/recent: {e}")
         return jsonify([]), 200
 
+def scan_local_messages(query, chat_filter):
+    """Сообщения из data/messages, подходящие под текст и чат, новые первыми"""
+    messages = []
+    
+    # Читаем все сообщения
+    if os.path.exists('data/messages'):
+        for filename in os.listdir('data/messages'):
+            if filename.endswith('.json'):
+                try:
+                    with open(f'data/messages/{filename}', 'r', encoding='utf-8') as f:
+                        message = json.load(f)
+                        
+                        # Фильтрация по тексту
+                        if query and query not in message.get('text', '').lower():
+                            continue
+                        
+                        # Фильтрация по чату
+                        if chat_filter and str(message.get('chat_id')) != str(chat_filter):
+                            continue
+                        
+                        # TODO: Фильтрация по дате
+                        
+                        messages.append(message)
+                except Exception:
+                    continue
+    
+    # Сортируем по времени
+    messages.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+    
+    return messages
+
 @app.route('/api/search')
 def search_messages():
     """Поиск сообщений"""
     try:
         query = request.args.get('q', '').lower()
         chat_filter = request.args.get('chat_id')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
-        
-        messages = []
-        
-        # Читаем все сообщения
-        if os.path.exists('data/messages'):
-            for filename in os.listdir('data/messages'):
-                if filename.endswith('.json'):
-                    try:
-                        with open(f'data/messages/{filename}', 'r', encoding='utf-8') as f:
-                            message = json.load(f)
-                            
-                            # Фильтрация по тексту
-                            if query and query not in message.get('text', '').lower():
-                                continue
-                            
-                            # Фильтрация по чату
-                            if chat_filter and str(message.get('chat_id')) != str(chat_filter):
-                                continue
-                            
-                            # TODO: Фильтрация по дате
-                            
-                            messages.append(message)
-                    except Exception:
-                        continue
-        
-        # Сортируем по времени
-        messages.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        
-        return jsonify(messages)
+        return jsonify(offload(scan_local_messages, query, chat_filter))
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
 
 # Новые API endpoints для управления чатами
 
@@ -450,7 +759,7 @@ def search_messages():
 def get_monitored_chats():
     """Получение отслеживаемых чатов"""
     try:
-        chats_config = autologist_api.load_chats_config()
+        chats_config = offload(autologist_api.load_chats_config)
         return jsonify({
             'success': True,
             'chats': chats_config
@@ -459,16 +768,16 @@ def get_monitored_chats():
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
+        }), getattr(e, 'status', 500)
 
 @app.route('/api/chats/all')
 def get_all_chats():
     """Получение всех доступных чатов пользователя"""
     try:
-        all_chats = autologist_api.get_all_user_chats()
+        all_chats = offload(autologist_api.get_all_user_chats)
         return jsonify(all_chats)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), getattr(e, 'status', 500)
 
 @app.route('/api/chats/add', methods=['POST'])
 def add_chat():
@@ -482,7 +791,7 @@ def add_chat():
             return jsonify({'success': False, 'message': 'Не указан ID чата'}), 400
         
         # Получаем название чата из списка всех чатов
-        all_chats = autologist_api.get_all_user_chats()
+        all_chats = offload(autologist_api.get_all_user_chats)
         chat_name = None
         chat_username = None
         
@@ -530,8 +839,9 @@ def update_keywords(chat_id):
     try:
         data = request.json
         keywords = data.get('keywords', [])
+        match_mode = data.get('match_mode')
         
-        result = autologist_api.update_chat_keywords(int(chat_id), keywords)
+        result = autologist_api.update_chat_keywords(int(chat_id), keywords, match_mode)
         return jsonify(result)
         
     except Exception as e:
@@ -0,0 +1,4 @@
+"""
+Общие модули Autologist: хранилища, миграции и обслуживание данных.
+Используются API сервером, парсером и служебными скриптами.
+"""
@@ -0,0 +1,272 @@
+"""
+Векторная аналитика по ставкам и тоннажу заявок (NumPy)
+
+Заявки загружаются в колоночные массивы: города, маршруты, типы грузов
+и валюты кодируются целыми числами (категориальное кодирование), вес,
+ставка и день - числовые массивы. Групповые перцентили, скользящие средние
+и z-оценки выбросов считаются одним проходом сортировки и bincount без
+циклов Python по строкам, поэтому миллионы заявок обрабатываются за секунды.
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from autologist.rollups import bucket_doc_id, previous_buckets
+from autologist.timebuckets import parse_timestamp
+
+# Перцентили ставки за тонну по маршруту
+ROUTE_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+class CargoFrame:
+    """Колоночное представление заявок"""
+
+    def __init__(self, cities, cargo_types, currencies, from_code, to_code, type_code,
+                 currency_code, weight, price, day):
+        self.cities = cities
+        self.cargo_types = cargo_types
+        self.currencies = currencies
+        self.from_code = from_code
+        self.to_code = to_code
+        self.type_code = type_code
+        self.currency_code = currency_code
+        self.weight = weight
+        self.price = price
+        self.day = day
+
+    def __len__(self):
+        return len(self.weight)
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Заявки из сообщений с полем cargos"""
+        origins, destinations, types, currencies, weights, prices, days = [], [], [], [], [], [], []
+        for message in messages:
+            timestamp = parse_timestamp(message.get('timestamp'))
+            day = timestamp.date().isoformat() if timestamp else 'NaT'
+            for cargo in message.get('cargos') or []:
+                origins.append(cargo.get('from_city') or '')
+                destinations.append(cargo.get('to_city') or '')
+                types.append(cargo.get('cargo_type') or '')
+                currencies.append(cargo.get('currency') or '')
+                weights.append(cargo.get('weight_tons') or np.nan)
+                prices.append(cargo.get('price') or np.nan)
+                days.append(day)
+
+        # Общий словарь городов для откуда/куда, чтобы коды маршрутов были сопоставимы
+        cities, city_codes = np.unique(np.array(origins + destinations, dtype=object).astype(str),
+                                       return_inverse=True)
+        count = len(origins)
+        cargo_types, type_code = np.unique(np.array(types, dtype=str), return_inverse=True)
+        currency_names, currency_code = np.unique(np.array(currencies, dtype=str), return_inverse=True)
+        return cls(
+            cities=cities,
+            cargo_types=cargo_types,
+            currencies=currency_names,
+            from_code=city_codes[:count],
+            to_code=city_codes[count:],
+            type_code=type_code,
+            currency_code=currency_code,
+            weight=np.array(weights, dtype=float),
+            price=np.array(prices, dtype=float),
+            day=np.array(days, dtype='datetime64[D]')
+        )
+
+    def route_code(self):
+        """Код маршрута: откуда * число городов + куда"""
+        return self.from_code.astype(np.int64) * len(self.cities) + self.to_code
+
+    def route_name(self, code):
+        origin, destination = divmod(int(code), len(self.cities))
+        return f"{self.cities[origin]} → {self.cities[destination]}"
+
+    def route_mask(self):
+        """Заявки с распознанными городами отправления и назначения"""
+        empty = np.flatnonzero(self.cities == '')
+        if not len(empty):
+            return np.ones(len(self), dtype=bool)
+        return (self.from_code != empty[0]) & (self.to_code != empty[0])
+
+    def currency_mask(self, currency):
+        matches = np.flatnonzero(self.currencies == currency)
+        if not len(matches):
+            return np.zeros(len(self), dtype=bool)
+        return self.currency_code == matches[0]
+
+
+def grouped_quantiles(groups, values, quantiles):
+    """
+    Перцентили values внутри каждой группы (линейная интерполяция, как np.quantile).
+    Возвращает (коды групп, размеры групп, массив [групп x перцентилей]).
+    """
+    mask = np.isfinite(values)
+    groups, values = groups[mask], values[mask]
+    if not len(values):
+        return np.array([], dtype=groups.dtype), np.array([], dtype=int), np.empty((0, len(quantiles)))
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    codes, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    result = np.empty((len(codes), len(quantiles)))
+    for i, q in enumerate(quantiles):
+        position = starts + q * (counts - 1)
+        low = np.floor(position).astype(int)
+        high = np.ceil(position).astype(int)
+        fraction = position - low
+        result[:, i] = values[low] + (values[high] - values[low]) * fraction
+    return codes, counts, result
+
+
+def grouped_zscores(groups, values):
+    """z-оценка каждого значения относительно среднего и отклонения своей группы"""
+    codes, inverse = np.unique(groups, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(codes))
+    sums = np.bincount(inverse, weights=values, minlength=len(codes))
+    squares = np.bincount(inverse, weights=values * values, minlength=len(codes))
+    mean = sums / counts
+    std = np.sqrt(np.maximum(squares / counts - mean * mean, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (values - mean[inverse]) / std[inverse]
+    return np.where(std[inverse] > 0, z, 0.0), counts[inverse]
+
+
+def moving_average(values, window):
+    """Скользящее среднее с окном window (для первых дней - по имеющимся)"""
+    if not len(values):
+        return values
+    cumulative = np.cumsum(np.insert(values, 0, 0.0))
+    sizes = np.minimum(np.arange(1, len(values) + 1), window)
+    ends = np.arange(1, len(values) + 1)
+    return (cumulative[ends] - cumulative[ends - sizes]) / sizes
+
+
+def price_per_ton(frame, currency, mask=None):
+    """Маска заявок в валюте с известной ставкой и весом и ставка за тонну"""
+    mask = frame.currency_mask(currency) if mask is None else mask & frame.currency_mask(currency)
+    mask = mask & np.isfinite(frame.price) & np.isfinite(frame.weight) & (frame.weight > 0)
+    return mask, frame.price[mask] / frame.weight[mask]
+
+
+def route_distributions(frame, currency='USD', min_count=3):
+    """Распределение ставки за тонну по маршрутам"""
+    mask, per_ton = price_per_ton(frame, currency, frame.route_mask())
+    codes, counts, quantiles = grouped_quantiles(frame.route_code()[mask], per_ton, ROUTE_QUANTILES)
+    weights = grouped_quantiles(frame.route_code(), frame.weight, (0.5,))
+    weight_by_route = dict(zip(weights[0].tolist(), weights[2][:, 0].tolist()))
+    routes = []
+    for code, count, row in zip(codes, counts, quantiles):
+        if count < min_count:
+            continue
+        routes.append({
+            'route': frame.route_name(code),
+            'count': int(count),
+            'price_per_ton': {f"p{int(q * 100)}": round(float(v), 2) for q, v in zip(ROUTE_QUANTILES, row)},
+            'weight_p50': round(weight_by_route[int(code)], 2)
+        })
+    routes.sort(key=lambda route: -route['count'])
+    return routes
+
+
+def price_outliers(frame, currency='USD', threshold=3.0, min_group=5, limit=50):
+    """Заявки, чья ставка за тонну отклоняется от маршрута больше чем на threshold сигм"""
+    mask, per_ton = price_per_ton(frame, currency, frame.route_mask())
+    rows = np.flatnonzero(mask)
+    z, group_sizes = grouped_zscores(frame.route_code()[mask], per_ton)
+    flagged = np.flatnonzero((np.abs(z) >= threshold) & (group_sizes >= min_group))
+    flagged = flagged[np.argsort(-np.abs(z[flagged]))][:limit]
+    return [{
+        'route': frame.route_name(frame.route_code()[rows[i]]),
+        'day': str(frame.day[rows[i]]),
+        'price': float(frame.price[rows[i]]),
+        'weight_tons': float(frame.weight[rows[i]]),
+        'price_per_ton': round(float(per_ton[i]), 2),
+        'zscore': round(float(z[i]), 2)
+    } for i in flagged]
+
+
+def daily_trend(frame, currency='USD', window=7):
+    """Число заявок и средняя ставка за тонну по дням со скользящими средними"""
+    valid = ~np.isnat(frame.day)
+    if not valid.any():
+        return []
+    first = frame.day[valid].min()
+    day_index = (frame.day[valid] - first).astype(int)
+    length = int(day_index.max()) + 1
+    counts = np.bincount(day_index, minlength=length).astype(float)
+
+    mask, per_ton = price_per_ton(frame, currency)
+    priced = mask[valid]
+    price_days = day_index[priced]
+    price_sum = np.bincount(price_days, weights=per_ton[valid[mask]], minlength=length)
+    price_count = np.bincount(price_days, minlength=length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_price = np.where(price_count > 0, price_sum / price_count, np.nan)
+
+    # Скользящее среднее ставки только по дням, где она известна
+    filled = np.where(price_count > 0, price_sum, 0.0)
+    weighted = moving_average(filled, window)
+    weighted_count = moving_average(price_count.astype(float), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_ma = np.where(weighted_count > 0, weighted / weighted_count, np.nan)
+    cargos_ma = moving_average(counts, window)
+
+    days = first + np.arange(length)
+    return [{
+        'day': str(days[i]),
+        'cargos': int(counts[i]),
+        'cargos_ma': round(float(cargos_ma[i]), 2),
+        'price_per_ton': None if np.isnan(mean_price[i]) else round(float(mean_price[i]), 2),
+        'price_per_ton_ma': None if np.isnan(price_ma[i]) else round(float(price_ma[i]), 2)
+    } for i in range(length)]
+
+
+def analyze(messages, currency='USD', window=7):
+    """Полный отчет для /api/analytics"""
+    frame = CargoFrame.from_messages(messages)
+    return {
+        'cargos': len(frame),
+        'currency': currency,
+        'routes': route_distributions(frame, currency),
+        'outliers': price_outliers(frame, currency),
+        'trend': daily_trend(frame, currency, window)
+    }
+
+
+def load_messages(db, days):
+    """Сообщения за последние days дней: только поля, нужные аналитике"""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    query = db.collection('messages').where('timestamp', '>=', since).select(['timestamp', 'cargos'])
+    return [doc.to_dict() for doc in query.stream()]
+
+
+def data_version(store, days):
+    """
+    Версия данных окна: счетчики сообщений и заявок дневных документов статистики.
+    Меняется при каждом сбросе приращений парсером, читается несколько документов.
+    """
+    day_ids = [bucket_doc_id('day', day) for day in previous_buckets('day', days)]
+    docs = store.get_many(day_ids)
+    return tuple((doc_id, docs[doc_id].get('messages', 0), docs[doc_id].get('cargos', 0))
+                 for doc_id in day_ids if doc_id in docs)
+
+
+class AnalyticsCache:
+    """Мемоизация отчетов по версии данных (счетчики дневной статистики)"""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, version, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                return entry[1]
+        result = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (version, result)
+        return result
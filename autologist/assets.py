@@ -0,0 +1,170 @@
+"""
+Сборка статики веб-интерфейса
+
+Встроенные в страницы frontend/*.html блоки <style> и <script> выносятся
+в отдельные файлы с хешем содержимого в имени (dashboard.3f2a9c1b7e.js),
+остальные файлы frontend копируются так же и ссылки на них в страницах
+переписываются. Результат лежит в frontend/dist:
+
+    *.html          страницы (имена не меняются, кэш с проверкой по ETag)
+    assets/         файлы с хешем в имени (кэш на год, immutable)
+    *.gz, *.br      заранее сжатые копии (brotli - если установлен пакет brotli)
+    manifest.json   исходное имя -> имя с хешем, ETag и сжатые варианты файлов
+
+Сборка детерминирована: одинаковые исходники дают одинаковые файлы и хеши.
+"""
+
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+FRONTEND_DIR = 'frontend'
+ASSETS_DIR = os.getenv('ASSETS_DIR', os.path.join(FRONTEND_DIR, 'dist'))
+MANIFEST_NAME = 'manifest.json'
+
+# Файлы меньше этого размера не сжимаются: выигрыш меньше накладных расходов
+MIN_COMPRESS_BYTES = 1024
+
+# Что сжимать заранее
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.map')
+
+INLINE_BLOCK_RE = re.compile(r'<(style|script)(\s[^>]*)?>(.*?)</\1>', re.DOTALL | re.IGNORECASE)
+REFERENCE_RE = re.compile(r'''(\b(?:src|href)\s*=\s*["'])([^"'#?]+)(["'])''', re.IGNORECASE)
+
+
+def content_hash(data, length=10):
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def fingerprinted_name(name, data):
+    """dashboard.js -> dashboard.<хеш>.js"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+
+def compress(path):
+    """Сжатые копии файла; возвращает список кодировок ('br', 'gzip')"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_BYTES or not path.endswith(COMPRESSIBLE):
+        return []
+    encodings = []
+    try:
+        import brotli
+
+        with open(f"{path}.br", 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+        encodings.append('br')
+    except ImportError:
+        pass
+    # mtime=0 - одинаковые исходники дают байт в байт одинаковый архив
+    with open(f"{path}.gz", 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    encodings.append('gzip')
+    return encodings
+
+
+class AssetBuilder:
+    """Сборка frontend -> frontend/dist"""
+
+    def __init__(self, source=FRONTEND_DIR, output=ASSETS_DIR):
+        self.source = source
+        self.output = output
+        self.assets = {}
+        self.files = {}
+
+    def _write_asset(self, name, data):
+        """Файл с хешем в имени в output/assets; возвращает URL"""
+        hashed = fingerprinted_name(name, data)
+        with open(os.path.join(self.output, 'assets', hashed), 'wb') as f:
+            f.write(data)
+        self.assets[name] = f"/assets/{hashed}"
+        return self.assets[name]
+
+    def _inline_replacement(self, page_stem, counter, match):
+        tag, attributes, body = match.group(1).lower(), match.group(2) or '', match.group(3)
+        # Внешние скрипты, JSON данные и пустые блоки остаются в странице
+        if tag == 'script' and ('src=' in attributes.lower() or 'type=' in attributes.lower()):
+            return match.group(0)
+        if not body.strip():
+            return match.group(0)
+        counter[tag] += 1
+        suffix = f"-{counter[tag]}" if counter[tag] > 1 else ''
+        ext = 'css' if tag == 'style' else 'js'
+        url = self._write_asset(f"{page_stem}{suffix}.{ext}", body.strip().encode('utf-8') + b'\n')
+        if tag == 'style':
+            return f'<link rel="stylesheet" href="{url}"{attributes}>'
+        return f'<script src="{url}"{attributes}></script>'
+
+    def _rewrite_references(self, match):
+        target = match.group(2)
+        url = self.assets.get(target.lstrip('/').replace('frontend/', '', 1))
+        return f"{match.group(1)}{url}{match.group(3)}" if url else match.group(0)
+
+    def build(self):
+        """Полная пересборка; возвращает манифест"""
+        if os.path.isdir(self.output):
+            shutil.rmtree(self.output)
+        os.makedirs(os.path.join(self.output, 'assets'))
+
+        pages = []
+        for name in sorted(os.listdir(self.source)):
+            path = os.path.join(self.source, name)
+            if not os.path.isfile(path):
+                continue
+            if name.endswith('.html'):
+                pages.append(name)
+                continue
+            with open(path, 'rb') as f:
+                self._write_asset(name, f.read())
+
+        for name in pages:
+            with open(os.path.join(self.source, name), 'r', encoding='utf-8') as f:
+                html = f.read()
+            counter = {'style': 0, 'script': 0}
+            stem = os.path.splitext(name)[0]
+            html = INLINE_BLOCK_RE.sub(lambda match: self._inline_replacement(stem, counter, match), html)
+            html = REFERENCE_RE.sub(self._rewrite_references, html)
+            data = html.encode('utf-8')
+            with open(os.path.join(self.output, name), 'wb') as f:
+                f.write(data)
+            self.files[name] = {}
+
+        for url in self.assets.values():
+            self.files[url.lstrip('/')] = {}
+        for name, info in self.files.items():
+            path = os.path.join(self.output, name)
+            with open(path, 'rb') as f:
+                info['etag'] = content_hash(f.read(), 16)
+            info['encodings'] = compress(path)
+
+        manifest = {'assets': self.assets, 'files': self.files}
+        with open(os.path.join(self.output, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        logger.info(f"📦 Собрано страниц: {len(pages)}, файлов с хешем: {len(self.assets)} -> {self.output}")
+        return manifest
+
+
+def load_manifest(directory=ASSETS_DIR):
+    """Манифест сборки или None, если статика не собрана"""
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def choose_encoding(accept_encoding, available):
+    """Лучшая из заранее сжатых кодировок, которую принимает клиент: br, затем gzip"""
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')
+                if not part.strip().endswith(';q=0')}
+    for encoding in ('br', 'gzip'):
+        if encoding in available and encoding in accepted:
+            return encoding
+    return None
@@ -0,0 +1,135 @@
+"""
+Запись входящего потока сообщений для последующего воспроизведения
+
+При PARSER_CAPTURE=true парсер пишет каждое сообщение отслеживаемых чатов
+(до фильтра по ключевым словам) строкой JSON в сжатый gzip сегмент
+data/capture/capture_<время>_<номер>.jsonl.gz: чат, отправитель, текст,
+время публикации и время получения. Сегмент закрывается после
+CAPTURE_SEGMENT_MESSAGES сообщений или через CAPTURE_SEGMENT_SECONDS.
+
+Читатель выдает записи всех сегментов по порядку; оборванный при падении
+хвост gzip сегмента пропускается.
+"""
+
+import os
+import glob
+import gzip
+import json
+import time
+import zlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+from autologist.timebuckets import json_default, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_DIR = os.getenv('CAPTURE_DIR', 'data/capture')
+CAPTURE_SEGMENT_MESSAGES = int(os.getenv('CAPTURE_SEGMENT_MESSAGES', '10000'))
+CAPTURE_SEGMENT_SECONDS = int(os.getenv('CAPTURE_SEGMENT_SECONDS', '3600'))
+
+SEGMENT_PATTERN = 'capture_*.jsonl.gz'
+
+
+def capture_record(chat, message, sender=None, received_at=None):
+    """
+    Запись о сообщении Telethon: только то, что нужно для воспроизведения.
+    sender - результат await message.get_sender(): message.sender до этого часто пуст.
+    """
+    return {
+        'chat_id': getattr(chat, 'id', None),
+        'chat_title': getattr(chat, 'title', None),
+        'megagroup': bool(getattr(chat, 'megagroup', False)),
+        'broadcast': bool(getattr(chat, 'broadcast', False)),
+        'message_id': message.id,
+        'sender_id': message.sender_id,
+        'sender_username': getattr(sender, 'username', None),
+        'sender_first_name': getattr(sender, 'first_name', None),
+        'sender_last_name': getattr(sender, 'last_name', None),
+        'sender_title': getattr(sender, 'title', None),
+        'text': message.text,
+        'date': message.date,
+        'received_at': received_at or datetime.now(timezone.utc)
+    }
+
+
+class CaptureWriter:
+    """Сжатые сегменты входящих сообщений"""
+
+    def __init__(self, directory=CAPTURE_DIR, segment_messages=CAPTURE_SEGMENT_MESSAGES,
+                 segment_seconds=CAPTURE_SEGMENT_SECONDS):
+        self.directory = directory
+        self.segment_messages = segment_messages
+        self.segment_seconds = segment_seconds
+        self._file = None
+        self._count = 0
+        self._opened_at = 0.0
+        self._number = 0
+        self._lock = threading.Lock()
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        self._number += 1
+        name = f"capture_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}_{self._number:04d}.jsonl.gz"
+        self.path = os.path.join(self.directory, name)
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._count = 0
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            logger.info(f"📼 Сегмент записи закрыт: {self.path} ({self._count} сообщений)")
+        self._file = None
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=json_default) + '\n'
+        with self._lock:
+            if self._file is not None and (self._count >= self.segment_messages or
+                                           time.monotonic() - self._opened_at >= self.segment_seconds):
+                self._close()
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._count += 1
+            self.total += 1
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def capture_segments(path=CAPTURE_DIR):
+    """Файлы сегментов: путь к папке, к файлу или glob шаблон"""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, SEGMENT_PATTERN)))
+    return sorted(glob.glob(path))
+
+
+def read_segment(path):
+    """Записи одного сегмента; оборванный хвост пропускается"""
+    records = []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    records.append(json.loads(line))
+    except (EOFError, zlib.error, OSError) as e:
+        logger.warning(f"⚠️  Сегмент {path} оборван, прочитано {len(records)} записей: {e}")
+    return records
+
+
+def iter_capture(path=CAPTURE_DIR, since=None, until=None):
+    """Записи всех сегментов по времени получения; since / until - границы по received_at"""
+    for segment in capture_segments(path):
+        records = read_segment(segment)
+        records.sort(key=lambda record: record.get('received_at') or '')
+        for record in records:
+            received_at = parse_timestamp(record.get('received_at'))
+            if since is not None and (received_at is None or received_at < since):
+                continue
+            if until is not None and (received_at is None or received_at >= until):
+                continue
+            yield record
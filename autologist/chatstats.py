@@ -0,0 +1,187 @@
+"""
+Статистика по чатам: сколько сообщений приходит и сколько из них сохраняется
+
+Парсер учитывает каждое текстовое сообщение отслеживаемого чата с исходом
+saved (сохранено), filtered (нет ключевых слов) или duplicate. Приращения
+копятся в памяти и сбрасываются вместе со статистикой грузов в компактный
+документ на чат (chat_stats/{chat_id}):
+
+    total, saved, filtered, duplicate       счетчики за все время
+    days.{2025-10-30}.{total|saved|...}     по дням за CHAT_STATS_DAYS дней
+    last_message_at, last_message           время и начало последнего сообщения
+    last_saved_at                           время последнего сохраненного
+
+API /api/chats читает документы всех чатов одним get_all, так что видно,
+какие чаты приносят заявки, а какие только шум, без подсчета сообщений
+запросами по каждому чату.
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from autologist.rollups import merge_counts
+from autologist.sharding import canonical_chat_id
+from autologist.timebuckets import day_bucket, json_default, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CHAT_STATS_COLLECTION = 'chat_stats'
+
+# Сколько дней хранить дневные счетчики в документе чата
+CHAT_STATS_DAYS = int(os.getenv('CHAT_STATS_DAYS', '30'))
+
+OUTCOMES = ('saved', 'filtered', 'duplicate')
+
+# Длина начала последнего сообщения в документе
+PREVIEW_CHARS = 140
+
+
+def expired_days(today, days=CHAT_STATS_DAYS, span=7):
+    """Дни сразу за границей хранения: их счетчики удаляются при сбросе"""
+    today = date.fromisoformat(today)
+    return [(today - timedelta(days=days + offset)).isoformat() for offset in range(span)]
+
+
+class FirestoreChatStatsStore:
+    """Документы chat_stats/{chat_id}"""
+
+    def __init__(self, db, collection=CHAT_STATS_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def apply(self, updates):
+        """Приращения и последние сообщения: {chat_id: (counts, latest)} одним batch"""
+        from google.cloud.firestore import DELETE_FIELD, Increment, SERVER_TIMESTAMP
+
+        def to_increments(counts):
+            return {key: to_increments(value) if isinstance(value, dict) else Increment(value)
+                    for key, value in counts.items()}
+
+        batch = self.db.batch()
+        for chat_id, (counts, latest) in updates.items():
+            data = to_increments(counts)
+            data.update(latest)
+            data['chat_id'] = chat_id
+            data['updated_at'] = SERVER_TIMESTAMP
+            # Каждая запись содержит день сообщения: старые дни удаляются по самому новому из них
+            for day in expired_days(max(counts['days'])):
+                data['days'][day] = DELETE_FIELD
+            batch.set(self.db.collection(self.collection).document(chat_id), data, merge=True)
+        batch.commit()
+
+    def get_many(self, chat_ids):
+        refs = [self.db.collection(self.collection).document(canonical_chat_id(chat_id)) for chat_id in chat_ids]
+        return {snapshot.id: snapshot.to_dict() for snapshot in self.db.get_all(refs) if snapshot.exists}
+
+
+class LocalChatStatsStore:
+    """Статистика чатов в локальном JSON файле (режим без Firestore)"""
+
+    def __init__(self, path='data/chat_stats.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def apply(self, updates):
+        with self._lock:
+            docs = self._load()
+            for chat_id, (counts, latest) in updates.items():
+                doc = docs.setdefault(chat_id, {'chat_id': chat_id})
+                merge_counts(doc, counts)
+                doc.update(latest)
+                if doc.get('days'):
+                    cutoff = (date.fromisoformat(max(doc['days'])) - timedelta(days=CHAT_STATS_DAYS)).isoformat()
+                    doc['days'] = {day: value for day, value in doc['days'].items() if day > cutoff}
+                doc['updated_at'] = datetime.now(timezone.utc).isoformat()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(docs, f, ensure_ascii=False, default=json_default)
+            os.replace(tmp_path, self.path)
+
+    def get_many(self, chat_ids):
+        docs = self._load()
+        keys = [canonical_chat_id(chat_id) for chat_id in chat_ids]
+        return {key: docs[key] for key in keys if key in docs}
+
+
+class ChatStatsEngine:
+    """Накопление приращений по чатам в памяти и периодический сброс в хранилище"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, chat, message, outcome, title=None):
+        """Учет текстового сообщения отслеживаемого чата с исходом из OUTCOMES"""
+        chat_id = canonical_chat_id(getattr(chat, 'id', chat))
+        sent_at = parse_timestamp(message.date) or datetime.now(timezone.utc)
+        day = day_bucket(sent_at)
+        counts = {'total': 1, outcome: 1, 'days': {day: {'total': 1, outcome: 1}}}
+        with self._lock:
+            pending_counts, latest = self._pending.setdefault(chat_id, ({}, {}))
+            merge_counts(pending_counts, counts)
+            title = title or getattr(chat, 'title', None)
+            if title:
+                latest['title'] = title
+            if not latest.get('last_message_at') or sent_at >= latest['last_message_at']:
+                latest['last_message_at'] = sent_at
+                latest['last_message'] = (message.text or '')[:PREVIEW_CHARS]
+            if outcome == 'saved' and (not latest.get('last_saved_at') or sent_at >= latest['last_saved_at']):
+                latest['last_saved_at'] = sent_at
+
+    def pending(self):
+        """Сколько чатов ждет сброса"""
+        return len(self._pending)
+
+    def flush(self):
+        """Запись накопленных приращений; при ошибке они возвращаются в очередь"""
+        with self._lock:
+            updates, self._pending = self._pending, {}
+        if not updates:
+            return 0
+        try:
+            self.store.apply(updates)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи статистики чатов: {e}")
+            with self._lock:
+                for chat_id, (counts, latest) in updates.items():
+                    pending_counts, pending_latest = self._pending.setdefault(chat_id, ({}, {}))
+                    merge_counts(pending_counts, counts)
+                    for key, value in latest.items():
+                        pending_latest.setdefault(key, value)
+            return 0
+        return len(updates)
+
+
+def chat_summary(doc, days=7, today=None):
+    """Ответ API по документу чата: счетчики, доля сохраненных и последние дни"""
+    doc = doc or {}
+    today = date.fromisoformat(today or day_bucket(datetime.now(timezone.utc)))
+    per_day = doc.get('days') or {}
+    recent = []
+    for offset in reversed(range(days)):
+        day = (today - timedelta(days=offset)).isoformat()
+        counts = per_day.get(day) or {}
+        recent.append({'day': day, **{key: counts.get(key, 0) for key in ('total',) + OUTCOMES}})
+    total = doc.get('total', 0)
+    recent_total = sum(item['total'] for item in recent)
+    return {
+        'total': total,
+        **{outcome: doc.get(outcome, 0) for outcome in OUTCOMES},
+        'save_rate': round(doc.get('saved', 0) / total, 3) if total else None,
+        'messages_per_day': round(recent_total / days, 1),
+        'saved_per_day': round(sum(item['saved'] for item in recent) / days, 1),
+        'days': recent,
+        'last_message_at': doc.get('last_message_at'),
+        'last_saved_at': doc.get('last_saved_at')
+    }
@@ -0,0 +1,215 @@
+"""
+Индекс контактов: телефон отправителя груза -> его объявления
+
+Один и тот же грузовладелец пишет с разных аккаунтов в разные чаты, но
+оставляет один телефон. При сохранении сообщения парсер записывает для
+каждого телефона (E.164) документ contacts/{телефон} со счетчиком и временем
+последнего объявления и запись contacts/{телефон}/messages/{hash} с кратким
+содержимым заявок. "Все объявления этого отправителя за неделю" - это один
+запрос к подколлекции по timestamp (одиночный индекс создается автоматически),
+без сканирования сообщений.
+
+Как и статистика, записи копятся в памяти и сбрасываются частями по
+MAX_BATCH_SIZE // 2, каждая - одной транзакцией. Счетчики идемпотентны:
+сообщение засчитывается только при создании его записи messages/{hash}, так
+что повторный сброс той же части (после ошибки) или повторная обработка
+сообщения их не увеличивают, а last_seen не сдвигается назад.
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+
+from autologist.migration import MAX_BATCH_SIZE, chunked
+from autologist.timebuckets import json_default, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CONTACTS_COLLECTION = 'contacts'
+CONTACT_MESSAGES = 'messages'
+
+# Сколько символов текста хранить в записи индекса
+EXCERPT_LENGTH = 300
+
+
+def cargo_ids(message_hash, cargos):
+    """Идентификаторы заявок сообщения: hash:номер"""
+    return [f"{message_hash}:{i}" for i in range(len(cargos or []))]
+
+
+def is_newer(timestamp, last_seen):
+    """Время записи позже last_seen контакта (или его еще нет)"""
+    timestamp, last_seen = parse_timestamp(timestamp), parse_timestamp(last_seen)
+    return timestamp is not None and (last_seen is None or timestamp > last_seen)
+
+
+def contact_entry(message_data):
+    """Запись индекса по сохраненному сообщению"""
+    cargos = message_data.get('cargos') or []
+    return {
+        'message_hash': message_data.get('hash'),
+        'cargo_ids': cargo_ids(message_data.get('hash'), cargos),
+        'chat_id': message_data.get('chat_id'),
+        'chat_title': message_data.get('chat_title'),
+        'sender_id': message_data.get('sender_id'),
+        'sender_username': message_data.get('sender_username'),
+        'timestamp': message_data.get('timestamp'),
+        'text': (message_data.get('text') or '')[:EXCERPT_LENGTH],
+        'routes': [f"{c['from_city']} → {c['to_city']}" for c in cargos if c.get('from_city') and c.get('to_city')]
+    }
+
+
+class FirestoreContactStore:
+    """Индекс в коллекции contacts с подколлекцией messages"""
+
+    def __init__(self, db, collection=CONTACTS_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def apply(self, entries):
+        """
+        entries: [(телефон, запись)], не больше MAX_BATCH_SIZE // 2 - одна транзакция.
+        Счетчики контакта растут только для hash, которых еще нет в messages.
+        """
+        from google.cloud.firestore import Increment, transactional
+
+        # Одно сообщение могло быть записано дважды до сброса: остается последняя запись
+        unique = {(phone, entry['message_hash']): entry for phone, entry in entries}
+        contacts = {phone: self.db.collection(self.collection).document(phone) for phone, _ in unique}
+        messages = {key: contacts[key[0]].collection(CONTACT_MESSAGES).document(key[1]) for key in unique}
+
+        @transactional
+        def write(transaction):
+            snapshots = {snapshot.reference.path: snapshot
+                         for snapshot in transaction.get_all(list(contacts.values()) + list(messages.values()))}
+            updates = {}
+            for key, entry in unique.items():
+                phone = key[0]
+                previous = snapshots[messages[key].path]
+                contact = snapshots[contacts[phone].path].to_dict() if snapshots[contacts[phone].path].exists else {}
+                change = updates.setdefault(phone, {'message_count': 0, 'cargo_count': 0,
+                                                    'last_seen': contact.get('last_seen')})
+                if previous.exists:
+                    # Повторная запись (например, после переобработки): обновляется содержимое,
+                    # число заявок - на разницу, число сообщений не меняется
+                    change['cargo_count'] += len(entry['cargo_ids']) - len(previous.get('cargo_ids') or [])
+                    transaction.set(messages[key], entry)
+                else:
+                    change['message_count'] += 1
+                    change['cargo_count'] += len(entry['cargo_ids'])
+                    transaction.create(messages[key], entry)
+                if is_newer(entry['timestamp'], change['last_seen']):
+                    change.update({'last_seen': entry['timestamp'], 'last_chat_id': entry['chat_id'], 'changed': True})
+            for phone, change in updates.items():
+                data = {'phone': phone}
+                if change['message_count']:
+                    data['message_count'] = Increment(change['message_count'])
+                if change['cargo_count']:
+                    data['cargo_count'] = Increment(change['cargo_count'])
+                if change.get('changed'):
+                    data.update({'last_seen': change['last_seen'], 'last_chat_id': change['last_chat_id']})
+                transaction.set(contacts[phone], data, merge=True)
+
+        write(self.db.transaction())
+
+    def lookup(self, phone, since=None, limit=100):
+        from google.cloud.firestore import Query
+
+        contact = self.db.collection(self.collection).document(phone)
+        snapshot = contact.get()
+        if not snapshot.exists:
+            return None, []
+        query = contact.collection(CONTACT_MESSAGES)
+        if since is not None:
+            query = query.where('timestamp', '>=', since)
+        query = query.order_by('timestamp', direction=Query.DESCENDING).limit(limit)
+        return snapshot.to_dict(), [doc.to_dict() for doc in query.stream()]
+
+
+class LocalContactStore:
+    """Индекс в локальном JSON файле (режим без Firestore)"""
+
+    def __init__(self, path='data/contacts.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, contacts):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(contacts, f, ensure_ascii=False, default=json_default)
+        os.replace(tmp_path, self.path)
+
+    def apply(self, entries):
+        with self._lock:
+            contacts = self._load()
+            for phone, entry in entries:
+                contact = contacts.setdefault(phone, {'phone': phone, 'message_count': 0, 'cargo_count': 0,
+                                                      'messages': {}})
+                previous = contact['messages'].get(entry['message_hash'])
+                if previous is None:
+                    contact['message_count'] += 1
+                    contact['cargo_count'] += len(entry['cargo_ids'])
+                else:
+                    contact['cargo_count'] += len(entry['cargo_ids']) - len(previous.get('cargo_ids') or [])
+                contact['messages'][entry['message_hash']] = json.loads(json.dumps(entry, default=json_default))
+                if is_newer(entry['timestamp'], contact.get('last_seen')):
+                    contact['last_seen'] = json_default(parse_timestamp(entry['timestamp']))
+                    contact['last_chat_id'] = entry['chat_id']
+            self._save(contacts)
+
+    def lookup(self, phone, since=None, limit=100):
+        contact = self._load().get(phone)
+        if contact is None:
+            return None, []
+        messages = sorted(contact.pop('messages').values(),
+                          key=lambda entry: parse_timestamp(entry['timestamp']) or datetime.min.replace(
+                              tzinfo=timezone.utc), reverse=True)
+        if since is not None:
+            messages = [m for m in messages if (parse_timestamp(m['timestamp']) or since) >= since]
+        return contact, messages[:limit]
+
+
+class ContactIndex:
+    """Накопление записей индекса в памяти и периодический сброс в хранилище"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def record(self, message_data, phones):
+        """Учет сохраненного сообщения для каждого найденного в нем телефона"""
+        if not phones or not message_data.get('hash'):
+            return
+        entry = contact_entry(message_data)
+        with self._lock:
+            self._pending.extend((phone, entry) for phone in phones)
+
+    def pending(self):
+        """Сколько записей ждет сброса"""
+        return len(self._pending)
+
+    def flush(self):
+        """Запись накопленных записей частями; при ошибке в очередь возвращаются незаписанные части"""
+        with self._lock:
+            entries, self._pending = self._pending, []
+        written = 0
+        for chunk in chunked(entries, MAX_BATCH_SIZE // 2):
+            try:
+                self.store.apply(chunk)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи индекса контактов: {e}")
+                with self._lock:
+                    self._pending = entries[written:] + self._pending
+                return written
+            written += len(chunk)
+        return written
@@ -0,0 +1,253 @@
+"""
+Дедупликация сообщений: фильтр Блума перед хранилищем
+
+Дубликат - сообщение с тем же hash, сохраненное за последние
+DUPLICATE_THRESHOLD_HOURS. Прежний парсер спрашивал Firestore о каждом
+сообщении, а v2 держал все hash в памяти без ограничения и терял их при
+перезапуске. Почти все сообщения новые, поэтому сначала проверяется
+фильтр Блума в памяти:
+
+    нет в фильтре     -> точно новое, к хранилищу не обращаемся
+    есть в фильтре    -> возможно дубликат: проверка по точному списку
+                         только что сохраненных (еще в спуле) и по документу
+                         messages/{hash} в Firestore (или data/messages)
+
+Фильтр разбит на партиции по времени (RotatingBloomFilter): новые hash
+пишутся в текущую, раз в window / partitions часов открывается новая, а
+самая старая выбрасывается - память не растет, а hash старше окна
+забываются сами. Размер партиции считается по ожидаемому числу сохранений
+в сутки и целевой доле ложных срабатываний. При старте фильтр заполняется
+hash сообщений за окно одним запросом к хранилищу.
+"""
+
+import os
+import math
+import glob
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from autologist.sharding import DEDUP_TTL_HOURS
+from autologist.timebuckets import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+DEDUP_EXPECTED_PER_DAY = int(os.getenv('DEDUP_EXPECTED_PER_DAY', '50000'))
+DEDUP_FALSE_POSITIVE = float(os.getenv('DEDUP_FALSE_POSITIVE', '0.01'))
+DEDUP_BLOOM_PARTITIONS = int(os.getenv('DEDUP_BLOOM_PARTITIONS', '4'))
+
+# Сколько только что сохраненных hash помнить точно (пока они в спуле, хранилище их не знает)
+DEDUP_PENDING_MAX = 10000
+
+
+def bloom_parameters(capacity, error_rate):
+    """Число бит и хеш-функций для capacity элементов с долей ложных срабатываний error_rate"""
+    bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+    hashes = max(1, int(round(bits / capacity * math.log(2))))
+    return bits, hashes
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.bits, self.hashes = bloom_parameters(capacity, error_rate)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного дайджеста
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RotatingBloomFilter:
+    """
+    Фильтр за скользящее окно: partitions + 1 партиций по window / partitions.
+    Запрос проверяет все партиции, поэтому доля ложных срабатываний каждой
+    делится на их число; ключ добавляется в партицию своего времени (обычно текущую).
+    """
+
+    def __init__(self, expected_per_day=DEDUP_EXPECTED_PER_DAY, error_rate=DEDUP_FALSE_POSITIVE,
+                 window_hours=DEDUP_TTL_HOURS, partitions=DEDUP_BLOOM_PARTITIONS, clock=None):
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.slot = timedelta(hours=window_hours) / partitions
+        self.live = partitions + 1
+        self.capacity = max(1, int(math.ceil(expected_per_day * window_hours / 24 / partitions)))
+        self.error_rate = error_rate / self.live
+        self.generations = []
+        self._lock = threading.Lock()
+
+    def _current(self):
+        now = self.clock()
+        if not self.generations:
+            # Партиции на все окно сразу: заполнение при старте раскладывает hash по времени
+            self.generations = [(now - self.slot * offset, BloomFilter(self.capacity, self.error_rate))
+                                for offset in range(self.live - 1, -1, -1)]
+        elif now - self.generations[-1][0] >= self.slot:
+            start = self.generations[-1][0] + self.slot * ((now - self.generations[-1][0]) // self.slot)
+            self.generations.append((start, BloomFilter(self.capacity, self.error_rate)))
+            del self.generations[:-self.live]
+        return self.generations[-1][1]
+
+    def add(self, key, at=None):
+        """Добавить ключ; at - время события (по умолчанию сейчас) выбирает партицию"""
+        with self._lock:
+            bloom = self._current()
+            if at is not None:
+                bloom = next((generation for start, generation in reversed(self.generations) if start <= at),
+                             self.generations[0][1])
+            bloom.add(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._current()
+            return any(key in bloom for _, bloom in self.generations)
+
+    def memory_bytes(self):
+        return sum(len(bloom.array) for _, bloom in self.generations)
+
+    def __len__(self):
+        return sum(bloom.count for _, bloom in self.generations)
+
+
+class FirestoreMessageLookup:
+    """Точная проверка по документу messages/{hash} (id документа - hash)"""
+
+    def __init__(self, db, collection='messages'):
+        self.db = db
+        self.collection = collection
+
+    def saved_at(self, message_hash):
+        snapshot = self.db.collection(self.collection).document(message_hash).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        return parse_timestamp(data.get('created_at') or data.get('timestamp'))
+
+    def recent(self, since):
+        """(hash, время сохранения) сообщений после since - заполнение фильтра при старте"""
+        query = self.db.collection(self.collection).where('created_at', '>=', since).select(['hash', 'created_at'])
+        return [(snapshot.to_dict().get('hash') or snapshot.id, parse_timestamp(snapshot.to_dict().get('created_at')))
+                for snapshot in query.stream()]
+
+
+class LocalMessageLookup:
+    """Точная проверка по data/messages/*_{hash[:8]}.json"""
+
+    def __init__(self, directory='data/messages'):
+        self.directory = directory
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def saved_at(self, message_hash):
+        for path in glob.glob(os.path.join(self.directory, f"*{message_hash[:8]}.json")):
+            data = self._read(path)
+            if data and data.get('hash') == message_hash:
+                return parse_timestamp(data.get('created_at') or data.get('timestamp'))
+        return None
+
+    def recent(self, since):
+        hashes = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+            if modified < since:
+                continue
+            data = self._read(path)
+            if data and data.get('hash'):
+                hashes.append((data['hash'], modified))
+        return hashes
+
+
+class DuplicateFilter:
+    """
+    Фильтр Блума + точная проверка возможных дубликатов.
+    lookup=None - без хранилища (бенчмарк, воспроизведение): точная проверка
+    только по недавно сохраненным hash.
+    """
+
+    def __init__(self, lookup=None, window_hours=DEDUP_TTL_HOURS, clock=None, **bloom_options):
+        self.lookup = lookup
+        self.window = timedelta(hours=window_hours)
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.bloom = RotatingBloomFilter(window_hours=window_hours, clock=self.clock, **bloom_options)
+        self.pending = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'checked': 0, 'definitely_new': 0, 'lookups': 0, 'duplicates': 0, 'false_positives': 0,
+                      'lookup_errors': 0}
+
+    def might_contain(self, message_hash):
+        """Быстрая проверка в памяти: False - сообщение точно новое"""
+        self.stats['checked'] += 1
+        if message_hash in self.bloom:
+            return True
+        self.stats['definitely_new'] += 1
+        return False
+
+    def confirm(self, message_hash):
+        """Точная проверка возможного дубликата (блокирующая: обращение к хранилищу)"""
+        self.stats['lookups'] += 1
+        cutoff = self.clock() - self.window
+        with self._lock:
+            saved_at = self.pending.get(message_hash)
+        if saved_at is None and self.lookup is not None:
+            try:
+                saved_at = self.lookup.saved_at(message_hash)
+            except Exception as e:
+                # Как и прежде: при недоступном хранилище сообщение считается новым
+                self.stats['lookup_errors'] += 1
+                logger.warning(f"⚠️  Проверка дубликата {message_hash[:8]} не удалась: {e}")
+                saved_at = None
+        if saved_at is not None and saved_at >= cutoff:
+            self.stats['duplicates'] += 1
+            return True
+        self.stats['false_positives'] += 1
+        return False
+
+    def add(self, message_hash):
+        """Отметить сохраненное сообщение"""
+        self.bloom.add(message_hash)
+        with self._lock:
+            self.pending[message_hash] = self.clock()
+            self.pending.move_to_end(message_hash)
+            while len(self.pending) > DEDUP_PENDING_MAX:
+                self.pending.popitem(last=False)
+
+    def discard(self, message_hash):
+        """
+        Сохранение не удалось: hash убирается из точного списка. Из фильтра
+        Блума его не удалить, но точная проверка его уже не подтвердит.
+        """
+        with self._lock:
+            self.pending.pop(message_hash, None)
+
+    def warm(self):
+        """Заполнить фильтр hash сообщений за окно; возвращает их число"""
+        if self.lookup is None:
+            return 0
+        hashes = self.lookup.recent(self.clock() - self.window)
+        for message_hash, saved_at in hashes:
+            self.bloom.add(message_hash, saved_at)
+        logger.info(f"🧮 Фильтр дубликатов: {len(hashes)} сообщений за {self.window}, "
+                    f"{self.bloom.memory_bytes() // 1024} КБ")
+        return len(hashes)
+
+    def __len__(self):
+        return len(self.bloom)
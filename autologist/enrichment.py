@@ -0,0 +1,280 @@
+"""
+Дообработка заявок через ИИ (Gemini)
+
+Правиловый извлекатель (autologist.extraction) разбирает большинство
+объявлений. В ИИ отправляются только сообщения, где он не нашел ни одной
+заявки или в заявках не хватает обязательных полей. Такие сообщения
+группируются по ENRICHMENT_BATCH_SIZE в один запрос, запросы выполняются
+не более чем в ENRICHMENT_CONCURRENCY потоков, а ответы кэшируются по хешу
+нормализованного текста - повторные публикации одного объявления
+обрабатываются бесплатно.
+
+Бэкенд подключаемый: GeminiBackend ходит в Google AI, StubBackend
+детерминированно отвечает без сети (для тестов и разработки).
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from autologist.extraction import REQUIRED_FIELDS, extract_cargos
+from autologist.migration import chunked
+from autologist.normalize import normalize_text
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_BATCH_SIZE = int(os.getenv('ENRICHMENT_BATCH_SIZE', '20'))
+ENRICHMENT_CONCURRENCY = int(os.getenv('ENRICHMENT_CONCURRENCY', '2'))
+# После стольких неудачных запросов к модели сообщение остается с заявками правил
+ENRICHMENT_MAX_ATTEMPTS = int(os.getenv('ENRICHMENT_MAX_ATTEMPTS', '5'))
+CACHE_COLLECTION = 'enrichment_cache'
+
+# Максимальная длина одного сообщения в запросе
+MAX_MESSAGE_CHARS = 1500
+
+CARGO_FIELDS = ('from_city', 'to_city', 'cargo_type', 'weight_tons', 'volume_m3', 'price', 'currency')
+NUMERIC_FIELDS = ('weight_tons', 'volume_m3', 'price')
+
+PROMPT_HEADER = """Ты разбираешь объявления о грузоперевозках из Telegram.
+Для каждого сообщения верни список заявок (в одном сообщении может быть несколько маршрутов).
+Поля заявки: from_city, to_city, cargo_type, weight_tons (число, тонны), volume_m3 (число),
+price (число), currency (USD, KZT или RUB). Неизвестное поле - null.
+Ответ - только JSON массив без пояснений: [{"id": "<id сообщения>", "cargos": [{...}]}]
+
+Сообщения:
+"""
+
+
+def text_key(text):
+    """Ключ кэша: хеш нормализованного текста (эмодзи, пробелы и регистр не влияют)"""
+    return hashlib.md5(normalize_text(text or '').dedup_key().encode()).hexdigest()
+
+
+def needs_enrichment(cargos):
+    """Правила не нашли заявок или нашли неполные"""
+    return not cargos or any(cargo.get('missing') for cargo in cargos)
+
+
+def build_prompt(items):
+    """Запрос для пачки сообщений: items - [(id, текст)]"""
+    parts = [PROMPT_HEADER]
+    for item_id, text in items:
+        parts.append(f"### id: {item_id}\n{normalize_text(text).clean[:MAX_MESSAGE_CHARS]}\n")
+    return '\n'.join(parts)
+
+
+def parse_response(text):
+    """{id: [заявки]} из ответа модели; допускает обрамление ```json"""
+    match = re.search(r'\[.*\]', text or '', re.DOTALL)
+    if not match:
+        raise ValueError('В ответе нет JSON массива')
+    result = {}
+    for item in json.loads(match.group(0)):
+        if isinstance(item, dict) and item.get('id') is not None:
+            result[str(item['id'])] = [clean_cargo(cargo) for cargo in item.get('cargos') or []
+                                       if isinstance(cargo, dict)]
+    return result
+
+
+def _to_number(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = re.search(r'\d+(?:[.,]\d+)?', str(value).replace(' ', ''))
+    return float(match.group(0).replace(',', '.')) if match else None
+
+
+def clean_cargo(cargo):
+    """Заявка из ответа модели в формате extract_cargos"""
+    result = {field: cargo.get(field) or None for field in CARGO_FIELDS}
+    for field in NUMERIC_FIELDS:
+        result[field] = _to_number(result[field])
+    result['price_negotiable'] = bool(cargo.get('price_negotiable')) and result['price'] is None
+    result['missing'] = [field for field in REQUIRED_FIELDS if result[field] is None]
+    return result
+
+
+def merge_cargos(rule_cargos, llm_cargos):
+    """
+    Заявки правил, дополненные ответом модели: пустые поля заполняются по порядку заявок.
+    Если правила ничего не нашли - берутся заявки модели.
+    """
+    if not rule_cargos:
+        return [dict(cargo, source='llm') for cargo in llm_cargos]
+    merged = []
+    for i, cargo in enumerate(rule_cargos):
+        cargo = dict(cargo)
+        llm_cargo = llm_cargos[i] if i < len(llm_cargos) else {}
+        filled = [field for field in CARGO_FIELDS if cargo.get(field) is None and llm_cargo.get(field) is not None]
+        for field in filled:
+            cargo[field] = llm_cargo[field]
+        cargo['missing'] = [field for field in REQUIRED_FIELDS if cargo.get(field) is None]
+        if filled:
+            cargo['source'] = 'rules+llm'
+        merged.append(cargo)
+    return merged
+
+
+class GeminiBackend:
+    """Запросы к Gemini через google-generativeai"""
+
+    def __init__(self, api_key=None, model=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv('GEMINI_API_KEY'))
+        self.model = genai.GenerativeModel(model or os.getenv('GEMINI_MODEL', 'gemini-1.5-flash'))
+
+    def complete(self, prompt):
+        response = self.model.generate_content(prompt, generation_config={'temperature': 0})
+        return response.text
+
+
+class StubBackend:
+    """
+    Локальная замена модели без сети: отвечает в формате Gemini,
+    разбирая сообщения правилами. Детерминирована - удобна для тестов.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self, prompt):
+        with self._lock:
+            self.calls += 1
+        items = re.findall(r'^### id: (.+?)\n(.*?)(?=^### id: |\Z)', prompt, re.MULTILINE | re.DOTALL)
+        response = []
+        for item_id, text in items:
+            cargos = [{field: cargo[field] for field in CARGO_FIELDS} for cargo in extract_cargos(text)]
+            response.append({'id': item_id, 'cargos': cargos})
+        return '```json\n' + json.dumps(response, ensure_ascii=False) + '\n```'
+
+
+def backend_from_env():
+    """Бэкенд по ENRICHMENT_BACKEND: gemini (по умолчанию) или stub"""
+    if os.getenv('ENRICHMENT_BACKEND', 'gemini') == 'stub':
+        return StubBackend()
+    return GeminiBackend()
+
+
+class FirestoreEnrichmentCache:
+    """Кэш ответов модели в коллекции enrichment_cache"""
+
+    def __init__(self, db, collection=CACHE_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def get_many(self, keys):
+        refs = [self.db.collection(self.collection).document(key) for key in keys]
+        return {snapshot.id: snapshot.to_dict()['cargos'] for snapshot in self.db.get_all(refs) if snapshot.exists}
+
+    def put_many(self, results):
+        for chunk in chunked(list(results.items()), 500):
+            batch = self.db.batch()
+            for key, cargos in chunk:
+                batch.set(self.db.collection(self.collection).document(key), {'cargos': cargos})
+            batch.commit()
+
+
+class LocalEnrichmentCache:
+    """Кэш ответов модели в локальном JSON файле"""
+
+    def __init__(self, path='data/enrichment_cache.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get_many(self, keys):
+        cache = self._load()
+        return {key: cache[key] for key in keys if key in cache}
+
+    def put_many(self, results):
+        with self._lock:
+            cache = self._load()
+            cache.update(results)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+class Enricher:
+    """Пакетная дообработка сообщений с кэшем и ограничением параллельности"""
+
+    def __init__(self, backend, cache, batch_size=ENRICHMENT_BATCH_SIZE, concurrency=ENRICHMENT_CONCURRENCY):
+        self.backend = backend
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.stats = {'messages': 0, 'rules_complete': 0, 'cache_hits': 0, 'llm_messages': 0,
+                      'llm_calls': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def enrich(self, messages):
+        """
+        messages - [(id, текст, заявки правил)].
+        Возвращает ({id: заявки}, failed): заявки с дополненными полями для всех
+        сообщений и множество id, запрос к модели для которых не удался (для них -
+        заявки правил, сообщение нужно обработать позже).
+        """
+        results = {}
+        pending = {}
+        for message_id, text, cargos in messages:
+            self.stats['messages'] += 1
+            if not needs_enrichment(cargos):
+                self.stats['rules_complete'] += 1
+                results[message_id] = cargos
+            else:
+                pending.setdefault(text_key(text), []).append((message_id, text, cargos))
+
+        cached = self.cache.get_many(list(pending)) if pending else {}
+        self.stats['cache_hits'] += sum(len(pending[key]) for key in cached)
+
+        # Одинаковые тексты отправляются в модель один раз
+        to_request = [(key, group[0][1]) for key, group in pending.items() if key not in cached]
+        answers = dict(cached)
+        failed_keys = set()
+        if to_request:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                batches = list(chunked(to_request, self.batch_size))
+                for batch, batch_answers in zip(batches, executor.map(self._request, batches)):
+                    if batch_answers is None:
+                        failed_keys.update(key for key, _ in batch)
+                    else:
+                        answers.update(batch_answers)
+
+        failed = set()
+        for key, group in pending.items():
+            for message_id, _, cargos in group:
+                results[message_id] = merge_cargos(cargos, answers[key]) if key in answers else cargos
+                if key in failed_keys:
+                    failed.add(message_id)
+        return results, failed
+
+    def _request(self, batch):
+        """Один запрос к модели на пачку; ответ сохраняется в кэш. None - запрос не удался"""
+        try:
+            response = parse_response(self.backend.complete(build_prompt(batch)))
+        except Exception as e:
+            logger.error(f"❌ Ошибка запроса к ИИ для {len(batch)} сообщений: {e}")
+            with self._lock:
+                self.stats['llm_calls'] += 1
+                self.stats['failed'] += len(batch)
+            return None
+        answers = {key: response[key] for key, _ in batch if key in response}
+        if answers:
+            self.cache.put_many(answers)
+        with self._lock:
+            self.stats['llm_calls'] += 1
+            self.stats['llm_messages'] += len(batch)
+            self.stats['failed'] += len(batch) - len(answers)
+        return answers
@@ -0,0 +1,179 @@
+"""
+Кэш сущностей Telegram рядом с файлом сессии
+
+После перезапуска парсер заново запрашивал get_me, обходил все диалоги
+(discover_chats) и получал чат каждого пришедшего сообщения. Кэш хранит
+аккаунт и групповые чаты (access_hash, название, username, тип, число
+участников, последнее сообщение диалога) в autologist_session.entities.json
+рядом с autologist_session.session, поэтому после перезапуска:
+
+    - чаты пришедших сообщений берутся из кэша, без запросов к Telegram;
+    - обработчики подключаются сразу, а обход диалогов идет в фоне;
+    - обход инкрементальный: диалоги отсортированы по последнему сообщению,
+      и обход останавливается на первом незакрепленном диалоге, который
+      не изменился с прошлого раза. Полный обход (с удалением чатов, из
+      которых аккаунт вышел) - при пустом кэше и раз в ENTITY_FULL_WALK_HOURS.
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from autologist.sharding import canonical_chat_id
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_VERSION = 1
+
+# Как часто обходить все диалоги, а не только изменившиеся
+ENTITY_FULL_WALK_HOURS = float(os.getenv('ENTITY_FULL_WALK_HOURS', '24'))
+
+
+def entity_cache_path(session_name):
+    """Файл кэша рядом с файлом сессии Telethon"""
+    return os.getenv('ENTITY_CACHE_PATH') or f"{session_name}.entities.json"
+
+
+class CachedChat:
+    """Чат из кэша с атрибутами сущности Telethon, которые использует парсер"""
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.title = record.get('title')
+        self.username = record.get('username')
+        self.access_hash = record.get('access_hash')
+        self.megagroup = record.get('type') == 'megagroup'
+        self.broadcast = record.get('type') == 'channel'
+        self.participants_count = record.get('participants')
+
+
+def chat_record(entity, top_message=None):
+    """Запись кэша для группы или канала Telethon; None для пользователей"""
+    if not hasattr(entity, 'title'):
+        return None
+    if getattr(entity, 'broadcast', False):
+        chat_type = 'channel'
+    elif getattr(entity, 'megagroup', False):
+        chat_type = 'megagroup'
+    else:
+        chat_type = 'group'
+    return {
+        'id': entity.id,
+        'access_hash': getattr(entity, 'access_hash', None),
+        'title': entity.title,
+        'username': getattr(entity, 'username', None),
+        'type': chat_type,
+        'participants': getattr(entity, 'participants_count', None),
+        'top_message': top_message
+    }
+
+
+class EntityCache:
+    """
+    Аккаунт и чаты сессии; path=None - только в памяти (бенчмарк, воспроизведение).
+    Изменения сохраняются методом save(), если что-то поменялось.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.me = None
+        self.chats = {}
+        self.full_walk_at = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError as e:
+            logger.warning(f"⚠️  Кэш сущностей {self.path} поврежден, начинаем с пустого: {e}")
+            return
+        if data.get('version') != ENTITY_CACHE_VERSION:
+            return
+        self.me = data.get('me')
+        self.chats = data.get('chats', {})
+        self.full_walk_at = data.get('full_walk_at')
+        logger.info(f"🗂️  Кэш сущностей: {len(self.chats)} чатов из {self.path}")
+
+    def save(self):
+        """Атомарная запись файла, если кэш изменился"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return False
+            data = {'version': ENTITY_CACHE_VERSION, 'me': self.me, 'full_walk_at': self.full_walk_at,
+                    'chats': self.chats}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            return True
+
+    def set_me(self, user):
+        """Аккаунт сессии; если он сменился (новый вход), чаты прежнего аккаунта сбрасываются"""
+        me = {'id': user.id, 'first_name': getattr(user, 'first_name', None),
+              'username': getattr(user, 'username', None)}
+        with self._lock:
+            if self.me and self.me.get('id') != me['id']:
+                logger.info("🔄 Сессия принадлежит другому аккаунту: кэш чатов сброшен")
+                self.chats = {}
+                self.full_walk_at = None
+            if me != self.me:
+                self.me = me
+                self._dirty = True
+
+    def get(self, chat_id):
+        """Чат по ID в любом виде (-100..., -..., без префикса) или None"""
+        if chat_id is None:
+            return None
+        record = self.chats.get(canonical_chat_id(chat_id))
+        return CachedChat(record) if record else None
+
+    def remember(self, entity, top_message=None):
+        """
+        Добавить или обновить чат. Возвращает True, если чат уже был в кэше
+        с тем же последним сообщением и названием (диалог не менялся).
+        """
+        record = chat_record(entity, top_message)
+        if record is None:
+            return False
+        key = canonical_chat_id(record['id'])
+        with self._lock:
+            previous = self.chats.get(key)
+            if previous:
+                # Сущность из события бывает неполной ("min"): без числа участников и с
+                # access_hash, годным только в контексте сообщения - известное не затираем
+                for field, value in previous.items():
+                    if record.get(field) is None or (field == 'access_hash' and getattr(entity, 'min', False)):
+                        record[field] = value
+            unchanged = previous is not None and top_message is not None and \
+                previous.get('top_message') == top_message and previous.get('title') == record['title']
+            if previous != record:
+                self.chats[key] = record
+                self._dirty = True
+        return unchanged
+
+    def retain(self, chat_ids):
+        """После полного обхода: оставить только чаты, в которых аккаунт состоит"""
+        keep = {canonical_chat_id(chat_id) for chat_id in chat_ids}
+        with self._lock:
+            removed = [key for key in self.chats if key not in keep]
+            for key in removed:
+                del self.chats[key]
+            self.full_walk_at = datetime.now(timezone.utc).isoformat()
+            self._dirty = True
+        return removed
+
+    def needs_full_walk(self):
+        if not self.chats or not self.full_walk_at:
+            return True
+        last = datetime.fromisoformat(self.full_walk_at)
+        return datetime.now(timezone.utc) - last > timedelta(hours=ENTITY_FULL_WALK_HOURS)
@@ -0,0 +1,248 @@
+"""
+Правиловое извлечение параметров грузов из текста объявления
+
+Одно сообщение часто содержит несколько заявок ("Хоргос - Москва ...",
+"Алашанькоу - Алматы ..."), поэтому текст делится на блоки по строкам
+с маршрутом, и для каждого блока извлекаются маршрут, тип груза, вес,
+объем и ставка. Поля, которые не удалось найти, остаются None -
+такие заявки потом можно дообработать через ИИ.
+"""
+
+import re
+
+# Поля, которые должны быть у полностью разобранной заявки
+REQUIRED_FIELDS = ('from_city', 'to_city', 'cargo_type', 'weight_tons', 'price')
+
+# Максимум заявок из одного сообщения
+MAX_CARGOS_PER_MESSAGE = 20
+
+# Разделители маршрута (дефис обрабатывается отдельно из-за "Санкт-Петербург")
+ROUTE_ARROWS = re.compile(r'\s*(?:->|>>|=>|→|➡️?|▶️?|►|>|/|—|–|\s-\s|\s-|-\s)\s*')
+
+# Части составных названий городов, после которых дефис не является разделителем
+HYPHEN_PREFIXES = {'санкт', 'ростов', 'нур', 'усть', 'комсомольск', 'петропавловск',
+                   'улан', 'ханты', 'горно', 'йошкар', 'наро', 'каменск', 'соль', 'сан'}
+HYPHEN_SUFFIXES = {'на', 'дону', 'амуре', 'волге', 'илецк', 'султан', 'петербург', 'уде'}
+
+# Слова, которые не являются названиями мест
+PLACE_STOPWORDS = {
+    'нужен', 'нужна', 'нужны', 'нужно', 'груз', 'готов', 'тент', 'реф', 'тандем', 'площадка',
+    'погрузка', 'погр', 'выезд', 'выгрузка', 'растаможка', 'раст', 'кнр', 'рф', 'срочно',
+    'фрахт', 'фракт', 'вес', 'куб', 'экспорт', 'импорт', 'маршрут', 'оплата', 'цена', 'машин',
+    'машина', 'авто', 'керек', 'через', 'дата', 'загрузки', 'транспорт', 'стоянки', 'г',
+    'погрузкой', 'заезд', 'трал', 'борт', 'есть', 'свободные', 'ед', 'шт'
+}
+
+# Тип груза: префикс слова -> каноническое название
+CARGO_TYPES = [
+    ('оборуд', 'оборудование'), ('обород', 'оборудование'), ('хими', 'химия'),
+    ('сахар', 'сахар'), ('мебел', 'мебель'), ('продукт', 'продукты'), ('стройматериал', 'стройматериалы'),
+    ('металл', 'металлопрокат'), ('контейнер', 'контейнер'), ('одежд', 'одежда'), ('обув', 'одежда'),
+    ('виноград', 'фрукты'), ('фрукт', 'фрукты'), ('сухофрукт', 'фрукты'), ('овощ', 'овощи'),
+    ('запчаст', 'запчасти'), ('спецтехник', 'спецтехника'), ('матрас', 'матрасы'), ('насос', 'оборудование'),
+    ('лён', 'лён'), ('лен ', 'лён'), ('тнп', 'тнп'), ('хозто', 'тнп'), ('коробк', 'тнп'),
+    ('электроприбор', 'электроника'), ('автомоб', 'автомобили'), ('автовоз', 'автомобили'),
+    ('зерн', 'зерно'), ('пшениц', 'зерно'), ('уголь', 'уголь'), ('цемент', 'стройматериалы'),
+    ('кирпич', 'стройматериалы'), ('сырье', 'сырье'), ('сырьё', 'сырье'), ('трубы', 'металлопрокат'),
+]
+# Поиск по всему тексту: префикс только с начала слова ("Зелёная" - не лён);
+# пробел в конце префикса ('лен ') - слово целиком
+CARGO_TYPE_RES = [(re.compile(r'\b' + re.escape(prefix.strip()) + (r'\b' if prefix.endswith(' ') else '')),
+                   cargo_type) for prefix, cargo_type in CARGO_TYPES]
+
+NUMBER = r'\d+(?:[.,]\d+)?'
+WEIGHT_RE = re.compile(rf'({NUMBER})(?:\s*[-–/~]\s*({NUMBER}))?\s*(?:тонн\w*|тон\w*|тн|т|t)(?![а-яёa-z])',
+                       re.IGNORECASE)
+WEIGHT_KG_RE = re.compile(r'(\d{3,6})\s*кг', re.IGNORECASE)
+VOLUME_RE = re.compile(rf'({NUMBER})(?:\s*[-–/,]\s*({NUMBER}))*\s*(?:куб\w*|м3|м³|m3)', re.IGNORECASE)
+PRICE_PATTERNS = [
+    (re.compile(r'(\d{1,3}(?:[ ,.]\d{3})+|\d+)\s*(?:\$|usd|долл\w*|у\.е)', re.IGNORECASE), 'USD'),
+    (re.compile(r'\$\s*(\d{1,3}(?:[ ,.]\d{3})+|\d+)'), 'USD'),
+    (re.compile(r'(\d{1,3}(?:[ ,.]\d{3})+|\d+)\s*(?:тг|тенге|₸)', re.IGNORECASE), 'KZT'),
+    (re.compile(r'(\d{1,3}(?:[ ,.]\d{3})+|\d+)\s*(?:руб\w*|р\.|₽)', re.IGNORECASE), 'RUB'),
+    (re.compile(r'(\d+)\s*к(?:\s|$|,)', re.IGNORECASE), 'RUB_K'),
+]
+NEGOTIABLE_RE = re.compile(r'договор\w*|договоримся', re.IGNORECASE)
+ROUTE_WORDS_RE = re.compile(r'^(?:из|с|со|от)\s+(.+?)\s+(?:до|в|во|на)\s+(.+)$', re.IGNORECASE)
+CARGO_AFTER_WORD_RE = re.compile(r'груз\w*\s*[:\-—–]?\s*([а-яёa-z]+)', re.IGNORECASE)
+
+# Все, кроме букв, цифр, пробелов и знаков, значимых для маршрута и чисел
+CLEAN_RE = re.compile(r'[^\w\s\-–—>/→.,:$₸₽~()]')
+
+
+def _number(value):
+    """'4,900' / '21,8' / '2 300' -> float"""
+    value = value.replace(' ', '')
+    if re.fullmatch(r'\d{1,3}(?:[,.]\d{3})+', value):
+        value = value.replace(',', '').replace('.', '')
+    return float(value.replace(',', '.'))
+
+
+def clean_line(line):
+    """Удаление эмодзи и прочих символов, мешающих разбору"""
+    line = line.replace('➡️', '>').replace('➡', '>').replace('▶️', '>').replace('▶', '>')
+    line = CLEAN_RE.sub(' ', line)
+    return re.sub(r'\s+', ' ', line).strip(' .,:*')
+
+
+def _split_hyphens(segment):
+    """Разделение 'Хоргос-Москва' с сохранением 'Санкт-Петербург' и 'Ростов-на-Дону'"""
+    parts = segment.split('-')
+    result = [parts[0]]
+    for part in parts[1:]:
+        left = result[-1].strip().split(' ')[-1].lower() if result[-1].strip() else ''
+        right = part.strip().split(' ')[0].lower() if part.strip() else ''
+        if left in HYPHEN_PREFIXES or left in HYPHEN_SUFFIXES or right in HYPHEN_SUFFIXES:
+            result[-1] = f"{result[-1]}-{part}"
+        else:
+            result.append(part)
+    return result
+
+
+def clean_place(segment):
+    """Название места из сегмента маршрута или None"""
+    segment = re.sub(r'\(.*?\)', ' ', segment)
+    words = []
+    for word in segment.replace(',', ' ').split():
+        if any(ch.isdigit() for ch in word):
+            break
+        word = word.strip('.:*')
+        if not word:
+            continue
+        if word.lower() in PLACE_STOPWORDS:
+            if words:
+                break
+            continue
+        words.append(word)
+        if len(words) == 3:
+            break
+    if not words or not words[0][:1].isalpha():
+        return None
+    place = ' '.join(words)
+    if len(place) < 3:
+        return None
+    return '-'.join(part.lower() if part.lower() == 'на' else part[:1].upper() + part[1:].lower()
+                    for part in place.split('-'))
+
+
+def parse_route(line):
+    """Маршрут (откуда, куда) из строки или None"""
+    line = clean_line(line)
+    if not line:
+        return None
+    match = ROUTE_WORDS_RE.match(line)
+    if match:
+        origin, destination = clean_place(match.group(1)), clean_place(match.group(2))
+        if origin and destination:
+            return origin, destination
+    segments = []
+    for segment in ROUTE_ARROWS.split(line):
+        segments.extend(_split_hyphens(segment))
+    places = [clean_place(segment) for segment in segments if segment.strip()]
+    if len(places) < 2 or places[0] is None:
+        return None
+    # Промежуточные точки (растаможка, выгрузка) пропускаем: берем первую и последнюю
+    destination = next((place for place in reversed(places[1:]) if place), None)
+    if destination is None or destination == places[0]:
+        return None
+    return places[0], destination
+
+
+def parse_weight(text):
+    """Вес в тоннах (для диапазона - верхняя граница)"""
+    match = WEIGHT_RE.search(text)
+    if match:
+        values = [_number(v) for v in match.groups() if v]
+        weight = max(values)
+        if 0 < weight <= 200:
+            return weight
+    match = WEIGHT_KG_RE.search(text)
+    if match:
+        return float(match.group(1)) / 1000
+    return None
+
+
+def parse_volume(text):
+    """Объем кузова в м3 (для перечисления - максимальный)"""
+    match = VOLUME_RE.search(text)
+    if not match:
+        return None
+    values = [_number(v) for v in re.findall(NUMBER, match.group(0))]
+    volume = max(values) if values else None
+    return volume if volume and volume <= 200 else None
+
+
+def parse_price(text):
+    """Ставка: (сумма, валюта) или (None, None)"""
+    for pattern, currency in PRICE_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        amount = _number(match.group(1))
+        if currency == 'RUB_K':
+            amount, currency = amount * 1000, 'RUB'
+        if amount >= 100:
+            return amount, currency
+    return None, None
+
+
+def parse_cargo_type(text):
+    """Тип груза по словарю"""
+    lowered = text.lower()
+    match = CARGO_AFTER_WORD_RE.search(lowered)
+    if match:
+        for prefix, cargo_type in CARGO_TYPES:
+            if match.group(1).startswith(prefix):
+                return cargo_type
+    for pattern, cargo_type in CARGO_TYPE_RES:
+        if pattern.search(lowered):
+            return cargo_type
+    return None
+
+
+def parse_block(lines, route):
+    """Параметры одной заявки"""
+    text = '\n'.join(lines)
+    price, currency = parse_price(text)
+    cargo = {
+        'from_city': route[0] if route else None,
+        'to_city': route[1] if route else None,
+        'cargo_type': parse_cargo_type(text),
+        'weight_tons': parse_weight(text),
+        'volume_m3': parse_volume(text),
+        'price': price,
+        'currency': currency,
+        'price_negotiable': bool(NEGOTIABLE_RE.search(text)) and price is None
+    }
+    cargo['missing'] = [field for field in REQUIRED_FIELDS if cargo[field] is None]
+    return cargo
+
+
+def extract_cargos(text):
+    """
+    Список заявок из текста сообщения.
+    Строки до первого маршрута относятся к первой заявке.
+    """
+    if not text:
+        return []
+    blocks = []
+    for line in text.splitlines():
+        route = parse_route(line)
+        if route and blocks and blocks[-1][1] is not None:
+            blocks.append([[line], route])
+            continue
+        if not blocks:
+            blocks.append([[], None])
+        blocks[-1][0].append(line)
+        if route:
+            blocks[-1][1] = route
+
+    cargos = [parse_block(lines, route) for lines, route in blocks]
+    # Сообщение без маршрута и без веса - не заявка
+    cargos = [c for c in cargos if c['from_city'] or c['weight_tons']]
+    return cargos[:MAX_CARGOS_PER_MESSAGE]
+
+
+def is_complete(cargo):
+    """Все обязательные поля заявки найдены"""
+    return not cargo.get('missing')
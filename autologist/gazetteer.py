@@ -0,0 +1,317 @@
+"""
+Справочник населенных пунктов для маршрутов
+
+Названия мест в объявлениях пишут по-разному: "Алашанькоу", "Алашонкоу",
+"Алашанку", "Питер", "Ростова-на-Дону". resolve_place() приводит их к
+каноническому id с координатами, регионом и страной. Регион - код вида
+KZ-ALM / RU-MOS (Москва вместе с областью), для стран без деления на
+регионы в справочнике - код страны.
+
+Для пространственного поиска используются geohash-ячейки: у заявки
+хранятся префиксы geohash точки отправления и назначения, а круг
+"в радиусе 200 км" покрывается несколькими ячейками того же уровня.
+"""
+
+import math
+import difflib
+from functools import lru_cache
+
+from autologist.keywords import stem, tokenize
+from autologist.normalize import fold
+
+EARTH_RADIUS_KM = 6371.0
+
+# Уровни geohash, которые хранятся у заявки (чем длиннее, тем мельче ячейка)
+GEOHASH_PRECISIONS = (2, 3, 4)
+# Ограничение Firestore на число значений в array_contains_any
+MAX_CELLS = 30
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+REGIONS = {
+    'KZ-ALM': 'Алматы и Алматинская область', 'KZ-ZHT': 'Жетысуская область', 'KZ-ABY': 'Абайская область',
+    'KZ-AST': 'Астана', 'KZ-AKM': 'Акмолинская область', 'KZ-ZHA': 'Жамбылская область',
+    'KZ-ATY': 'Атырауская область', 'KZ-KAR': 'Карагандинская область', 'KZ-YUZ': 'Туркестанская область и Шымкент',
+    'KZ-AKT': 'Актюбинская область', 'KZ-PAV': 'Павлодарская область', 'KZ-VOS': 'Восточно-Казахстанская область',
+    'KZ-KUS': 'Костанайская область', 'KZ-MAN': 'Мангистауская область', 'KZ-ZAP': 'Западно-Казахстанская область',
+    'KZ-KZY': 'Кызылординская область', 'KZ-SEV': 'Северо-Казахстанская область',
+    'RU-MOS': 'Москва и Московская область', 'RU-SPE': 'Санкт-Петербург и Ленинградская область',
+    'RU-ROS': 'Ростовская область', 'RU-TA': 'Татарстан', 'RU-UD': 'Удмуртия', 'RU-KIR': 'Кировская область',
+    'RU-TOM': 'Томская область', 'RU-VOR': 'Воронежская область', 'RU-KEM': 'Кемеровская область',
+    'RU-KO': 'Республика Коми', 'RU-KDA': 'Краснодарский край', 'RU-BEL': 'Белгородская область',
+    'RU-CE': 'Чечня', 'RU-BA': 'Башкортостан', 'RU-SAR': 'Саратовская область', 'RU-NVS': 'Новосибирская область',
+    'RU-SVE': 'Свердловская область', 'RU-CHE': 'Челябинская область', 'RU-SAM': 'Самарская область',
+    'RU-OMS': 'Омская область', 'RU-KYA': 'Красноярский край', 'RU-NIZ': 'Нижегородская область',
+    'RU-ORE': 'Оренбургская область', 'RU-TYU': 'Тюменская область', 'RU-VGG': 'Волгоградская область',
+    'RU-AST': 'Астраханская область', 'RU-ALT': 'Алтайский край', 'RU-PER': 'Пермский край',
+    'RU-IRK': 'Иркутская область',
+    'UZ-TO': 'Ташкент и Ташкентская область', 'UZ-BU': 'Бухарская область', 'UZ-NW': 'Навоийская область',
+    'UZ-JI': 'Джизакская область', 'UZ-SU': 'Сурхандарьинская область', 'UZ-AN': 'Андижанская область',
+    'UZ-SA': 'Самаркандская область', 'UZ-FA': 'Ферганская область', 'UZ-NG': 'Наманганская область',
+    'CN-XJ': 'Синьцзян', 'CN-ZJ': 'Чжэцзян', 'CN-GD': 'Гуандун', 'CN-SH': 'Шанхай',
+    'BY-MI': 'Минская область', 'BY-BR': 'Брестская область',
+}
+
+# Дополнительные названия регионов для поиска
+REGION_ALIASES = {
+    'подмосковье': 'RU-MOS', 'московская область': 'RU-MOS', 'ленинградская область': 'RU-SPE',
+    'ленобласть': 'RU-SPE', 'алматинская область': 'KZ-ALM', 'ташкентская область': 'UZ-TO',
+    'синьцзян': 'CN-XJ', 'xinjiang': 'CN-XJ',
+}
+
+COUNTRIES = {
+    'KZ': 'Казахстан', 'RU': 'Россия', 'UZ': 'Узбекистан', 'KG': 'Кыргызстан', 'TJ': 'Таджикистан',
+    'TM': 'Туркменистан', 'CN': 'Китай', 'BY': 'Беларусь', 'AZ': 'Азербайджан', 'GE': 'Грузия',
+    'AM': 'Армения', 'AF': 'Афганистан', 'PL': 'Польша', 'LT': 'Литва', 'TR': 'Турция',
+}
+
+# id, название, широта, долгота, регион, дополнительные написания
+PLACES = [
+    ('khorgos', 'Хоргос', 44.21, 80.41, 'KZ-ZHT', ('харгос', 'хоргос кнр', 'хоргас', 'khorgos')),
+    ('alashankou', 'Алашанькоу', 45.17, 82.57, 'CN-XJ',
+     ('алашанку', 'алашонькоу', 'алашонкоу', 'алашанкоу', 'алащонькоу', 'алашонкоуь', 'алашань')),
+    ('dostyk', 'Достык', 45.25, 82.49, 'KZ-ABY', ('дружба',)),
+    ('bakhty', 'Бахты', 46.67, 82.74, 'KZ-ABY', ()),
+    ('zharkent', 'Жаркент', 44.16, 80.00, 'KZ-ZHT', ()),
+    ('chundzha', 'Чунджа', 43.54, 79.46, 'KZ-ALM', ()),
+    ('almaty', 'Алматы', 43.24, 76.89, 'KZ-ALM', ('алмата', 'алма-ата')),
+    ('taldykorgan', 'Талдыкорган', 45.02, 78.37, 'KZ-ZHT', ()),
+    ('astana', 'Астана', 51.17, 71.43, 'KZ-AST', ('нур-султан', 'целиноград')),
+    ('kokshetau', 'Кокшетау', 53.28, 69.39, 'KZ-AKM', ('көкшетау', 'кокчетав')),
+    ('taraz', 'Тараз', 42.90, 71.37, 'KZ-ZHA', ('жамбыл', 'джамбул')),
+    ('atyrau', 'Атырау', 47.09, 51.92, 'KZ-ATY', ('гурьев',)),
+    ('karaganda', 'Караганда', 49.80, 73.09, 'KZ-KAR', ('караганды',)),
+    ('temirtau', 'Темиртау', 50.05, 72.96, 'KZ-KAR', ()),
+    ('balkhash', 'Балхаш', 46.85, 74.98, 'KZ-KAR', ()),
+    ('shymkent', 'Шымкент', 42.32, 69.59, 'KZ-YUZ', ('чимкент',)),
+    ('turkestan', 'Туркестан', 43.30, 68.25, 'KZ-YUZ', ()),
+    ('aktobe', 'Актобе', 50.28, 57.21, 'KZ-AKT', ('актюбинск',)),
+    ('pavlodar', 'Павлодар', 52.29, 76.97, 'KZ-PAV', ()),
+    ('oskemen', 'Усть-Каменогорск', 49.95, 82.61, 'KZ-VOS', ('оскемен',)),
+    ('semey', 'Семей', 50.41, 80.23, 'KZ-ABY', ('семипалатинск',)),
+    ('kostanay', 'Костанай', 53.21, 63.62, 'KZ-KUS', ()),
+    ('aktau', 'Актау', 43.65, 51.16, 'KZ-MAN', ()),
+    ('uralsk', 'Уральск', 51.23, 51.37, 'KZ-ZAP', ('орал',)),
+    ('kyzylorda', 'Кызылорда', 44.85, 65.51, 'KZ-KZY', ()),
+    ('petropavlovsk', 'Петропавловск', 54.87, 69.15, 'KZ-SEV', ()),
+    ('moscow', 'Москва', 55.76, 37.62, 'RU-MOS', ('мск', 'moscow')),
+    ('podolsk', 'Подольск', 55.43, 37.54, 'RU-MOS', ()),
+    ('spb', 'Санкт-Петербург', 59.94, 30.31, 'RU-SPE', ('питер', 'спб', 'санк-петербург', 'петербург')),
+    ('rostov', 'Ростов-на-Дону', 47.22, 39.72, 'RU-ROS', ('ростов', 'ростова-на-дону', 'ростов на дону')),
+    ('bataysk', 'Батайск', 47.14, 39.74, 'RU-ROS', ()),
+    ('kazan', 'Казань', 55.79, 49.12, 'RU-TA', ()),
+    ('chelny', 'Набережные Челны', 55.74, 52.40, 'RU-TA', ('челны',)),
+    ('izhevsk', 'Ижевск', 56.85, 53.21, 'RU-UD', ()),
+    ('kirov', 'Киров', 58.60, 49.66, 'RU-KIR', ()),
+    ('tomsk', 'Томск', 56.48, 84.95, 'RU-TOM', ()),
+    ('voronezh', 'Воронеж', 51.67, 39.18, 'RU-VOR', ()),
+    ('novokuznetsk', 'Новокузнецк', 53.76, 87.12, 'RU-KEM', ()),
+    ('syktyvkar', 'Сыктывкар', 61.67, 50.84, 'RU-KO', ()),
+    ('sochi', 'Сочи', 43.60, 39.73, 'RU-KDA', ()),
+    ('krasnodar', 'Краснодар', 45.04, 38.98, 'RU-KDA', ()),
+    ('belgorod', 'Белгород', 50.60, 36.59, 'RU-BEL', ()),
+    ('grozny', 'Грозный', 43.32, 45.69, 'RU-CE', ()),
+    ('ufa', 'Уфа', 54.74, 55.97, 'RU-BA', ()),
+    ('chishmy', 'Чишмы', 54.58, 55.39, 'RU-BA', ('чышми',)),
+    ('saratov', 'Саратов', 51.53, 46.03, 'RU-SAR', ()),
+    ('novosibirsk', 'Новосибирск', 55.03, 82.92, 'RU-NVS', ('новосиб',)),
+    ('yekaterinburg', 'Екатеринбург', 56.84, 60.61, 'RU-SVE', ('екб',)),
+    ('chelyabinsk', 'Челябинск', 55.16, 61.40, 'RU-CHE', ()),
+    ('samara', 'Самара', 53.20, 50.15, 'RU-SAM', ()),
+    ('omsk', 'Омск', 54.99, 73.37, 'RU-OMS', ()),
+    ('krasnoyarsk', 'Красноярск', 56.01, 92.87, 'RU-KYA', ()),
+    ('nizhny', 'Нижний Новгород', 56.33, 44.00, 'RU-NIZ', ('нижний',)),
+    ('orenburg', 'Оренбург', 51.77, 55.10, 'RU-ORE', ()),
+    ('tyumen', 'Тюмень', 57.15, 65.53, 'RU-TYU', ()),
+    ('volgograd', 'Волгоград', 48.71, 44.51, 'RU-VGG', ()),
+    ('astrakhan', 'Астрахань', 46.35, 48.04, 'RU-AST', ()),
+    ('barnaul', 'Барнаул', 53.35, 83.78, 'RU-ALT', ()),
+    ('perm', 'Пермь', 58.01, 56.25, 'RU-PER', ()),
+    ('irkutsk', 'Иркутск', 52.29, 104.28, 'RU-IRK', ()),
+    ('tashkent', 'Ташкент', 41.30, 69.24, 'UZ-TO', ('тошкент',)),
+    ('olmaliq', 'Алмалык', 40.85, 69.60, 'UZ-TO', ('олмалик', 'олмалиқ')),
+    ('bukhara', 'Бухара', 39.77, 64.42, 'UZ-BU', ('бухоро',)),
+    ('navoi', 'Навои', 40.10, 65.38, 'UZ-NW', ('навой',)),
+    ('jizzakh', 'Джизак', 40.12, 67.84, 'UZ-JI', ('жиззах', 'джизах')),
+    ('termez', 'Термез', 37.22, 67.28, 'UZ-SU', ()),
+    ('andijan', 'Андижан', 40.78, 72.34, 'UZ-AN', ()),
+    ('samarkand', 'Самарканд', 39.65, 66.96, 'UZ-SA', ()),
+    ('fergana', 'Фергана', 40.38, 71.79, 'UZ-FA', ()),
+    ('namangan', 'Наманган', 41.00, 71.67, 'UZ-NG', ()),
+    ('urumqi', 'Урумчи', 43.83, 87.62, 'CN-XJ', ()),
+    ('kashgar', 'Кашгар', 39.47, 75.99, 'CN-XJ', ()),
+    ('yiwu', 'Иу', 29.31, 120.08, 'CN-ZJ', ('иву',)),
+    ('guangzhou', 'Гуанчжоу', 23.13, 113.26, 'CN-GD', ()),
+    ('shanghai', 'Шанхай', 31.23, 121.47, 'CN-SH', ()),
+    ('minsk', 'Минск', 53.90, 27.56, 'BY-MI', ()),
+    ('brest', 'Брест', 52.10, 23.69, 'BY-BR', ()),
+    ('bishkek', 'Бишкек', 42.87, 74.59, 'KG', ()),
+    ('dushanbe', 'Душанбе', 38.56, 68.78, 'TJ', ()),
+    ('mary', 'Мары', 37.59, 61.83, 'TM', ()),
+    ('baku', 'Баку', 40.41, 49.87, 'AZ', ()),
+    ('tbilisi', 'Тбилиси', 41.72, 44.79, 'GE', ('тблиси',)),
+    ('yerevan', 'Ереван', 40.18, 44.51, 'AM', ()),
+    ('kabul', 'Кабул', 34.53, 69.17, 'AF', ()),
+    ('mazar', 'Мазари-Шариф', 36.71, 67.11, 'AF', ('мазар', 'мазари шариф')),
+    ('warsaw', 'Варшава', 52.23, 21.01, 'PL', ()),
+    ('vilnius', 'Вильнюс', 54.69, 25.28, 'LT', ()),
+    ('kaunas', 'Каунас', 54.90, 23.89, 'LT', ('каунус',)),
+    ('istanbul', 'Стамбул', 41.01, 28.98, 'TR', ()),
+    # Страны целиком ("Алматы - Афганистан"): точка - географический центр
+    ('country_af', 'Афганистан', 33.94, 67.71, 'AF', ()),
+    ('country_am', 'Армения', 40.07, 45.04, 'AM', ()),
+    ('country_pl', 'Польша', 51.92, 19.15, 'PL', ()),
+    ('country_by', 'Беларусь', 53.71, 27.95, 'BY', ('белоруссия', 'белорусия', 'белорус', 'рб')),
+    ('country_tm', 'Туркменистан', 38.97, 59.56, 'TM', ('туркмения',)),
+    ('country_cn', 'Китай', 35.86, 104.20, 'CN', ('кнр',)),
+    ('country_kg', 'Кыргызстан', 41.20, 74.77, 'KG', ('киргизия',)),
+    ('country_tj', 'Таджикистан', 38.86, 71.28, 'TJ', ()),
+    ('country_lt', 'Литва', 55.17, 23.88, 'LT', ()),
+]
+
+
+def _country(region):
+    return region.split('-')[0]
+
+
+def _make_place(row):
+    place_id, name, lat, lon, region, _ = row
+    return {
+        'id': place_id,
+        'name': name,
+        'lat': lat,
+        'lon': lon,
+        'region': region,
+        'country': _country(region),
+        'kind': 'country' if place_id.startswith('country_') else 'city'
+    }
+
+
+def _stem_key(text):
+    return ' '.join(stem(token) for token in tokenize(text))
+
+
+PLACES_BY_ID = {row[0]: _make_place(row) for row in PLACES}
+ALIASES = {}
+STEM_ALIASES = {}
+for _row in PLACES:
+    for _alias in (_row[1],) + _row[5]:
+        ALIASES.setdefault(fold(_alias), _row[0])
+        STEM_ALIASES.setdefault(_stem_key(_alias), _row[0])
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Расстояние по большой окружности в километрах"""
+    lat1, lon1, lat2, lon2 = (math.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def geohash(lat, lon, precision=max(GEOHASH_PRECISIONS)):
+    """Geohash точки заданной длины"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    result, bits, value, even = [], 0, 0, True
+    while len(result) < precision:
+        target, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (target[0] + target[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            target[0] = middle
+        else:
+            target[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            result.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(result)
+
+
+def cell_size(precision):
+    """Размер ячейки geohash в градусах: (широта, долгота)"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def point_cells(lat, lon):
+    """Префиксы geohash точки для всех хранимых уровней"""
+    full = geohash(lat, lon)
+    return [full[:precision] for precision in GEOHASH_PRECISIONS]
+
+
+def covering_cells(lat, lon, radius_km):
+    """
+    Ячейки geohash, покрывающие круг радиуса radius_km.
+    Выбирается самый мелкий уровень, на котором ячеек не больше MAX_CELLS;
+    если их больше и на самом крупном уровне - ValueError (обрезанный список
+    потерял бы часть круга, и поиск молча пропустил бы заявки).
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lon_delta = lat_delta / max(math.cos(math.radians(min(abs(lat) + lat_delta, 89.0))), 0.01)
+    for precision in sorted(GEOHASH_PRECISIONS, reverse=True):
+        lat_step, lon_step = cell_size(precision)
+        cells = set()
+        lat_value = lat - lat_delta
+        while lat_value <= lat + lat_delta + lat_step:
+            lon_value = lon - lon_delta
+            while lon_value <= lon + lon_delta + lon_step:
+                cells.add(geohash(max(min(lat_value, lat + lat_delta), -90.0),
+                                  ((min(lon_value, lon + lon_delta) + 180.0) % 360.0) - 180.0, precision))
+                lon_value += lon_step
+            lat_value += lat_step
+        if len(cells) <= MAX_CELLS:
+            return sorted(cells)
+    raise ValueError(f"Радиус {radius_km:g} км слишком большой: круг не покрывается {MAX_CELLS} ячейками, "
+                     f"ищите по региону или стране")
+
+
+@lru_cache(maxsize=4096)
+def resolve_place(name):
+    """
+    Канонический пункт по названию из объявления или None.
+    Точное написание -> основы слов -> отдельные слова -> близкое написание.
+    """
+    key = fold(name or '').strip(' .,()')
+    if not key:
+        return None
+    place_id = ALIASES.get(key) or STEM_ALIASES.get(_stem_key(key))
+    if place_id is None:
+        # "Хоргос китай", "Туркмения мары": первый распознанный город, иначе страна
+        found = [ALIASES.get(word) or STEM_ALIASES.get(_stem_key(word)) for word in key.split()]
+        found = [found_id for found_id in found if found_id]
+        cities = [found_id for found_id in found if not found_id.startswith('country_')]
+        place_id = (cities or found or [None])[0]
+    if place_id is None and len(key) >= 5:
+        close = difflib.get_close_matches(key, ALIASES.keys(), n=1, cutoff=0.85)
+        place_id = ALIASES[close[0]] if close else None
+    return PLACES_BY_ID.get(place_id) if place_id else None
+
+
+def resolve_area(name):
+    """
+    Область поиска по названию: ('id', place_id), ('region', код) или ('country', код).
+    Город имеет приоритет: "Москва" - город, "Московская область" - регион.
+    """
+    key = fold(name or '').strip()
+    upper = (name or '').strip().upper()
+    if upper in REGIONS:
+        return 'region', upper
+    if upper in COUNTRIES:
+        return 'country', upper
+    if key in REGION_ALIASES:
+        return 'region', REGION_ALIASES[key]
+    for code, region_name in REGIONS.items():
+        if fold(region_name) == key:
+            return 'region', code
+    for code, country_name in COUNTRIES.items():
+        if fold(country_name) == key:
+            return 'country', code
+    place = resolve_place(name)
+    if place is None:
+        return None
+    if place['kind'] == 'country':
+        return 'country', place['country']
+    return 'id', place['id']
@@ -0,0 +1,197 @@
+"""
+Пульс парсера: периодические отчеты о состоянии конвейера
+
+Каждый процесс парсера раз в HEARTBEAT_SECONDS пишет документ
+parser_heartbeats/{воркер} (или data/heartbeats.json в локальном режиме):
+скорость обработки и сохранения за последний интервал, долю ошибок,
+задержку (текущее время минус время публикации сообщения в Telegram),
+глубину очередей (спул и индексы, ждущие сброса) и размеры кэшей.
+
+Отчет пишется из цикла событий, поэтому зависший цикл перестает слать
+пульс: API считает воркер остановившимся, если отчет старше
+HEARTBEAT_STALE_SECONDS, - это видно уже через несколько секунд.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from autologist.timebuckets import json_default, parse_timestamp
+
+HEARTBEAT_COLLECTION = 'parser_heartbeats'
+
+HEARTBEAT_SECONDS = int(os.getenv('HEARTBEAT_SECONDS', '5'))
+HEARTBEAT_STALE_SECONDS = int(os.getenv('HEARTBEAT_STALE_SECONDS', '20'))
+
+# Пороги "работает, но с проблемами"
+HEARTBEAT_LAG_ALERT_SECONDS = int(os.getenv('HEARTBEAT_LAG_ALERT_SECONDS', '300'))
+HEARTBEAT_ERROR_RATE_ALERT = float(os.getenv('HEARTBEAT_ERROR_RATE_ALERT', '0.2'))
+
+# Сколько последних задержек хранить для оценки
+LAG_SAMPLES = 1000
+
+
+def _percentile(values, quantile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class PipelineMeter:
+    """Скорости по приращениям счетчиков парсера и задержка последних сообщений"""
+
+    def __init__(self):
+        self._lags = deque(maxlen=LAG_SAMPLES)
+        self._previous = None
+        self._lock = threading.Lock()
+        self.last_message_at = None
+
+    def observe(self, message_date):
+        """Учет полученного сообщения: задержка от публикации до обработки"""
+        now = datetime.now(timezone.utc)
+        self.last_message_at = now
+        if message_date is None:
+            return
+        if message_date.tzinfo is None:
+            message_date = message_date.replace(tzinfo=timezone.utc)
+        with self._lock:
+            self._lags.append((time.time(), max(0.0, (now - message_date).total_seconds())))
+
+    def snapshot(self, counters):
+        """
+        Скорости (в минуту) с прошлого снимка и задержка за этот интервал.
+        counters - накопленные messages_processed / messages_saved / errors.
+        """
+        now = time.time()
+        previous_time, previous = self._previous or (now, counters)
+        self._previous = (now, dict(counters))
+        elapsed = now - previous_time
+        delta = {key: counters[key] - previous.get(key, 0) for key in counters}
+        per_minute = (lambda value: round(value * 60 / elapsed, 2)) if elapsed > 0 else (lambda value: 0.0)
+
+        with self._lock:
+            lags = [lag for observed, lag in self._lags if observed >= previous_time] or \
+                   [lag for _, lag in list(self._lags)[-10:]]
+        handled = delta.get('messages_processed', 0)
+        return {
+            'processed_per_min': per_minute(handled),
+            'saved_per_min': per_minute(delta.get('messages_saved', 0)),
+            'error_rate': round(delta.get('errors', 0) / handled, 4) if handled else 0.0,
+            'lag_p50_seconds': round(_percentile(lags, 0.5), 1) if lags else None,
+            'lag_max_seconds': round(max(lags), 1) if lags else None,
+            'last_message_at': self.last_message_at
+        }
+
+
+def build_heartbeat(worker_id, session, status, started_at, counters, meter, queues=None, caches=None):
+    """Документ пульса воркера"""
+    now = datetime.now(timezone.utc)
+    doc = {
+        'worker_id': worker_id,
+        'session': session,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'status': status,
+        'started_at': started_at,
+        'updated_at': now,
+        'uptime_seconds': int((now - started_at).total_seconds()),
+        'queues': dict(queues or {}),
+        'caches': dict(caches or {})
+    }
+    doc.update(counters)
+    doc.update(meter.snapshot(counters))
+    return doc
+
+
+class FirestoreHeartbeatStore:
+    """Пульс в коллекции parser_heartbeats"""
+
+    def __init__(self, db, collection=HEARTBEAT_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def publish(self, doc):
+        self.db.collection(self.collection).document(doc['worker_id']).set(doc)
+
+    def read(self):
+        return [snapshot.to_dict() for snapshot in self.db.collection(self.collection).stream()]
+
+
+class LocalHeartbeatStore:
+    """Пульс в локальном JSON файле: {воркер: документ}"""
+
+    def __init__(self, path='data/heartbeats.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def publish(self, doc):
+        with self._lock:
+            heartbeats = self._load()
+            heartbeats[doc['worker_id']] = json.loads(json.dumps(doc, default=json_default))
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(heartbeats, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def read(self):
+        return list(self._load().values())
+
+
+def worker_health(heartbeat, now=None, stale_seconds=HEARTBEAT_STALE_SECONDS):
+    """
+    Состояние воркера по последнему пульсу:
+    stopped - остановлен штатно, stalled - пульс устарел (процесс завис или упал),
+    degraded - большая задержка или доля ошибок, running - норма.
+    """
+    now = now or datetime.now(timezone.utc)
+    updated_at = parse_timestamp(heartbeat.get('updated_at'))
+    age = (now - updated_at).total_seconds() if updated_at else None
+    problems = []
+    if heartbeat.get('status') == 'stopped':
+        status = 'stopped'
+    elif age is None or age > stale_seconds:
+        status = 'stalled'
+        problems.append(f"нет пульса {int(age) if age is not None else '?'} с")
+    else:
+        lag = heartbeat.get('lag_p50_seconds')
+        if lag is not None and lag > HEARTBEAT_LAG_ALERT_SECONDS:
+            problems.append(f"задержка {int(lag)} с")
+        if (heartbeat.get('error_rate') or 0) > HEARTBEAT_ERROR_RATE_ALERT:
+            problems.append(f"ошибки {heartbeat['error_rate']:.0%}")
+        status = 'degraded' if problems else 'running'
+    return dict(heartbeat, health=status, heartbeat_age_seconds=round(age, 1) if age is not None else None,
+                problems=problems)
+
+
+def parser_health(heartbeats, now=None, stale_seconds=HEARTBEAT_STALE_SECONDS):
+    """Общее состояние парсера по всем воркерам"""
+    workers = [worker_health(heartbeat, now, stale_seconds) for heartbeat in heartbeats]
+    states = {worker['health'] for worker in workers}
+    if 'running' in states and states <= {'running', 'stopped'}:
+        status = 'running'
+    elif states & {'running', 'degraded'}:
+        status = 'degraded'
+    elif 'stalled' in states:
+        status = 'stalled'
+    else:
+        status = 'stopped'
+    return {
+        'status': status,
+        'workers': sorted(workers, key=lambda worker: worker.get('worker_id') or ''),
+        'processed_per_min': round(sum(w.get('processed_per_min') or 0 for w in workers
+                                       if w['health'] in ('running', 'degraded')), 2),
+        'spool_pending': sum((w.get('queues') or {}).get('spool', 0) for w in workers)
+    }
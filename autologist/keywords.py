@@ -0,0 +1,197 @@
+"""
+Поиск ключевых слов с учетом русской морфологии
+
+Режим 'substring' (прежнее поведение): ключевое слово ищется как подстрока,
+поэтому "перевозка" не находит "перевозки", а "груз" срабатывает на "грузин".
+
+Режим 'stem': текст один раз разбивается на слова, каждое слово нормализуется
+(нижний регистр, ё -> е) и приводится к основе облегченным стеммером Snowball.
+Основы ключевых слов чата вычисляются заранее, поэтому проверка сообщения -
+O(число слов) и не зависит от количества ключевых слов.
+
+Особые формы ключевых слов:
+    груз*              - любое слово, начинающееся с "груз" (грузовой, грузоперевозки)
+    растаможка в Китае - фраза: основы слов должны идти подряд
+"""
+
+import re
+from functools import lru_cache
+
+MATCH_MODES = ('substring', 'stem')
+DEFAULT_MATCH_MODE = 'substring'
+
+TOKEN_RE = re.compile(r'[0-9a-zа-я]+')
+
+VOWELS = set('аеиоуыэюя')
+
+# Окончания по алгоритму Snowball для русского языка.
+# Окончания первой группы удаляются только после "а" или "я".
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+REFLEXIVE = ('ся', 'сь')
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+             'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть',
+         'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым',
+         'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой',
+        'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию',
+        'ью', 'ю', 'ия', 'ья', 'я')
+DERIVATIONAL = ('ост', 'ость')
+SUPERLATIVE = ('ейш', 'ейше')
+
+
+def normalize_token(word):
+    return word.lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    """Нормализованные слова текста"""
+    return TOKEN_RE.findall(normalize_token(text or ''))
+
+
+def _regions(word):
+    """Начала областей RV и R2 алгоритма Snowball"""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS),
+              len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS),
+              len(word))
+    return rv, r2
+
+
+def _remove(word, start, endings, after_a=False):
+    """Удаление самого длинного окончания, целиком лежащего в области с позиции start"""
+    for ending in sorted(endings, key=len, reverse=True):
+        cut = len(word) - len(ending)
+        if cut < start or not word.endswith(ending):
+            continue
+        if after_a and (cut - 1 < start or word[cut - 1] not in 'ая'):
+            continue
+        return word[:cut], True
+    return word, False
+
+
+def _remove_grouped(word, start, groups):
+    """Окончания первой группы (после а/я) и второй группы"""
+    first, removed = _remove(word, start, groups[0], after_a=True)
+    second, removed_second = _remove(word, start, groups[1])
+    # Как и в Snowball, выигрывает более длинное окончание
+    if removed and (not removed_second or len(first) <= len(second)):
+        return first, True
+    return second, removed_second
+
+
+def stem_variants(word):
+    """
+    Основа слова и ее формы с беглой гласной: у "перевозка" родительный
+    падеж множественного числа "перевозок" дает основу "перевозок"
+    """
+    base = stem(word)
+    variants = [base]
+    if len(base) > 3 and base[-1] == 'к' and base[-2] not in VOWELS:
+        variants.extend([base[:-1] + 'ок', base[:-1] + 'ек'])
+    return variants
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Основа русского слова (облегченный стеммер Snowball)"""
+    word = normalize_token(word)
+    if not any(ch in VOWELS for ch in word):
+        return word
+    rv, r2 = _regions(word)
+
+    word, removed = _remove_grouped(word, rv, PERFECTIVE_GERUND)
+    if not removed:
+        word, _ = _remove(word, rv, REFLEXIVE)
+        word, removed = _remove(word, rv, ADJECTIVE)
+        if removed:
+            word, _ = _remove_grouped(word, rv, PARTICIPLE)
+        else:
+            word, removed = _remove_grouped(word, rv, VERB)
+            if not removed:
+                word, _ = _remove(word, rv, NOUN)
+
+    word, _ = _remove(word, rv, ('и',))
+    word, _ = _remove(word, r2, DERIVATIONAL)
+
+    if word.endswith('нн') and len(word) - 1 > rv:
+        return word[:-1]
+    word, removed = _remove(word, rv, SUPERLATIVE)
+    if removed:
+        return word[:-1] if word.endswith('нн') else word
+    word, _ = _remove(word, rv, ('ь',))
+    return word
+
+
+class KeywordMatcher:
+    """Предвычисленный набор основ ключевых слов одного чата"""
+
+    def __init__(self, keywords, mode=DEFAULT_MATCH_MODE):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {mode}")
+        self.mode = mode
+        self.keywords = [keyword for keyword in keywords or [] if keyword and keyword.strip()]
+        self.stems = {}
+        self.prefixes = {}
+        self.phrases = {}
+        for keyword in self.keywords:
+            tokens = tokenize(keyword)
+            if not tokens:
+                continue
+            if len(tokens) > 1:
+                self.phrases.setdefault(tuple(stem(token) for token in tokens), keyword)
+            elif keyword.strip().endswith('*'):
+                self.prefixes.setdefault(tokens[0], keyword)
+            else:
+                for variant in stem_variants(tokens[0]):
+                    self.stems.setdefault(variant, keyword)
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+        self.phrase_lengths = sorted({len(phrase) for phrase in self.phrases})
+
+    def match(self, text, normalized=None):
+        """
+        Найденные ключевые слова в порядке их объявления.
+        normalized - готовый результат autologist.normalize, чтобы не разбирать текст повторно
+        """
+        if not text:
+            return []
+        if self.mode == 'substring':
+            text_lower = normalized.folded if normalized is not None else normalize_token(text)
+            return [keyword for keyword in self.keywords if normalize_token(keyword).strip() in text_lower]
+
+        found = set()
+        stems = []
+        tokens = normalized.tokens if normalized is not None else tokenize(text)
+        for token in tokens:
+            token_stem = stem(token)
+            stems.append(token_stem)
+            if token_stem in self.stems:
+                found.add(self.stems[token_stem])
+            for length in self.prefix_lengths:
+                if token[:length] in self.prefixes:
+                    found.add(self.prefixes[token[:length]])
+        for length in self.phrase_lengths:
+            for i in range(len(stems) - length + 1):
+                phrase = tuple(stems[i:i + length])
+                if phrase in self.phrases:
+                    found.add(self.phrases[phrase])
+        return [keyword for keyword in self.keywords if keyword in found]
+
+
+def matcher_for_chat(chat_config, cache=None):
+    """
+    Матчер по настройкам чата (keywords, match_mode).
+    cache - словарь, в котором матчеры переиспользуются, пока не изменятся настройки.
+    """
+    mode = chat_config.get('match_mode') or DEFAULT_MATCH_MODE
+    keywords = tuple(chat_config.get('keywords') or [])
+    if cache is None:
+        return KeywordMatcher(keywords, mode)
+    key = (mode, keywords)
+    matcher = cache.get(key)
+    if matcher is None:
+        matcher = cache[key] = KeywordMatcher(keywords, mode)
+    return matcher
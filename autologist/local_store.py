@@ -0,0 +1,34 @@
+"""
+Локальное хранилище сообщений (data/messages/*.json)
+Используется парсером, когда Firestore недоступен
+"""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Папка с локальными сообщениями
+LOCAL_MESSAGES_DIR = 'data/messages'
+
+
+def iter_local_messages(directory=LOCAL_MESSAGES_DIR):
+    """
+    Перебор локальных сообщений в порядке имен файлов (т.е. по времени сохранения).
+    Возвращает пары (имя файла, словарь сообщения); битые файлы пропускаются.
+    """
+    if not os.path.exists(directory):
+        return
+
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        filepath = os.path.join(directory, filename)
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                message = json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️  Пропускаем {filename}: {e}")
+            continue
+        yield filename, message
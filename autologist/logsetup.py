@@ -0,0 +1,194 @@
+"""
+Асинхронное структурированное логирование для парсера
+
+setup_logging() заменяет синхронные FileHandler/StreamHandler одной
+очередью: поток обработки сообщений только кладет запись в очередь, а
+форматирование и запись в файл и консоль выполняет фоновый поток
+QueueListener. В файл пишутся JSON строки (время, уровень, сообщение и
+поля из extra), в консоль - привычный текст.
+
+Частые события помечаются extra={'sample': 'имя'}: из них пишется одно из
+N (LOG_SAMPLE_RATES="message_received=100,keywords=50"). Сообщения
+передаются в стиле logger.info("... %s", значение) - строка собирается
+уже в фоновом потоке и только для записей, которые будут записаны.
+
+Подробная трассировка отдельных чатов включается без перезапуска:
+список ID чатов в config/debug_chats.json (или LOG_TRACE_CHATS)
+перечитывается при изменении файла.
+"""
+
+import os
+import json
+import queue
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from autologist.sharding import canonical_chat_id
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Атрибуты LogRecord, которые не относятся к полям из extra
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Как часто проверять файл трассировки на изменения (секунды)
+TRACE_CHECK_SECONDS = 5
+
+
+def parse_sample_rates(value):
+    """'message_received=100,keywords=50' -> {'message_received': 100, 'keywords': 50}"""
+    rates = {}
+    for part in (value or '').split(','):
+        name, _, rate = part.partition('=')
+        if name.strip() and rate.strip().isdigit():
+            rates[name.strip()] = max(1, int(rate))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись: ts, level, logger, msg и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key != 'sample':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает одну из N записей с extra={'sample': имя}; остальные записи - все"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        name = getattr(record, 'sample', None)
+        rate = self.rates.get(name) if name else None
+        if not rate or rate == 1:
+            return True
+        with self._lock:
+            count = self._counts.get(name, 0)
+            self._counts[name] = count + 1
+        if count % rate:
+            return False
+        record.sampled_1_of = rate
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь без форматирования: в отличие от стандартного
+    QueueHandler, строка сообщения собирается в потоке QueueListener.
+    Аргументы сообщений - строки и числа, поэтому передавать их безопасно.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _QueuedLogging:
+    listener = None
+
+
+def setup_logging(log_file='logs/telegram_parser.log', level=None):
+    """
+    Логирование через очередь: JSON в файл, текст в консоль, выборка частых событий.
+    Повторный вызов ничего не делает. Возвращает QueueListener (stop() - дописать очередь).
+    """
+    if _QueuedLogging.listener is not None:
+        return _QueuedLogging.listener
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+
+    handlers = []
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers.append(console)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(
+        os.getenv('LOG_SAMPLE_RATES', 'message_received=100,keywords=100'))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _QueuedLogging.listener = listener
+    return listener
+
+
+def stop_logging():
+    """Дописать записи из очереди и остановить фоновый поток"""
+    if _QueuedLogging.listener is not None:
+        _QueuedLogging.listener.stop()
+        _QueuedLogging.listener = None
+
+
+class ChatTrace:
+    """
+    Чаты с подробной трассировкой. Список ID перечитывается из файла
+    не чаще раза в TRACE_CHECK_SECONDS и только если файл изменился,
+    поэтому проверка на каждом сообщении - поиск в множестве.
+    """
+
+    def __init__(self, path='config/debug_chats.json', env_value=None):
+        self.path = path
+        self._env_ids = {canonical_chat_id(chat_id.strip())
+                         for chat_id in (env_value if env_value is not None
+                                         else os.getenv('LOG_TRACE_CHATS', '')).split(',') if chat_id.strip()}
+        self._file_ids = set()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.chat_ids = set(self._env_ids)
+
+    def _reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < TRACE_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        ids = set()
+        if mtime is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                chats = data.get('chat_ids', []) if isinstance(data, dict) else data
+                ids = {canonical_chat_id(chat_id) for chat_id in chats}
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).warning("⚠️  Не удалось прочитать %s: %s", self.path, e)
+                return
+        self._file_ids = ids
+        self.chat_ids = self._env_ids | ids
+        logging.getLogger(__name__).info("🔎 Трассировка чатов: %s", sorted(self.chat_ids) or 'выключена')
+
+    def traced(self, chat_id):
+        self._reload()
+        return bool(self.chat_ids) and canonical_chat_id(chat_id) in self.chat_ids
@@ -0,0 +1,346 @@
+"""
+Firestore в памяти процесса для бенчмарков и воспроизведения потоков
+
+Поддерживает то подмножество клиента google-cloud-firestore, которое
+использует запись парсера: коллекции и подколлекции, set (в том числе
+merge=True с Increment, SERVER_TIMESTAMP и DELETE_FIELD во вложенных полях), create,
+update, delete, get, get_all, stream, batch и transaction, а также запросы слоя
+autologist.queries: where (==, in, <, <=, >, >=, array_contains),
+order_by, limit, start_after, select и count(). Каждая операция выполняется под одной
+блокировкой, поэтому хранилище можно использовать из потоков executor.
+latency - задержка каждого обращения "к серверу" (секунды), чтобы
+нагрузочные тесты API видели время ответа, похожее на настоящий Firestore.
+"""
+
+import copy
+import time
+import threading
+from datetime import datetime, timezone
+
+
+def _is_increment(value):
+    return type(value).__name__ == 'Increment' and hasattr(value, 'value')
+
+
+def _is_server_timestamp(value):
+    return type(value).__name__ == 'Sentinel' and 'timestamp' in repr(value).lower()
+
+
+def _is_delete_field(value):
+    return type(value).__name__ == 'Sentinel' and 'delete' in repr(value).lower()
+
+
+def _apply(target, data, merge):
+    """Запись полей с применением Increment / SERVER_TIMESTAMP / DELETE_FIELD"""
+    for key, value in data.items():
+        if _is_delete_field(value):
+            target.pop(key, None)
+        elif _is_increment(value):
+            current = target.get(key)
+            target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+        elif _is_server_timestamp(value):
+            target[key] = datetime.now(timezone.utc)
+        elif isinstance(value, dict) and merge:
+            nested = target.get(key)
+            if not isinstance(nested, dict):
+                nested = target[key] = {}
+            _apply(nested, value, merge)
+        elif isinstance(value, dict):
+            target[key] = _apply({}, value, False)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+class MemorySnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class MemoryDocument:
+    def __init__(self, store, path, doc_id):
+        self._store = store
+        self._path = path
+        self.id = doc_id
+
+    @property
+    def _key(self):
+        return self._path + (self.id,)
+
+    @property
+    def path(self):
+        return '/'.join(self._key)
+
+    def collection(self, name):
+        return MemoryCollection(self._store, self._key + (name,))
+
+    def set(self, data, merge=False):
+        with self._store.lock:
+            current = self._store.docs.get(self._key) if merge else None
+            self._store.docs[self._key] = _apply(current if current is not None else {}, data, merge)
+            self._store.writes += 1
+
+    def create(self, data):
+        from google.api_core.exceptions import AlreadyExists
+
+        with self._store.lock:
+            if self._key in self._store.docs:
+                raise AlreadyExists(f"Документ уже существует: {'/'.join(self._key)}")
+            self._store.docs[self._key] = _apply({}, data, False)
+            self._store.writes += 1
+
+    def update(self, data):
+        from google.api_core.exceptions import NotFound
+
+        with self._store.lock:
+            if self._key not in self._store.docs:
+                raise NotFound(f"Документ не найден: {'/'.join(self._key)}")
+            _apply(self._store.docs[self._key], data, True)
+            self._store.writes += 1
+
+    def delete(self):
+        with self._store.lock:
+            self._store.docs.pop(self._key, None)
+            self._store.writes += 1
+
+    def get(self):
+        self._store.rpc()
+        with self._store.lock:
+            return MemorySnapshot(self, copy.deepcopy(self._store.docs.get(self._key)))
+
+
+def _sortable(value):
+    """Ключ сортировки: None раньше любых значений, разные типы не сравниваются между собой"""
+    return (value is not None, type(value).__name__, value if value is not None else 0)
+
+
+def _compare(compare):
+    """Сравнение только значений одного типа: как в Firestore, строка не меньше и не больше даты"""
+    def check(value, target):
+        try:
+            return value is not None and compare(value, target)
+        except TypeError:
+            return False
+    return check
+
+
+FILTERS = {
+    '==': lambda value, target: value == target,
+    'in': lambda value, target: value in target,
+    '<': _compare(lambda value, target: value < target),
+    '<=': _compare(lambda value, target: value <= target),
+    '>': _compare(lambda value, target: value > target),
+    '>=': _compare(lambda value, target: value >= target),
+    'array_contains': lambda value, target: isinstance(value, list) and target in value,
+    'array_contains_any': lambda value, target: isinstance(value, list) and bool(set(value) & set(target)),
+}
+
+
+class MemoryAggregation:
+    def __init__(self, value):
+        self.value = value
+
+
+class MemoryCountQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        return [[MemoryAggregation(len(self._query._matching()))]]
+
+
+class MemoryQuery:
+    """Неизменяемый запрос: каждый метод возвращает новый запрос"""
+
+    def __init__(self, store, path, filters=(), orders=(), limit_count=None, fields=None, cursor=None):
+        self._store = store
+        self._path = path
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit_count
+        self._fields = fields
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        values = {'filters': self._filters, 'orders': self._orders, 'limit_count': self._limit,
+                  'fields': self._fields, 'cursor': self._cursor}
+        values.update(changes)
+        return MemoryQuery(self._store, self._path, **values)
+
+    def where(self, field, op, value):
+        if op not in FILTERS:
+            raise ValueError(f"Оператор {op} не поддерживается")
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field, str(direction).upper().endswith('DESCENDING')),))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def start_after(self, snapshot):
+        """Продолжение после документа (его может уже не быть - позиция считается по его полям)"""
+        return self._copy(cursor=(snapshot.id, snapshot.to_dict() or {}))
+
+    def count(self):
+        return MemoryCountQuery(self)
+
+    def _matching(self):
+        self._store.rpc()
+        with self._store.lock:
+            items = [(key[-1], copy.deepcopy(data)) for key, data in self._store.docs.items()
+                     if key[:-1] == self._path and
+                     all(FILTERS[op](data.get(field), value) for field, op, value in self._filters)]
+        cursor = None
+        if self._cursor is not None:
+            # Курсор ставится в общий порядок вместе с документами, берется все после него
+            cursor = (self._cursor[0], self._cursor[1], True)
+            items = [item for item in items if item[0] != cursor[0]] + [cursor]
+        items.sort(key=lambda item: item[0])
+        for field, descending in reversed(self._orders):
+            items.sort(key=lambda item: _sortable(item[1].get(field)), reverse=descending)
+        if cursor is not None:
+            items = items[items.index(cursor) + 1:]
+        return items[:self._limit] if self._limit else items
+
+    def stream(self):
+        snapshots = []
+        for doc_id, data in self._matching():
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            snapshots.append(MemorySnapshot(MemoryDocument(self._store, self._path, doc_id), data))
+        return iter(snapshots)
+
+    def get(self):
+        return list(self.stream())
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+
+    def document(self, doc_id):
+        return MemoryDocument(self._store, self._path, str(doc_id))
+
+
+class MemoryBatch:
+    """Операции копятся и применяются при commit"""
+
+    def __init__(self, store):
+        self._store = store
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append((reference.set, (data, merge)))
+
+    def create(self, reference, data):
+        self._ops.append((reference.create, (data,)))
+
+    def update(self, reference, data):
+        self._ops.append((reference.update, (data,)))
+
+    def delete(self, reference):
+        self._ops.append((reference.delete, ()))
+
+    def commit(self):
+        self._store.rpc()
+        for operation, args in self._ops:
+            operation(*args)
+        self._store.commits += 1
+        self._ops = []
+
+
+class MemoryTransaction(MemoryBatch):
+    """
+    Транзакция для firestore.transactional: блокировка хранилища берется в
+    _begin и держится до _commit / _rollback, поэтому чтения и записи
+    транзакции не пересекаются с другими потоками.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._id = None
+        self._locked = False
+
+    def _clean_up(self):
+        self._ops = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._store.rpc()
+        self._store.lock.acquire()
+        self._locked = True
+        self._id = b'memory'
+
+    def _release(self):
+        if self._locked:
+            self._locked = False
+            self._store.lock.release()
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._release()
+            self._clean_up()
+
+    def _rollback(self):
+        self._release()
+        self._clean_up()
+
+    def get_all(self, references):
+        return self._store.get_all(references)
+
+
+class MemoryFirestore:
+    """Клиент Firestore в памяти (подмножество API для записи)"""
+
+    def __init__(self, latency=0):
+        self.docs = {}
+        self.lock = threading.RLock()
+        self.latency = latency
+        self.writes = 0
+        self.commits = 0
+        self.rpcs = 0
+
+    def rpc(self):
+        """Одно обращение к серверу: счетчик и имитация сетевой задержки"""
+        with self.lock:
+            self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return MemoryCollection(self, (name,))
+
+    def batch(self):
+        return MemoryBatch(self)
+
+    def transaction(self):
+        return MemoryTransaction(self)
+
+    def get_all(self, references):
+        self.rpc()
+        with self.lock:
+            return [MemorySnapshot(reference, copy.deepcopy(self.docs.get(reference._key)))
+                    for reference in references]
+
+    def count(self, collection):
+        """Число документов коллекции верхнего уровня"""
+        with self.lock:
+            return sum(1 for key in self.docs if len(key) == 2 and key[0] == collection)
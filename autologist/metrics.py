@@ -0,0 +1,321 @@
+"""
+Метрики парсера: счетчики, датчики и гистограммы задержек
+
+Минимальная реализация в духе prometheus_client без внешних зависимостей.
+Метрики регистрируются в общем REGISTRY при импорте модуля, который их
+использует, и отдаются в текстовом формате Prometheus по HTTP
+(start_metrics_server, GET /metrics) и словарем для get_stats()
+(GET /stats).
+
+Запись значения - перевод метки в ключ, блокировка и сложение; замер
+времени - два вызова perf_counter. Этого достаточно, чтобы оставлять
+таймеры включенными в рабочем режиме.
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP сервера метрик парсера; 0 - не запускать
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Границы корзин задержек (секунды): от 0.1 мс до 10 с
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Bound:
+    """Метрика с зафиксированными значениями меток"""
+
+    def __init__(self, metric, key):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount=1):
+        self._metric._inc(self._key, amount)
+
+    def set(self, value):
+        self._metric._set(self._key, value)
+
+    def observe(self, value):
+        self._metric._observe(self._key, value)
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Контекстный менеджер замера длительности (работает и вокруг await)"""
+
+    def __init__(self, target):
+        self._target = target
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._target.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._bound = {}
+
+    def labels(self, *values, **named):
+        """Метрика для конкретных значений меток (объект кэшируется)"""
+        key = tuple(str(value) for value in values) if values else \
+            tuple(str(named[name]) for name in self.labelnames)
+        bound = self._bound.get(key)
+        if bound is None:
+            bound = self._bound.setdefault(key, _Bound(self, key))
+        return bound
+
+    def inc(self, amount=1):
+        self._inc((), amount)
+
+    def set(self, value):
+        self._set((), value)
+
+    def observe(self, value):
+        self._observe((), value)
+
+    def time(self):
+        return _Timer(_Bound(self, ()))
+
+    def _inc(self, key, amount):
+        raise TypeError(f"{self.kind} {self.name} не поддерживает inc")
+
+    def _set(self, key, value):
+        raise TypeError(f"{self.kind} {self.name} не поддерживает set")
+
+    def _observe(self, key, value):
+        raise TypeError(f"{self.kind} {self.name} не поддерживает observe")
+
+    def samples(self):
+        """[(суффикс имени, значения меток, доп. метка, значение)]"""
+        with self._lock:
+            return [('', key, None, value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+        if not self.labelnames:
+            return values.get((), 0)
+        return {','.join(key): value for key, value in sorted(values.items())}
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = 'counter'
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией при чтении"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_function(self, function, *labelvalues):
+        """Значение берется из function() при каждом чтении"""
+        self._functions[tuple(str(value) for value in labelvalues)] = function
+
+    def _refresh(self):
+        for key, function in list(self._functions.items()):
+            try:
+                value = function()
+            except Exception as e:
+                logger.debug(f"Датчик {self.name} не прочитан: {e}")
+                continue
+            self._set(key, value)
+
+    def samples(self):
+        self._refresh()
+        return super().samples()
+
+    def snapshot(self):
+        self._refresh()
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    """Распределение значений по фиксированным корзинам"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _observe(self, key, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            states = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._values.items())]
+        result = []
+        for key, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                result.append(('_bucket', key, ('le', _format_value(bound)), cumulative))
+            result.append(('_sum', key, None, total))
+            result.append(('_count', key, None, count))
+        return result
+
+    def quantile(self, counts, count, quantile):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        target = quantile * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets + (self.buckets[-1],), counts):
+            if bucket_count and cumulative + bucket_count >= target:
+                return lower + (bound - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            states = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        summary = {}
+        for key, (counts, total, count) in sorted(states.items()):
+            summary[','.join(key)] = {
+                'count': count,
+                'mean_ms': round(total / count * 1000, 3) if count else 0,
+                'p50_ms': round(self.quantile(counts, count, 0.5) * 1000, 3) if count else 0,
+                'p95_ms': round(self.quantile(counts, count, 0.95) * 1000, 3) if count else 0,
+                'total_s': round(total, 3)
+            }
+        return summary if self.labelnames else summary.get('', {})
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for suffix, key, extra, value in metric.samples():
+                lines.append(f"{name}{suffix}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Значения всех метрик словарем (для get_stats и /stats)"""
+        return {name: metric.snapshot() for name, metric in sorted(self._metrics.items())}
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.startswith('/metrics'):
+            body = self.registry.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.startswith('/stats'):
+            body = json.dumps(self.registry.snapshot(), ensure_ascii=False, default=str).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Опросы Prometheus не пишутся в лог парсера
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, registry=REGISTRY, host='127.0.0.1'):
+    """HTTP сервер метрик в фоновом потоке; None, если порт 0 или занят"""
+    if not port:
+        return None
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.warning(f"⚠️  Сервер метрик не запущен на порту {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,217 @@
+"""
+Движок массового переноса документов в Firestore
+
+Документы пишутся пакетами (до 500 операций на batch - лимит Firestore),
+пакеты коммитятся параллельно несколькими потоками. Прогресс сохраняется
+в файл контрольной точки, поэтому прерванный перенос можно продолжить.
+Идентификатор документа стабилен (для сообщений - поле hash), так что
+повторный запуск перезаписывает те же документы, а не создает копии.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число операций в одном batch Firestore
+MAX_BATCH_SIZE = 500
+
+# Сколько документов читать за один вызов get_all при проверке
+VERIFY_CHUNK_SIZE = 300
+
+
+def message_doc_id(message):
+    """Стабильный ID документа сообщения: hash, затем id, затем отпечаток чата и текста"""
+    if message.get('hash'):
+        return str(message['hash'])
+    if message.get('id'):
+        return str(message['id'])
+    hash_string = f"{message.get('chat_id', '')}_{message.get('message_id', '')}_{message.get('text', '')}"
+    return hashlib.md5(hash_string.encode()).hexdigest()
+
+
+def chat_doc_id(chat):
+    """ID документа отслеживаемого чата"""
+    return str(chat.get('chat_id'))
+
+
+def chunked(items, size):
+    """Разбиение списка на части не длиннее size"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class MigrationCheckpoint:
+    """
+    Файл контрольной точки: множество уже записанных ID документов.
+    Каждый вызов mark дописывает в конец файла одну строку {"done": [...]}
+    (JSON Lines), а не переписывает все множество, поэтому отметка не
+    дорожает с ростом числа записанных документов. Прежний формат - один
+    объект {"done": [...]} - читается как файл из одной строки.
+
+    version - отпечаток условий прогона (например, настроек фильтров): он
+    пишется первой строкой, и точка с другим отпечатком не используется -
+    прогон начинается заново.
+    """
+
+    def __init__(self, path, version=None):
+        self.path = path
+        self.version = version
+        self.done = set()
+        self._lock = threading.Lock()
+        self._torn = False
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        saved_version = None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self._torn = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Строка, недописанная при аварийной остановке: эти ID будут записаны повторно
+                    logger.warning(f"⚠️  Пропущена поврежденная строка контрольной точки {self.path}")
+                    continue
+                saved_version = record.get('version', saved_version)
+                self.done.update(record.get('done', []))
+        if self.version is not None and saved_version != self.version:
+            logger.info(f"🔄 Контрольная точка {self.path} создана при других условиях: начинаем заново")
+            self.reset()
+
+    def mark(self, doc_ids):
+        """Отметить ID как записанные: одна строка в конец файла"""
+        if not self.path:
+            return
+        with self._lock:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id not in self.done]
+            if not doc_ids:
+                return
+            self.done.update(doc_ids)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            header = json.dumps({'version': self.version}) + '\n' \
+                if self.version is not None and not os.path.exists(self.path) else ''
+            with open(self.path, 'a', encoding='utf-8') as f:
+                # После недописанной строки - с новой строки, чтобы не испортить и эту
+                f.write(('\n' if self._torn else '') + header + json.dumps({'done': doc_ids}) + '\n')
+            self._torn = False
+
+    def reset(self):
+        """Удалить контрольную точку и начать перенос заново"""
+        with self._lock:
+            self.done = set()
+            self._torn = False
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class MigrationEngine:
+    """Параллельная идемпотентная запись документов в коллекцию Firestore"""
+
+    def __init__(self, db, collection, id_func, batch_size=MAX_BATCH_SIZE, workers=4,
+                 checkpoint_path=None, transform=None, max_retries=3):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size должен быть от 1 до {MAX_BATCH_SIZE}")
+        self.db = db
+        self.collection = collection
+        self.id_func = id_func
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.checkpoint = MigrationCheckpoint(checkpoint_path)
+        self.transform = transform
+        self.max_retries = max_retries
+
+    def plan(self, records):
+        """
+        Подготовка документов к записи.
+        Дубликаты по ID схлопываются (побеждает последний), уже записанные
+        по контрольной точке исключаются.
+        """
+        documents = {}
+        total = 0
+        for record in records:
+            total += 1
+            data = self.transform(record) if self.transform else record
+            documents[self.id_func(record)] = data
+
+        pending = [(doc_id, data) for doc_id, data in documents.items()
+                   if doc_id not in self.checkpoint.done]
+        report = {
+            'total': total,
+            'unique': len(documents),
+            'duplicates': total - len(documents),
+            'already_done': len(documents) - len(pending),
+            'pending': len(pending),
+            'batches': (len(pending) + self.batch_size - 1) // self.batch_size
+        }
+        return pending, report
+
+    def dry_run(self, records):
+        """Подсчет того, что будет записано, без обращения к Firestore"""
+        _, report = self.plan(records)
+        return report
+
+    def run(self, records):
+        """Запись документов; возвращает отчет с количеством записанных и ошибок"""
+        pending, report = self.plan(records)
+        report.update({'written': 0, 'failed': 0, 'failed_ids': []})
+        if not pending:
+            return report
+
+        started = time.time()
+        batches = list(chunked(pending, self.batch_size))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._commit_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                ids = [doc_id for doc_id, _ in batch]
+                try:
+                    future.result()
+                    self.checkpoint.mark(ids)
+                    report['written'] += len(ids)
+                except Exception as e:
+                    logger.error(f"❌ Пакет из {len(ids)} документов не записан: {e}")
+                    report['failed'] += len(ids)
+                    report['failed_ids'].extend(ids)
+                done = report['written'] + report['failed']
+                elapsed = max(time.time() - started, 1e-6)
+                logger.info(f"⏳ {self.collection}: {done}/{len(pending)} "
+                            f"({report['written'] / elapsed:.0f} док/с)")
+
+        report['elapsed'] = round(time.time() - started, 2)
+        return report
+
+    def _commit_batch(self, batch):
+        """Коммит одного пакета с повторами и экспоненциальной задержкой"""
+        collection_ref = self.db.collection(self.collection)
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                write_batch = self.db.batch()
+                for doc_id, data in batch:
+                    write_batch.set(collection_ref.document(doc_id), data)
+                write_batch.commit()
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = 2 ** (attempt - 1)
+                logger.warning(f"⚠️  Ошибка коммита ({e}), повтор через {delay} с")
+                time.sleep(delay)
+
+    def verify(self, doc_ids):
+        """Проверка, что все документы существуют в Firestore; возвращает список отсутствующих"""
+        collection_ref = self.db.collection(self.collection)
+        missing = []
+        for chunk in chunked(list(doc_ids), VERIFY_CHUNK_SIZE):
+            refs = [collection_ref.document(doc_id) for doc_id in chunk]
+            found = {snapshot.id for snapshot in self.db.get_all(refs) if snapshot.exists}
+            missing.extend(doc_id for doc_id in chunk if doc_id not in found)
+        return missing
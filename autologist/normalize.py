@@ -0,0 +1,155 @@
+"""
+Единая нормализация текста сообщения
+
+Текст объявления разбирается один раз: чистая форма (без эмодзи, с единым
+видом стрелок маршрута, исправленными латинскими "двойниками" кириллицы и
+схлопнутыми пробелами, но с сохраненными переносами строк), форма для
+сравнения (нижний регистр, ё -> е), слова и телефоны. Результат кэшируется
+по тексту и прикрепляется к объекту сообщения, поэтому дедупликация, поиск
+ключевых слов, извлечение заявок и индексы используют уже готовые данные.
+"""
+
+import os
+import re
+import hashlib
+import unicodedata
+from functools import lru_cache
+
+from autologist.keywords import normalize_token, tokenize
+
+# Атрибут, под которым результат прикрепляется к объекту сообщения Telethon
+MESSAGE_ATTRIBUTE = 'autologist_normalized'
+
+# Эмодзи-стрелки, которые в объявлениях разделяют города маршрута
+ARROWS_RE = re.compile(r'(?:➡️|➡|▶️|▶|⏩|⤵️|👉|→|⟶|⇒|►)')
+# Эмодзи, флаги, пиктограммы и модификаторы (вариации, ZWJ, тон кожи)
+EMOJI_RE = re.compile(
+    '[\U0001F000-\U0001FAFF\U00002600-\U000027BF\U00002B00-\U00002BFF\U0001F1E6-\U0001F1FF'
+    '\u2300-\u23FF\u25A0-\u25FF\uFE0F\uFE0E\u200D\u20E3]'
+)
+SPACES_RE = re.compile('[ \t\u00A0\u2000-\u200B\u202F\u205F\u3000]+')
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile('[а-яё]', re.IGNORECASE)
+
+# Латинские буквы, которые пишут вместо похожих кириллических ("Тoнн" с латинской o)
+HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'c': 'с', 'e': 'е', 'o': 'о', 'p': 'р', 'x': 'х', 'y': 'у', 'k': 'к',
+    'A': 'А', 'B': 'В', 'C': 'С', 'E': 'Е', 'H': 'Н', 'K': 'К', 'M': 'М', 'O': 'О',
+    'P': 'Р', 'T': 'Т', 'X': 'Х', 'Y': 'У'
+})
+LATIN_LETTERS = set('acepoxykABCEHKMOPTXY')
+
+# Телефон: +7 701 015 51 50, 8(705)349-60-05, +86 138 1234 5678
+PHONE_RE = re.compile(r'(?<![\d])(\+?\d[\d \t().\-]{8,18}\d)(?![\d])')
+# Даты и время, похожие на телефон: 2025-10-30, 03.11, 12:30
+NOT_PHONE_RE = re.compile(r'\d{4}-\d{2}-\d{2}|\d{1,2}\.\d{2}(?:\.|\D|$)')
+PHONE_MIN_DIGITS = 10
+PHONE_MAX_DIGITS = 15
+# Код страны для номеров без него (8 701..., 701...)
+DEFAULT_PHONE_COUNTRY = os.getenv('DEFAULT_PHONE_COUNTRY', '7')
+
+
+def _fix_homoglyphs(match):
+    """Латинские двойники заменяются только в словах, где уже есть кириллица"""
+    word = match.group(0)
+    if CYRILLIC_RE.search(word) and any(ch in LATIN_LETTERS for ch in word):
+        return word.translate(HOMOGLYPHS)
+    return word
+
+
+def clean_text(text):
+    """Чистая форма текста с сохранением строк"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = ARROWS_RE.sub(' → ', text)
+    text = EMOJI_RE.sub(' ', text)
+    text = WORD_RE.sub(_fix_homoglyphs, text)
+    lines = (SPACES_RE.sub(' ', line).strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def fold(text):
+    """Форма для сравнения: нижний регистр, ё -> е"""
+    return normalize_token(text or '')
+
+
+def to_e164(phone, default_country=None):
+    """
+    Телефон в формате E.164 (+77010155150) или None.
+    Местные форматы: 8XXXXXXXXXX и 10 цифр без кода - номера с кодом страны по умолчанию,
+    11 цифр с первой 1 - мобильный Китая
+    """
+    default_country = default_country or DEFAULT_PHONE_COUNTRY
+    explicit = str(phone).strip().startswith('+')
+    digits = re.sub(r'\D', '', str(phone))
+    if not explicit:
+        if default_country == '7' and len(digits) == 11 and digits[0] == '8':
+            digits = '7' + digits[1:]
+        elif len(digits) == 10 and digits[0] != '0':
+            digits = default_country + digits
+        elif len(digits) == 11 and digits[0] == '1':
+            # Мобильные номера Китая (пограничные переходы) пишут без +86
+            digits = '86' + digits
+        elif digits.startswith('00'):
+            digits = digits[2:]
+    if not PHONE_MIN_DIGITS <= len(digits) <= PHONE_MAX_DIGITS or digits[0] == '0':
+        return None
+    if digits[0] == '7' and len(digits) != 11:
+        return None
+    return f"+{digits}"
+
+
+def extract_phones(text):
+    """Телефоны в формате E.164 в порядке появления"""
+    phones = []
+    for match in PHONE_RE.finditer(text or ''):
+        if NOT_PHONE_RE.search(match.group(1)):
+            continue
+        phone = to_e164(match.group(1))
+        if phone and phone not in phones:
+            phones.append(phone)
+    return phones
+
+
+class NormalizedText:
+    """Результат нормализации одного текста"""
+
+    __slots__ = ('raw', 'clean', 'folded', 'tokens', 'phones')
+
+    def __init__(self, raw, clean, folded, tokens, phones):
+        self.raw = raw
+        self.clean = clean
+        self.folded = folded
+        self.tokens = tokens
+        self.phones = phones
+
+    def dedup_key(self):
+        """Текст для хеша дедупликации: одинаковые объявления с разными эмодзи и пробелами совпадают"""
+        return ' '.join(self.folded.split())
+
+
+@lru_cache(maxsize=4096)
+def normalize_text(text):
+    """Нормализация текста (кэшируется: одно объявление часто приходит в несколько чатов)"""
+    clean = clean_text(text)
+    folded = fold(clean)
+    return NormalizedText(
+        raw=text,
+        clean=clean,
+        folded=folded,
+        tokens=tuple(tokenize(folded)),
+        phones=tuple(extract_phones(clean))
+    )
+
+
+def message_hash(dedup_key, sender_id, chat_id):
+    """Хеш дедупликации сообщения (он же ID документа messages/{hash})"""
+    return hashlib.md5(f"{dedup_key}_{sender_id}_{chat_id}".encode()).hexdigest()
+
+
+def normalize_message(message):
+    """Нормализованный текст сообщения Telethon, вычисленный один раз и прикрепленный к сообщению"""
+    normalized = getattr(message, MESSAGE_ATTRIBUTE, None)
+    if normalized is None or normalized.raw != message.text:
+        normalized = normalize_text(message.text or '')
+        setattr(message, MESSAGE_ATTRIBUTE, normalized)
+    return normalized
@@ -0,0 +1,103 @@
+"""
+Блокирующие вызовы API в ограниченном пуле потоков
+
+Маршруты Flask читают Firestore и ходят в Telegram синхронно: один
+медленный вызов держит поток сервера, пока не закончится. BackendPool
+выполняет такие вызовы в общем пуле потоков и ограничивает три вещи:
+
+    время       вызов дольше таймаута маршрута -> BackendTimeout (504),
+                поток сервера освобождается сразу
+    очередь     не больше workers + queue вызовов одновременно, остальные
+                сразу получают BackendBusy (503), а не копятся в памяти
+    дубликаты   одинаковые параллельные запросы (один ключ) ждут один
+                вызов и получают общий результат (singleflight)
+
+Вызов, который не уложился в таймаут, продолжает выполняться в пуле
+(прервать поток нельзя) и занимает место в очереди до своего завершения.
+Поэтому зависший Firestore не может создать больше потоков, чем задано.
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+API_BACKEND_WORKERS = int(os.getenv('API_BACKEND_WORKERS', '8'))
+API_BACKEND_QUEUE = int(os.getenv('API_BACKEND_QUEUE', '64'))
+API_TIMEOUT_SECONDS = float(os.getenv('API_TIMEOUT_SECONDS', '10'))
+
+
+class BackendError(Exception):
+    """Ошибка вызова в пуле; status - HTTP код ответа"""
+    status = 500
+
+
+class BackendTimeout(BackendError):
+    status = 504
+
+
+class BackendBusy(BackendError):
+    status = 503
+
+
+class BackendPool:
+    def __init__(self, workers=API_BACKEND_WORKERS, queue=API_BACKEND_QUEUE, timeout=API_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.timeout = timeout
+        self.coalesce = True
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {'calls': 0, 'coalesced': 0, 'timeouts': 0, 'rejected': 0}
+
+    def _pool(self):
+        # Потоки создаются при первом вызове (под self._lock): импорт app.py их не запускает
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='api-backend')
+        return self._executor
+
+    def _finished(self, key, future):
+        self._slots.release()
+        if key is not None:
+            with self._lock:
+                # Ключ мог уже занять более новый вызов - его не трогаем
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def submit(self, fn, *args, key=None):
+        """Future вызова; с ключом - общий Future уже выполняющегося такого же вызова"""
+        if not self.coalesce:
+            key = None
+        with self._lock:
+            if key is not None and key in self._inflight:
+                self.stats['coalesced'] += 1
+                return self._inflight[key]
+            if not self._slots.acquire(blocking=False):
+                self.stats['rejected'] += 1
+                raise BackendBusy('Сервер перегружен, повторите запрос позже')
+            self.stats['calls'] += 1
+            try:
+                future = self._pool().submit(fn, *args)
+            except Exception:
+                self._slots.release()
+                raise
+            if key is not None:
+                self._inflight[key] = future
+        # Вне блокировки: если вызов уже завершился, callback выполнится сразу в этом потоке
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def call(self, fn, *args, key=None, timeout=None):
+        """Результат вызова или BackendTimeout, если он не уложился в timeout секунд"""
+        future = self.submit(fn, *args, key=key)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.stats['timeouts'] += 1
+            name = getattr(fn, '__name__', repr(fn))
+            logger.warning(f"⏱️ {name}: нет ответа за {timeout or self.timeout} с")
+            raise BackendTimeout(f'Нет ответа за {timeout or self.timeout} с')
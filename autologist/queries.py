@@ -0,0 +1,173 @@
+"""
+Слой запросов к сообщениям Firestore
+
+Для каждой комбинации фильтров выбирается путь, для которого есть индекс:
+выборки всегда сортируются по timestamp DESC, чтобы все варианты
+(чат + период, хэш + период, чат + корзина) обслуживались одним составным
+индексом на набор полей равенства. Подсчеты по корзинам day / week / month -
+запросы на равенство без сортировки. Нужные индексы объявлены в
+firestore.indexes.json, а required_index() позволяет проверить, что для
+плана запроса индекс действительно объявлен.
+"""
+
+import json
+import heapq
+
+# Файл с объявленными индексами (firebase deploy --only firestore:indexes)
+INDEXES_FILE = 'firestore.indexes.json'
+
+# Ограничение Firestore на число значений в фильтре 'in'
+MAX_IN_VALUES = 30
+
+DESCENDING = 'DESCENDING'
+
+
+class MessageQuery:
+    """
+    Запрос к сообщениям с необязательными фильтрами по чатам, периоду, хэшу
+    и временным корзинам (day / week / month - равенство по готовому полю).
+    """
+
+    def __init__(self, chat_ids=None, since=None, until=None, message_hash=None,
+                 day=None, week=None, month=None, limit=50, collection='messages'):
+        self.chat_ids = [str(chat_id) for chat_id in chat_ids] if chat_ids else []
+        self.since = since
+        self.until = until
+        self.message_hash = message_hash
+        self.buckets = [(field, value) for field, value in
+                        (('day', day), ('week', week), ('month', month)) if value]
+        self.limit = limit
+        self.collection = collection
+
+    def plans(self):
+        """
+        Планы запросов: словари с фильтрами равенства, границами периода и сортировкой.
+        Больше 30 чатов разбиваются на несколько запросов 'in', результаты сливаются.
+        """
+        base = {'collection': self.collection, 'since': self.since, 'until': self.until,
+                'order_by': 'timestamp', 'limit': self.limit}
+        if self.message_hash:
+            return [dict(base, filters=[('hash', '==', self.message_hash)])]
+        filters = [(field, '==', value) for field, value in self.buckets]
+        if not self.chat_ids:
+            return [dict(base, filters=filters)]
+        if len(self.chat_ids) == 1:
+            return [dict(base, filters=[('chat_id', '==', self.chat_ids[0])] + filters)]
+        return [dict(base, filters=[('chat_id', 'in', self.chat_ids[i:i + MAX_IN_VALUES])] + filters)
+                for i in range(0, len(self.chat_ids), MAX_IN_VALUES)]
+
+    def build(self, db, plan):
+        """Построение запроса Firestore по плану"""
+        query = db.collection(plan['collection'])
+        for field, op, value in plan['filters']:
+            query = query.where(field, op, value)
+        if plan['since'] is not None:
+            query = query.where('timestamp', '>=', plan['since'])
+        if plan['until'] is not None:
+            query = query.where('timestamp', '<', plan['until'])
+        if plan['order_by']:
+            query = query.order_by(plan['order_by'], direction=DESCENDING)
+        if plan['limit']:
+            query = query.limit(plan['limit'])
+        return query
+
+    def fetch(self, db):
+        """Выполнение запроса; возвращает список словарей, новые сверху"""
+        results = []
+        for plan in self.plans():
+            results.append([doc.to_dict() for doc in self.build(db, plan).stream()])
+        if len(results) == 1:
+            return results[0]
+        merged = heapq.merge(*results, key=_sort_key, reverse=True)
+        messages = list(merged)
+        return messages[:self.limit] if self.limit else messages
+
+    def count_plans(self):
+        """
+        Планы для подсчета: без лимита, а без диапазона по времени и без сортировки.
+        Одни только равенства Firestore обслуживает слиянием одиночных индексов.
+        """
+        plans = []
+        for plan in self.plans():
+            has_range = plan['since'] is not None or plan['until'] is not None
+            plans.append(dict(plan, order_by=plan['order_by'] if has_range else None, limit=None))
+        return plans
+
+    def count(self, db):
+        """
+        Количество документов по запросу (агрегация на стороне сервера).
+        Подсчет по корзине без других фильтров обслуживается одиночным индексом.
+        """
+        total = 0
+        for plan in self.count_plans():
+            total += self.build(db, plan).count().get()[0][0].value
+        return total
+
+
+def _sort_key(message):
+    value = message.get('timestamp')
+    return value if value is not None else ''
+
+
+def required_index(plan):
+    """
+    Составной индекс, необходимый для плана, в формате firestore.indexes.json.
+    None - запрос обслуживается автоматическими одиночными индексами.
+    """
+    if not plan['filters'] or not plan['order_by']:
+        return None
+    fields = [{'fieldPath': field, 'arrayConfig': 'CONTAINS'} if op.startswith('array_contains')
+              else {'fieldPath': field, 'order': 'ASCENDING'} for field, op, _ in plan['filters']]
+    fields.append({'fieldPath': plan['order_by'], 'order': DESCENDING})
+    return {
+        'collectionGroup': plan['collection'],
+        'queryScope': 'COLLECTION',
+        'fields': fields
+    }
+
+
+def load_declared_indexes(path=INDEXES_FILE):
+    """Индексы из firestore.indexes.json"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('indexes', [])
+
+
+def _index_key(index):
+    return (index['collectionGroup'], index.get('queryScope', 'COLLECTION'),
+            tuple((field['fieldPath'], field.get('order') or field.get('arrayConfig'))
+                  for field in index['fields']))
+
+
+def missing_indexes(plans, declared=None):
+    """Индексы, которые нужны планам, но не объявлены"""
+    declared_keys = {_index_key(index) for index in (declared if declared is not None
+                                                     else load_declared_indexes())}
+    missing = []
+    for plan in plans:
+        index = required_index(plan)
+        if index and _index_key(index) not in declared_keys and index not in missing:
+            missing.append(index)
+    return missing
+
+
+def access_patterns(collection='messages'):
+    """Все комбинации фильтров, которые использует API (для проверки индексов)"""
+    patterns = []
+    for chat_ids in (None, ['1'], [str(i) for i in range(MAX_IN_VALUES + 1)]):
+        for since, until in ((None, None), ('since', None), ('since', 'until')):
+            patterns.append(MessageQuery(chat_ids=chat_ids, since=since, until=until,
+                                         collection=collection))
+        patterns.append(MessageQuery(chat_ids=chat_ids, day='bucket', collection=collection))
+    for bucket in ('week', 'month'):
+        patterns.append(MessageQuery(collection=collection, **{bucket: 'bucket'}))
+    patterns.append(MessageQuery(message_hash='hash', since='since', limit=1, collection=collection))
+    return patterns
+
+
+def all_plans(collection='messages'):
+    """Планы выборки и подсчета для всех комбинаций фильтров"""
+    plans = []
+    for query in access_patterns(collection):
+        plans.extend(query.plans())
+        plans.extend(query.count_plans())
+    return plans
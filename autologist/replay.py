@@ -0,0 +1,87 @@
+"""
+Подача сообщений в парсер без Telegram
+
+Объекты с интерфейсом событий Telethon, которые использует
+TelegramParser.process_message, и виртуальные часы. Используются
+воспроизведением записанного потока (scripts/replay_capture.py) и
+нагрузочным бенчмарком (scripts/benchmark_parser.py).
+"""
+
+from datetime import datetime, timezone
+
+from autologist.timebuckets import parse_timestamp
+
+
+class FakeChat:
+    def __init__(self, chat_id, title, megagroup=True, broadcast=False):
+        self.id = chat_id
+        self.title = title
+        self.megagroup = megagroup
+        self.broadcast = broadcast
+
+
+class FakeSender:
+    def __init__(self, sender_id, username=None, first_name=None, last_name=None, title=None):
+        self.id = sender_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        if title is not None:
+            self.title = title
+
+
+class FakeMessage:
+    def __init__(self, message_id, text, date, sender):
+        self.id = message_id
+        self.text = text
+        self.date = date
+        self.sender = sender
+        self.sender_id = sender.id if sender is not None else None
+
+    async def get_sender(self):
+        return self.sender
+
+
+class FakeEvent:
+    def __init__(self, chat, message):
+        self.chat = chat
+        self.message = message
+
+    async def get_chat(self):
+        return self.chat
+
+
+class FakeClient:
+    """Заглушка TelegramClient: к Telegram не подключается"""
+
+    async def disconnect(self):
+        pass
+
+
+def event_from_record(record):
+    """Событие из записи autologist.capture"""
+    chat = FakeChat(record['chat_id'], record.get('chat_title'), record.get('megagroup', True),
+                    record.get('broadcast', False))
+    sender = None
+    if record.get('sender_id') is not None:
+        sender = FakeSender(record['sender_id'], record.get('sender_username'), record.get('sender_first_name'),
+                            record.get('sender_last_name'), record.get('sender_title'))
+    return FakeEvent(chat, FakeMessage(record.get('message_id'), record.get('text'),
+                                       parse_timestamp(record.get('date')), sender))
+
+
+class ReplayClock:
+    """
+    Виртуальные часы: "сейчас" - время получения текущего воспроизводимого
+    сообщения, поэтому created_at и корзины не зависят от момента прогона.
+    """
+
+    def __init__(self, start=None):
+        self.current = start or datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def advance(self, moment):
+        if moment is not None and moment > self.current:
+            self.current = moment
+
+    def __call__(self):
+        return self.current
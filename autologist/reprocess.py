@@ -0,0 +1,451 @@
+"""
+Переобработка архива сообщений текущими фильтрами
+
+Изменение ключевых слов чата действует только на новые сообщения. Движок
+прогоняет уже сохраненный архив (Firestore или data/messages) и/или запись
+входящего потока (autologist.capture) через текущие настройки чатов: поиск
+ключевых слов, хеш дедупликации, извлечение заявок и телефонов - так же,
+как это делает парсер.
+
+Записываются только различия:
+    - у сохраненного сообщения изменились keywords_found / cargos / phones -
+      обновляются только эти поля;
+    - сохраненное сообщение больше не проходит фильтр или повторяет уже
+      встреченное - удаляется (только с delete_rejected, иначе считается);
+    - сообщение из записи потока теперь проходит фильтр, а в архиве его нет -
+      добавляется, как его сохранил бы парсер.
+
+Сообщения отключенных чатов и чатов, которых нет в настройках, не
+переобрабатываются и никогда не удаляются (skipped_chat). Из сообщений с
+одинаковым новым hash остается самое раннее по timestamp (при равенстве -
+с меньшим ключом) независимо от того, в каком порядке обработаны части:
+дубликаты архива удаляются после сканирования, а сообщения записи потока
+добавляются после выбора.
+
+Архив читается частями (страницы сканера Firestore или пачки файлов),
+части обрабатываются параллельно и пишутся пакетами до 500 операций.
+Обработанные ключи сохраняются в контрольную точку, поэтому прерванный
+прогон продолжается с места остановки. Точка помечена отпечатком настроек
+фильтров (при их изменении прогон начинается заново) и удаляется после
+прогона без ошибок. Индекс маршрутов обновляется для
+добавленных и измененных сообщений, статистика и контакты - только для
+добавленных (их счетчики не идемпотентны).
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from datetime import datetime, timezone
+
+from autologist.extraction import extract_cargos
+from autologist.keywords import matcher_for_chat
+from autologist.local_store import LOCAL_MESSAGES_DIR, iter_local_messages
+from autologist.migration import MAX_BATCH_SIZE, VERIFY_CHUNK_SIZE, MigrationCheckpoint, chunked
+from autologist.normalize import message_hash, normalize_text
+from autologist.scan import CollectionScanner
+from autologist.sharding import canonical_chat_id
+from autologist.timebuckets import json_default, parse_timestamp, time_buckets, with_native_times
+
+logger = logging.getLogger(__name__)
+
+REPROCESS_CHECKPOINT_PATH = 'data/.reprocess_checkpoint.json'
+
+# Сколько сообщений в одной части при обработке файлов и записи потока
+REPROCESS_CHUNK_SIZE = 500
+
+# Поля, которые пересчитываются и сравниваются с сохраненными
+RESULT_FIELDS = ('keywords_found', 'cargos', 'phones')
+
+# Сколько примеров различий хранить для отчета
+MAX_EXAMPLES = 20
+
+# Сообщения без времени при выборе среди дубликатов считаются самыми поздними
+LATEST = datetime.max.replace(tzinfo=timezone.utc)
+
+
+class ChatFilters:
+    """Текущие настройки чатов по каноническому ID с кэшем матчеров"""
+
+    def __init__(self, chats):
+        self.chats = {canonical_chat_id(chat['chat_id']): chat for chat in chats if chat.get('chat_id')}
+        self.matchers = {}
+
+    def fingerprint(self):
+        """Отпечаток настроек, от которых зависит результат: ID, включен, ключевые слова, режим"""
+        relevant = sorted((chat_id, bool(chat.get('enabled', True)), chat.get('match_mode') or '',
+                           list(chat.get('keywords') or [])) for chat_id, chat in self.chats.items())
+        return hashlib.sha1(json.dumps(relevant, ensure_ascii=False).encode()).hexdigest()
+
+    def config(self, chat_id):
+        """Настройки включенного чата или None"""
+        chat = self.chats.get(canonical_chat_id(chat_id))
+        if chat is None or not chat.get('enabled', True):
+            return None
+        return chat
+
+
+def evaluate(message, filters):
+    """
+    Результат текущих фильтров для сообщения: None, если оно не проходит,
+    иначе hash, keywords_found, cargos и phones
+    """
+    text = message.get('text')
+    chat_config = filters.config(message.get('chat_id'))
+    if not text or chat_config is None:
+        return None
+    normalized = normalize_text(text)
+    found_keywords = matcher_for_chat(chat_config, filters.matchers).match(text, normalized)
+    if not found_keywords:
+        return None
+    return {
+        'hash': message_hash(normalized.dedup_key(), str(message.get('sender_id')), str(message.get('chat_id'))),
+        'keywords_found': found_keywords,
+        'cargos': extract_cargos(normalized.clean),
+        'phones': list(normalized.phones)
+    }
+
+
+def changed_fields(stored, result):
+    """Пересчитанные поля, отличающиеся от сохраненных (сравнение в JSON представлении)"""
+    changes = {}
+    for field in RESULT_FIELDS:
+        before = json.dumps(stored.get(field), sort_keys=True, default=json_default)
+        after = json.dumps(result[field], sort_keys=True, default=json_default)
+        if before != after:
+            changes[field] = result[field]
+    return changes
+
+
+def message_from_record(record, received_at=None):
+    """Документ сообщения из записи потока - те же поля, что пишет парсер"""
+    sender_name = record.get('sender_first_name') or record.get('sender_title') or ''
+    if record.get('sender_first_name') and record.get('sender_last_name'):
+        sender_name += f" {record['sender_last_name']}"
+    timestamp = parse_timestamp(record.get('date')) or parse_timestamp(record.get('received_at'))
+    message = {
+        'text': record.get('text'),
+        'source': 'telegram',
+        'chat_id': str(record.get('chat_id')),
+        'chat_title': record.get('chat_title'),
+        'message_id': str(record.get('message_id')),
+        'sender_id': str(record['sender_id']) if record.get('sender_id') else None,
+        'sender_name': sender_name,
+        'sender_username': record.get('sender_username') or '',
+        'timestamp': timestamp,
+        'processed': False,
+        'created_at': received_at or datetime.now(timezone.utc)
+    }
+    message.update(time_buckets(timestamp))
+    return message
+
+
+class FirestoreArchive:
+    """Сообщения в коллекции messages (ID документа - hash)"""
+
+    def __init__(self, db, collection='messages'):
+        self.db = db
+        self.collection = collection
+
+    def scan(self, handle_chunk, workers):
+        """Параллельное сканирование по разделам: handle_chunk([(ID документа, данные)])"""
+        scanner = CollectionScanner(self.db, self.collection, workers=workers)
+        scanner.run(lambda snapshots: handle_chunk([(snapshot.id, snapshot.to_dict() or {})
+                                                     for snapshot in snapshots]))
+
+    def existing(self, hashes):
+        """Какие из хешей уже есть в архиве"""
+        collection_ref = self.db.collection(self.collection)
+        found = set()
+        for chunk in chunked(list(hashes), VERIFY_CHUNK_SIZE):
+            refs = [collection_ref.document(doc_hash) for doc_hash in chunk]
+            found.update(snapshot.id for snapshot in self.db.get_all(refs) if snapshot.exists)
+        return found
+
+    def apply(self, updates, deletes, adds):
+        """updates: [(ID, поля)], deletes: [ID], adds: [(hash, документ)] - пакетами до 500 операций"""
+        collection_ref = self.db.collection(self.collection)
+        writes = ([('update', doc_id, fields) for doc_id, fields in updates] +
+                  [('delete', doc_id, None) for doc_id in deletes] +
+                  [('set', doc_id, with_native_times(data)) for doc_id, data in adds])
+        for chunk in chunked(writes, MAX_BATCH_SIZE):
+            batch = self.db.batch()
+            for op, doc_id, data in chunk:
+                ref = collection_ref.document(doc_id)
+                if op == 'update':
+                    batch.update(ref, data)
+                elif op == 'delete':
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data)
+            batch.commit()
+
+
+class LocalArchive:
+    """Сообщения в data/messages (ключ - имя файла)"""
+
+    def __init__(self, directory=LOCAL_MESSAGES_DIR):
+        self.directory = directory
+        self._hashes = None
+        self._lock = threading.Lock()
+
+    def scan(self, handle_chunk, workers):
+        """Файлы читаются пачками по REPROCESS_CHUNK_SIZE, пачки обрабатываются параллельно"""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(handle_chunk, chunk) for chunk in
+                       chunked(list(iter_local_messages(self.directory)), REPROCESS_CHUNK_SIZE)]
+            for future in futures:
+                future.result()
+
+    def existing(self, hashes):
+        with self._lock:
+            if self._hashes is None:
+                self._hashes = {message.get('hash') for _, message in iter_local_messages(self.directory)}
+            return {doc_hash for doc_hash in hashes if doc_hash in self._hashes}
+
+    def _write(self, filename, message):
+        path = os.path.join(self.directory, filename)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(message, f, ensure_ascii=False, indent=2, default=json_default)
+        os.replace(tmp_path, path)
+
+    def apply(self, updates, deletes, adds):
+        for filename, fields in updates:
+            with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                message = json.load(f)
+            message.update(fields)
+            self._write(filename, message)
+        for filename in deletes:
+            path = os.path.join(self.directory, filename)
+            if os.path.exists(path):
+                os.remove(path)
+        os.makedirs(self.directory, exist_ok=True)
+        for doc_hash, message in adds:
+            self._write(f"message_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{doc_hash[:8]}.json", message)
+        with self._lock:
+            if self._hashes is not None:
+                self._hashes.update(doc_hash for doc_hash, _ in adds)
+
+
+class ReprocessEngine:
+    """Параллельная переобработка архива и записи потока с записью только различий"""
+
+    def __init__(self, archive, chats, workers=4, checkpoint_path=None, delete_rejected=False,
+                 dry_run=False, rollups=None, contacts=None, routes=None):
+        self.archive = archive
+        self.filters = ChatFilters(chats)
+        self.workers = max(1, workers)
+        self.checkpoint = MigrationCheckpoint(None if dry_run else checkpoint_path, self.filters.fingerprint())
+        self.delete_rejected = delete_rejected
+        self.dry_run = dry_run
+        self.rollups = rollups
+        self.contacts = contacts
+        self.routes = routes
+        self.stats = {'scanned': 0, 'skipped_done': 0, 'skipped_chat': 0, 'unchanged': 0, 'updated': 0,
+                      'rejected': 0, 'duplicates': 0, 'deleted': 0, 'added': 0, 'in_archive': 0, 'errors': 0}
+        self.examples = []
+        # Новый hash -> (timestamp, ключ) оставляемого сообщения; ключи остальных - дубликаты
+        self._keepers = {}
+        self._losers = []
+        # Измененные сообщения архива: в индекс маршрутов - после отбора дубликатов
+        self._indexed = []
+        self._lock = threading.Lock()
+        self._started = None
+
+    def run_archive(self):
+        """Переобработка сохраненных сообщений; возвращает статистику"""
+        self._start()
+        logger.info(f"♻️  Переобработка архива{' (dry-run)' if self.dry_run else ''}")
+        self.archive.scan(self._process_archive_chunk, self.workers)
+        self._remove_duplicates()
+        return self._finish()
+
+    def run_capture(self, records):
+        """Поиск в записи потока сообщений, которые теперь проходят фильтр, но не сохранены"""
+        self._start()
+        logger.info(f"♻️  Переобработка записи потока{' (dry-run)' if self.dry_run else ''}")
+        # Сначала все части оцениваются, затем пишутся: какую копию добавить, решается по всей записи
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            evaluated = list(executor.map(self._evaluate_capture_chunk, chunked(list(records), REPROCESS_CHUNK_SIZE)))
+            keepers = {rank[1] for rank in self._keepers.values()}
+            for future in [executor.submit(self._write_capture_chunk, *chunk, keepers) for chunk in evaluated]:
+                future.result()
+        return self._finish()
+
+    def _start(self):
+        if self._started is None:
+            self._started = time.time()
+        with self._lock:
+            self._keepers, self._losers, self._indexed = {}, [], []
+
+    def _finish(self):
+        self.flush_indexes()
+        self.stats['elapsed'] = round(time.time() - self._started, 2)
+        if not self.dry_run and not self.stats['errors']:
+            # Прогон завершен: следующий (например, после смены фильтров) проходит все сообщения
+            self.checkpoint.reset()
+        return dict(self.stats)
+
+    def _rank(self, doc_hash, key, timestamp):
+        """Учет сообщения с новым hash: остается самое раннее, при равенстве - с меньшим ключом"""
+        rank = (parse_timestamp(timestamp) or LATEST, key)
+        with self._lock:
+            best = self._keepers.get(doc_hash)
+            if best is None:
+                self._keepers[doc_hash] = rank
+            elif rank < best:
+                self._keepers[doc_hash] = rank
+                self._losers.append(best[1])
+            else:
+                self._losers.append(key)
+
+    def _remove_duplicates(self):
+        """Дубликаты архива после сканирования: учет, удаление (с delete_rejected) и индекс маршрутов"""
+        with self._lock:
+            losers, self._losers = sorted(self._losers), []
+            indexed, self._indexed = self._indexed, []
+        if self.routes:
+            skip = set(losers)
+            for doc_id, message in indexed:
+                if doc_id not in skip:
+                    self.routes.record(message)
+        for doc_id in losers[:MAX_EXAMPLES]:
+            self._example(doc_id, 'duplicate', {})
+        deleted = 0
+        if self.delete_rejected:
+            for chunk in chunked(losers, MAX_BATCH_SIZE):
+                if self._write([], [], chunk, []):
+                    deleted += len(chunk)
+                else:
+                    self._add_stats({}, errors=len(chunk))
+        self._add_stats({'duplicates': len(losers)}, deleted=deleted)
+
+    def _process_archive_chunk(self, items):
+        updates, rejected, indexed = [], [], []
+        counts = {'scanned': len(items), 'skipped_done': 0, 'skipped_chat': 0, 'unchanged': 0, 'updated': 0,
+                  'rejected': 0}
+        keys = []
+        for doc_id, message in items:
+            if doc_id in self.checkpoint.done:
+                counts['skipped_done'] += 1
+                continue
+            keys.append(doc_id)
+            if self.filters.config(message.get('chat_id')) is None:
+                # Чат отключен или удален из настроек: его архив не трогаем
+                counts['skipped_chat'] += 1
+                continue
+            result = evaluate(message, self.filters)
+            if result is None:
+                counts['rejected'] += 1
+                rejected.append(doc_id)
+                self._example(doc_id, 'rejected', {field: message.get(field) for field in ('keywords_found',)})
+                continue
+            # Дубликаты определяются после сканирования; изменения пишутся всем копиям
+            self._rank(result['hash'], doc_id, message.get('timestamp'))
+            changes = changed_fields(message, result)
+            if not changes:
+                counts['unchanged'] += 1
+                continue
+            counts['updated'] += 1
+            updates.append((doc_id, changes))
+            indexed.append((doc_id, dict(message, **changes)))
+            self._example(doc_id, 'updated', {field: (message.get(field), value) for field, value in changes.items()
+                                              if field != 'cargos'})
+
+        deletes = rejected if self.delete_rejected else []
+        written = self._write(keys, updates, deletes, [])
+        if written and self.routes:
+            with self._lock:
+                self._indexed.extend(indexed)
+        self._add_stats(counts, deleted=len(deletes) if written else 0, errors=0 if written else len(keys))
+
+    def _evaluate_capture_chunk(self, records):
+        """Оценка части записи потока без записи: (ключи, [(ключ, сообщение)], счетчики)"""
+        candidates = []
+        counts = {'scanned': len(records), 'skipped_done': 0, 'skipped_chat': 0, 'rejected': 0,
+                  'duplicates': 0, 'in_archive': 0}
+        keys = []
+        for record in records:
+            key = f"capture:{record.get('chat_id')}:{record.get('message_id')}"
+            if key in self.checkpoint.done:
+                counts['skipped_done'] += 1
+                continue
+            keys.append(key)
+            if self.filters.config(record.get('chat_id')) is None:
+                counts['skipped_chat'] += 1
+                continue
+            message = message_from_record(record, parse_timestamp(record.get('received_at')))
+            result = evaluate(message, self.filters)
+            if result is None:
+                counts['rejected'] += 1
+                continue
+            message.update(result)
+            candidates.append((key, message))
+            self._rank(message['hash'], key, message['timestamp'])
+        return keys, candidates, counts
+
+    def _write_capture_chunk(self, keys, candidates, counts, keepers):
+        """Добавление выбранных копий части, которых еще нет в архиве"""
+        kept = [message for key, message in candidates if key in keepers]
+        counts['duplicates'] += len(candidates) - len(kept)
+        in_archive = self.archive.existing({message['hash'] for message in kept}) if kept else set()
+        adds = []
+        for message in kept:
+            if message['hash'] in in_archive:
+                counts['in_archive'] += 1
+            else:
+                adds.append((message['hash'], message))
+                self._example(message['hash'], 'added', {'keywords_found': message['keywords_found']})
+
+        written = self._write(keys, [], [], adds)
+        if written:
+            for _, message in adds:
+                if self.rollups:
+                    self.rollups.record(message, message['cargos'])
+                if self.contacts:
+                    self.contacts.record(message, message['phones'])
+                if self.routes:
+                    self.routes.record(message)
+        self._add_stats(counts, added=len(adds) if written else 0, errors=0 if written else len(keys))
+
+    def _write(self, keys, updates, deletes, adds):
+        """Запись различий части и отметка ее ключей в контрольной точке"""
+        if self.dry_run:
+            return True
+        try:
+            if updates or deletes or adds:
+                self.archive.apply(updates, deletes, adds)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи части из {len(keys)} сообщений: {e}")
+            return False
+        self.checkpoint.mark(keys)
+        return True
+
+    def _example(self, key, kind, details):
+        with self._lock:
+            if len(self.examples) < MAX_EXAMPLES:
+                self.examples.append({'key': key, 'kind': kind, **details})
+
+    def _add_stats(self, counts, **extra):
+        with self._lock:
+            for key, value in list(counts.items()) + list(extra.items()):
+                self.stats[key] += value
+            self._report()
+
+    def _report(self):
+        elapsed = max(time.time() - self._started, 1e-6)
+        logger.info(f"⏳ просмотрено {self.stats['scanned']} ({self.stats['scanned'] / elapsed:.0f} сообщ./с), "
+                    f"изменено {self.stats['updated']}, не проходят {self.stats['rejected']}, "
+                    f"дубликатов {self.stats['duplicates']}, добавлено {self.stats['added']}")
+
+    def flush_indexes(self):
+        """Сброс накопленных записей индексов"""
+        if self.dry_run:
+            return
+        for index in (self.rollups, self.contacts, self.routes):
+            if index is not None:
+                index.flush()
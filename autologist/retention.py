@@ -0,0 +1,176 @@
+"""
+Очистка и ограничение срока хранения сообщений в Firestore
+
+Удаляемые документы выбираются запросами по индексу, а не сканированием
+всей коллекции: timestamp < граница (плюс chat_id == ... для каждого чата,
+индекс chat_id + timestamp), только по чатам - chat_id == .... Запросы
+читаются постранично с курсором и выполняются параллельно (по чату на
+поток). Полное сканирование по разделам (partition queries) остается для
+delete_all и для legacy_scan: старые документы со строковым timestamp
+запросом по времени не находятся (backfill_message_times переводит их в
+Timestamp).
+
+Подходящие документы удаляются пакетами до 500 штук. Скорость удаления
+ограничивается, чтобы не упираться в квоты, а в режиме dry-run только
+считается, сколько документов будет удалено.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from autologist.migration import MAX_BATCH_SIZE, chunked
+from autologist.queries import DESCENDING
+from autologist.scan import SCAN_PAGE_SIZE, CollectionScanner
+from autologist.timebuckets import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые нужны для фильтрации
+FILTER_FIELDS = ['timestamp', 'chat_id']
+
+
+class RateLimiter:
+    """Ограничитель скорости (token bucket), общий для всех потоков"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Дождаться разрешения на amount операций"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                if self._allowance >= amount or self._allowance >= self.rate:
+                    self._allowance -= amount
+                    return
+                wait = (amount - self._allowance) / self.rate
+            time.sleep(wait)
+
+
+class RetentionJob:
+    """Удаление сообщений по возрасту и/или по чатам; legacy_scan - полное сканирование коллекции"""
+
+    def __init__(self, db, collection='messages', older_than=None, chat_ids=None,
+                 delete_all=False, workers=4, batch_size=MAX_BATCH_SIZE, rate=None,
+                 dry_run=False, legacy_scan=False):
+        if not (older_than or chat_ids or delete_all):
+            raise ValueError("Нужно указать older_than, chat_ids или delete_all")
+        self.db = db
+        self.collection = collection
+        self.cutoff = datetime.now(timezone.utc) - older_than if older_than else None
+        self.chat_ids = {str(chat_id) for chat_id in chat_ids} if chat_ids else None
+        self.delete_all = delete_all
+        self.workers = max(1, workers)
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.limiter = RateLimiter(rate)
+        self.dry_run = dry_run
+        self.legacy_scan = legacy_scan
+        self.stats = {'scanned': 0, 'matched': 0, 'deleted': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        self._started = None
+
+    def matches(self, data):
+        """Подходит ли документ под условия удаления"""
+        if self.delete_all:
+            return True
+        if self.chat_ids is not None and str(data.get('chat_id')) not in self.chat_ids:
+            return False
+        if self.cutoff is not None:
+            timestamp = parse_timestamp(data.get('timestamp'))
+            # Документы без корректного времени по возрасту не удаляем
+            if timestamp is None or timestamp >= self.cutoff:
+                return False
+        return True
+
+    def queries(self):
+        """Запросы, которые находят удаляемые документы по индексу"""
+        collection = self.db.collection(self.collection)
+        queries = [collection.where('chat_id', '==', chat_id) for chat_id in sorted(self.chat_ids)] \
+            if self.chat_ids is not None else [collection]
+        if self.cutoff is None:
+            return [query.order_by('__name__') for query in queries]
+        # Порядок timestamp DESC - тот же индекс chat_id + timestamp, что у ленты сообщений
+        return [query.where('timestamp', '<', self.cutoff).order_by('timestamp', direction=DESCENDING)
+                for query in queries]
+
+    def run(self):
+        """Запуск очистки; возвращает статистику"""
+        self._started = time.time()
+        if self.delete_all or self.legacy_scan:
+            scanner = CollectionScanner(self.db, self.collection, workers=self.workers, fields=FILTER_FIELDS)
+            logger.info(f"🧹 {self.collection}: сканирование{' (dry-run)' if self.dry_run else ''}")
+            scanner.run(self._process_page)
+        else:
+            queries = self.queries()
+            logger.info(f"🧹 {self.collection}: {len(queries)} запросов по индексу{' (dry-run)' if self.dry_run else ''}")
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(queries))) as executor:
+                for future in [executor.submit(self._drain, query) for query in queries]:
+                    future.result()
+        self.stats['elapsed'] = round(time.time() - self._started, 2)
+        return dict(self.stats)
+
+    def _drain(self, query):
+        """Постраничное чтение запроса с курсором (удаленные документы курсору не мешают)"""
+        last = None
+        while True:
+            page_query = query.select(FILTER_FIELDS).limit(SCAN_PAGE_SIZE)
+            if last is not None:
+                page_query = page_query.start_after(last)
+            page = list(page_query.stream())
+            if not page:
+                break
+            last = page[-1]
+            self._process_page(page)
+            if len(page) < SCAN_PAGE_SIZE:
+                break
+
+    def _process_page(self, snapshots):
+        """Отбор подходящих документов страницы и пакетное удаление"""
+        matched = [snapshot.reference for snapshot in snapshots if self.matches(snapshot.to_dict() or {})]
+        self._add_stats(scanned=len(snapshots), matched=len(matched))
+        for refs in chunked(matched, self.batch_size):
+            self._delete(refs)
+
+    def _delete(self, refs):
+        """Удаление одного пакета документов"""
+        if self.dry_run:
+            self._report()
+            return
+        self.limiter.acquire(len(refs))
+        try:
+            batch = self.db.batch()
+            for ref in refs:
+                batch.delete(ref)
+            batch.commit()
+            self._add_stats(deleted=len(refs))
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления пакета из {len(refs)} документов: {e}")
+            self._add_stats(errors=len(refs))
+        self._report()
+
+    def _add_stats(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def _report(self):
+        elapsed = max(time.time() - self._started, 1e-6)
+        logger.info(f"⏳ просмотрено {self.stats['scanned']}, подходит {self.stats['matched']}, "
+                    f"удалено {self.stats['deleted']} ({self.stats['deleted'] / elapsed:.0f} док/с)")
+
+
+def retention_from_env(db, **kwargs):
+    """Задание очистки по сроку MESSAGE_RETENTION_DAYS из окружения (по умолчанию 7 дней)"""
+    days = int(os.getenv('MESSAGE_RETENTION_DAYS', '7').split('#')[0].strip())
+    return RetentionJob(db, older_than=timedelta(days=days), **kwargs)
@@ -0,0 +1,341 @@
+"""
+Инкрементальная статистика грузов по дням, неделям и месяцам
+
+Парсер при каждом сохранении сообщения увеличивает счетчики дневной
+корзины (statistics/day_2025-10-30): сообщения, заявки, чаты, маршруты,
+типы грузов и скетчи распределения веса и ставок. Скетч - логарифмическая
+гистограмма с относительной точностью 2%: корзины складываются через
+Increment, поэтому перцентили считаются без чтения исходных сообщений.
+
+Приращения копятся в памяти и сбрасываются одним batch раз в несколько
+секунд. Недельные и месячные документы собираются из дневных (compact),
+а для незакрытых периодов API сливает дневные документы на лету -
+в любом случае это чтение нескольких документов, а не всей истории.
+"""
+
+import os
+import json
+import math
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from autologist.timebuckets import current_buckets, time_buckets
+
+logger = logging.getLogger(__name__)
+
+STATS_COLLECTION = 'statistics'
+
+# Сколько маршрутов хранить в недельных и месячных документах
+TOP_ROUTES = 20
+
+# Относительная точность скетча перцентилей
+SKETCH_ACCURACY = 0.02
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+
+PERIODS = ('day', 'week', 'month')
+
+
+def sketch_key(value):
+    """Номер корзины скетча для положительного значения"""
+    return str(int(math.ceil(math.log(value) / math.log(SKETCH_GAMMA))))
+
+
+def sketch_quantiles(bins, quantiles=(0.5, 0.9)):
+    """Перцентили по корзинам скетча {номер: количество}"""
+    items = sorted((int(key), count) for key, count in (bins or {}).items() if count > 0)
+    total = sum(count for _, count in items)
+    if not total:
+        return [None for _ in quantiles]
+    result = []
+    for q in quantiles:
+        rank = q * (total - 1)
+        seen = 0
+        for key, count in items:
+            seen += count
+            if seen > rank:
+                # Середина корзины (gamma^(k-1), gamma^k] с относительной ошибкой <= accuracy
+                result.append(round(2 * SKETCH_GAMMA ** key / (SKETCH_GAMMA + 1), 2))
+                break
+    return result
+
+
+def _field_key(value):
+    """Ключ поля карты Firestore: без точек и обратных кавычек"""
+    return str(value).replace('.', '').replace('`', '').strip() or '—'
+
+
+def route_key(cargo):
+    return _field_key(f"{cargo['from_city']} → {cargo['to_city']}")
+
+
+def _add(target, path, amount=1):
+    """Приращение во вложенном словаре по пути ключей"""
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = target.get(path[-1], 0) + amount
+
+
+def merge_counts(target, source):
+    """Поэлементное сложение вложенных словарей счетчиков"""
+    for key, value in source.items():
+        if isinstance(value, dict):
+            merge_counts(target.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            target[key] = target.get(key, 0) + value
+    return target
+
+
+def message_counts(message_data, cargos):
+    """Приращения счетчиков от одного сохраненного сообщения"""
+    counts = {}
+    _add(counts, ['messages'])
+    _add(counts, ['chats', _field_key(message_data.get('chat_id'))])
+    for cargo in cargos or []:
+        _add(counts, ['cargos'])
+        if cargo.get('from_city') and cargo.get('to_city'):
+            _add(counts, ['routes', route_key(cargo)])
+        if cargo.get('cargo_type'):
+            _add(counts, ['cargo_types', _field_key(cargo['cargo_type'])])
+        weight = cargo.get('weight_tons')
+        if weight:
+            _add(counts, ['weight_sum'], weight)
+            _add(counts, ['weight_count'])
+            _add(counts, ['weight_sketch', sketch_key(weight)])
+        price, currency = cargo.get('price'), cargo.get('currency')
+        if price and currency:
+            _add(counts, ['price_sketch', currency, sketch_key(price)])
+            if weight:
+                _add(counts, ['price_per_ton_sketch', currency, sketch_key(price / weight)])
+    return counts
+
+
+def bucket_doc_id(period, bucket):
+    return f"{period}_{bucket}"
+
+
+def days_of(period, bucket):
+    """Дневные корзины, входящие в неделю или месяц"""
+    if period == 'day':
+        return [bucket]
+    if period == 'week':
+        year, week = bucket.split('-W')
+        start = date.fromisocalendar(int(year), int(week), 1)
+        return [(start + timedelta(days=i)).isoformat() for i in range(7)]
+    year, month = (int(part) for part in bucket.split('-'))
+    day = date(year, month, 1)
+    days = []
+    while day.month == month:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def previous_buckets(period, count, end=None):
+    """Последние count корзин периода, от старой к новой"""
+    end = end or current_buckets()[period]
+    if period == 'day':
+        last = date.fromisoformat(end)
+        return [(last - timedelta(days=i)).isoformat() for i in reversed(range(count))]
+    if period == 'week':
+        year, week = end.split('-W')
+        last = date.fromisocalendar(int(year), int(week), 1)
+        weeks = [(last - timedelta(weeks=i)).isocalendar() for i in reversed(range(count))]
+        return [f"{year}-W{week:02d}" for year, week, _ in weeks]
+    year, month = (int(part) for part in end.split('-'))
+    buckets = []
+    for _ in range(count):
+        buckets.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return list(reversed(buckets))
+
+
+class FirestoreRollupStore:
+    """Документы статистики в коллекции statistics"""
+
+    def __init__(self, db, collection=STATS_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def apply(self, updates):
+        """Атомарные приращения: {doc_id: (period, bucket, counts)} одним batch"""
+        from google.cloud.firestore import Increment, SERVER_TIMESTAMP
+
+        def to_increments(counts):
+            return {key: to_increments(value) if isinstance(value, dict) else Increment(value)
+                    for key, value in counts.items()}
+
+        batch = self.db.batch()
+        for doc_id, (period, bucket, counts) in updates.items():
+            data = to_increments(counts)
+            data.update({'period': period, 'bucket': bucket, 'updated_at': SERVER_TIMESTAMP})
+            batch.set(self.db.collection(self.collection).document(doc_id), data, merge=True)
+        batch.commit()
+
+    def replace(self, doc_id, data):
+        self.db.collection(self.collection).document(doc_id).set(data)
+
+    def get_many(self, doc_ids):
+        refs = [self.db.collection(self.collection).document(doc_id) for doc_id in doc_ids]
+        return {snapshot.id: snapshot.to_dict() for snapshot in self.db.get_all(refs) if snapshot.exists}
+
+    def delete(self, doc_ids):
+        batch = self.db.batch()
+        for doc_id in doc_ids:
+            batch.delete(self.db.collection(self.collection).document(doc_id))
+        batch.commit()
+
+
+class LocalRollupStore:
+    """Статистика в локальном JSON файле (режим без Firestore)"""
+
+    def __init__(self, path='data/statistics.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, docs):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(docs, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def apply(self, updates):
+        with self._lock:
+            docs = self._load()
+            for doc_id, (period, bucket, counts) in updates.items():
+                doc = docs.setdefault(doc_id, {'period': period, 'bucket': bucket})
+                merge_counts(doc, counts)
+                doc['updated_at'] = datetime.now(timezone.utc).isoformat()
+            self._save(docs)
+
+    def replace(self, doc_id, data):
+        with self._lock:
+            docs = self._load()
+            docs[doc_id] = data
+            self._save(docs)
+
+    def get_many(self, doc_ids):
+        docs = self._load()
+        return {doc_id: docs[doc_id] for doc_id in doc_ids if doc_id in docs}
+
+    def delete(self, doc_ids):
+        with self._lock:
+            docs = self._load()
+            for doc_id in doc_ids:
+                docs.pop(doc_id, None)
+            self._save(docs)
+
+
+class RollupEngine:
+    """Накопление приращений в памяти и периодический сброс в хранилище"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, message_data, cargos):
+        """Учет сохраненного сообщения и извлеченных из него заявок"""
+        buckets = {'day': message_data['day']} if message_data.get('day') else time_buckets(
+            message_data['timestamp'])
+        doc_id = bucket_doc_id('day', buckets['day'])
+        counts = message_counts(message_data, cargos)
+        with self._lock:
+            _, _, pending = self._pending.setdefault(doc_id, ('day', buckets['day'], {}))
+            merge_counts(pending, counts)
+
+    def pending(self):
+        """Сколько записей ждет сброса"""
+        return len(self._pending)
+
+    def flush(self):
+        """Запись накопленных приращений; при ошибке они возвращаются в очередь"""
+        with self._lock:
+            updates, self._pending = self._pending, {}
+        if not updates:
+            return 0
+        try:
+            self.store.apply(updates)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи статистики: {e}")
+            with self._lock:
+                for doc_id, (period, bucket, counts) in updates.items():
+                    _, _, pending = self._pending.setdefault(doc_id, (period, bucket, {}))
+                    merge_counts(pending, counts)
+            return 0
+        return len(updates)
+
+
+def trim_routes(doc, limit=TOP_ROUTES):
+    """Оставить только самые частые маршруты"""
+    routes = doc.get('routes') or {}
+    if len(routes) > limit:
+        doc['routes'] = dict(sorted(routes.items(), key=lambda item: -item[1])[:limit])
+    return doc
+
+
+def merge_days(store, period, bucket):
+    """Сводный документ периода из дневных документов"""
+    day_ids = [bucket_doc_id('day', day) for day in days_of(period, bucket)]
+    merged = {'period': period, 'bucket': bucket}
+    for doc in store.get_many(day_ids).values():
+        merge_counts(merged, doc)
+    return trim_routes(merged)
+
+
+def compact(store, period, bucket):
+    """Пересборка недельного или месячного документа из дневных (идемпотентно)"""
+    merged = merge_days(store, period, bucket)
+    merged['compacted_at'] = datetime.now(timezone.utc).isoformat()
+    store.replace(bucket_doc_id(period, bucket), merged)
+    return merged
+
+
+def load_statistics(store, period, buckets):
+    """
+    Документы статистики для корзин периода.
+    Закрытые недели и месяцы читаются из сжатых документов, текущие - из дневных.
+    """
+    current = current_buckets()[period]
+    docs = store.get_many([bucket_doc_id(period, bucket) for bucket in buckets])
+    result = []
+    for bucket in buckets:
+        doc = docs.get(bucket_doc_id(period, bucket))
+        if period != 'day' and (doc is None or bucket >= current):
+            doc = merge_days(store, period, bucket)
+        result.append(summarize(doc or {}, period, bucket))
+    return result
+
+
+def summarize(doc, period, bucket):
+    """Ответ API: счетчики, топ маршрутов и перцентили вместо сырых корзин скетча"""
+    weight_p50, weight_p90 = sketch_quantiles(doc.get('weight_sketch'))
+    prices = {}
+    for currency, bins in (doc.get('price_sketch') or {}).items():
+        p50, p90 = sketch_quantiles(bins)
+        per_ton = sketch_quantiles((doc.get('price_per_ton_sketch') or {}).get(currency), (0.5,))[0]
+        prices[currency] = {'count': sum(bins.values()), 'p50': p50, 'p90': p90, 'per_ton_p50': per_ton}
+    routes = sorted((doc.get('routes') or {}).items(), key=lambda item: -item[1])[:10]
+    weight_count = doc.get('weight_count') or 0
+    return {
+        'period': period,
+        'bucket': bucket,
+        'messages': doc.get('messages', 0),
+        'cargos': doc.get('cargos', 0),
+        'chats': doc.get('chats', {}),
+        'cargo_types': doc.get('cargo_types', {}),
+        'top_routes': [{'route': route, 'count': count} for route, count in routes],
+        'weight': {
+            'avg': round(doc['weight_sum'] / weight_count, 2) if weight_count else None,
+            'p50': weight_p50,
+            'p90': weight_p90
+        },
+        'prices': prices
+    }
@@ -0,0 +1,285 @@
+"""
+Индекс маршрутов: поиск актуальных заявок по откуда / куда
+
+Для каждой заявки с распознанным маршрутом в коллекцию routes пишется
+документ {hash}:{номер} с каноническими пунктами справочника, их
+регионами, странами, координатами и geohash-ячейками. Запросы вида
+"из радиуса 200 км от Казани в Московскую область за последние сутки"
+выполняются одним запросом к индексу:
+
+    равенство по from_id / from_region / from_country и to_* +
+    from_cells array_contains_any [ячейки круга] +
+    timestamp >= since, сортировка timestamp DESC
+
+Ячейки покрывают круг с запасом, поэтому точное расстояние проверяется
+после выборки. Нужные составные индексы перечислены в
+route_access_patterns() и объявлены в firestore.indexes.json.
+"""
+
+import os
+import json
+import logging
+import threading
+
+from autologist.gazetteer import covering_cells, haversine_km, point_cells, resolve_area, resolve_place
+from autologist.migration import MAX_BATCH_SIZE, chunked
+from autologist.queries import MessageQuery
+from autologist.timebuckets import json_default, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+ROUTES_COLLECTION = 'routes'
+
+# Во сколько раз больше документов читать, когда результат дофильтровывается по расстоянию
+RADIUS_OVERFETCH = 4
+MAX_FETCH = 500
+
+# Сколько символов текста хранить в записи индекса
+EXCERPT_LENGTH = 300
+
+SIDES = ('from', 'to')
+
+
+def place_fields(side, place):
+    """Поля пункта отправления или назначения"""
+    return {
+        f'{side}_id': place['id'],
+        f'{side}_name': place['name'],
+        f'{side}_region': place['region'],
+        f'{side}_country': place['country'],
+        f'{side}_lat': place['lat'],
+        f'{side}_lon': place['lon'],
+        f'{side}_cells': point_cells(place['lat'], place['lon'])
+    }
+
+
+def route_entries(message_data):
+    """Записи индекса по сохраненному сообщению: (id, запись) для заявок с распознанным маршрутом"""
+    entries = []
+    for number, cargo in enumerate(message_data.get('cargos') or []):
+        origin = resolve_place(cargo.get('from_city'))
+        destination = resolve_place(cargo.get('to_city'))
+        if origin is None or destination is None or origin['id'] == destination['id']:
+            continue
+        entry = {
+            'cargo_id': f"{message_data.get('hash')}:{number}",
+            'message_hash': message_data.get('hash'),
+            'chat_id': message_data.get('chat_id'),
+            'chat_title': message_data.get('chat_title'),
+            'timestamp': message_data.get('timestamp'),
+            'cargo_type': cargo.get('cargo_type'),
+            'weight_tons': cargo.get('weight_tons'),
+            'volume_m3': cargo.get('volume_m3'),
+            'price': cargo.get('price'),
+            'currency': cargo.get('currency'),
+            'phones': list(message_data.get('phones') or []),
+            'text': (message_data.get('text') or '')[:EXCERPT_LENGTH]
+        }
+        entry.update(place_fields('from', origin))
+        entry.update(place_fields('to', destination))
+        entries.append((entry['cargo_id'], entry))
+    return entries
+
+
+class RouteArea:
+    """Условие на одну сторону маршрута: пункт, регион, страна или круг"""
+
+    def __init__(self, side, name, radius_km=None):
+        self.side = side
+        self.name = name
+        self.radius_km = radius_km
+        if radius_km:
+            place = resolve_place(name)
+            if place is None:
+                raise ValueError(f"Пункт не найден в справочнике: {name}")
+            self.kind, self.value = 'radius', place
+            self.cells = covering_cells(place['lat'], place['lon'], radius_km)
+        else:
+            area = resolve_area(name)
+            if area is None:
+                raise ValueError(f"Пункт, регион или страна не найдены: {name}")
+            self.kind, self.value = area
+            self.cells = None
+
+    def equality_filter(self):
+        if self.kind == 'radius':
+            return None
+        return (f'{self.side}_{self.kind}', '==', self.value)
+
+    def cells_filter(self):
+        return (f'{self.side}_cells', 'array_contains_any', self.cells)
+
+    def contains(self, entry):
+        """Точная проверка попадания в круг"""
+        if self.kind != 'radius':
+            return True
+        distance = haversine_km(self.value['lat'], self.value['lon'],
+                                entry[f'{self.side}_lat'], entry[f'{self.side}_lon'])
+        return distance <= self.radius_km
+
+    def describe(self):
+        if self.kind == 'radius':
+            return {'place': self.value['name'], 'radius_km': self.radius_km}
+        return {self.kind: self.value}
+
+
+class RouteQuery(MessageQuery):
+    """Запрос к индексу маршрутов (план строится так же, как у запросов к сообщениям)"""
+
+    def __init__(self, origin=None, destination=None, since=None, until=None, limit=50,
+                 collection=ROUTES_COLLECTION):
+        super().__init__(since=since, until=until, limit=limit, collection=collection)
+        self.areas = [area for area in (origin, destination) if area is not None]
+
+    def radius_areas(self):
+        return [area for area in self.areas if area.kind == 'radius']
+
+    def plans(self):
+        """
+        Один план: равенства по сторонам с пунктом/регионом/страной и
+        array_contains_any по ячейкам первой стороны с радиусом.
+        Вторая сторона с радиусом проверяется только после выборки.
+        """
+        filters = [area.equality_filter() for area in self.areas if area.equality_filter()]
+        radius = self.radius_areas()
+        if radius:
+            filters.append(radius[0].cells_filter())
+        limit = self.limit
+        if radius and limit:
+            limit = min(limit * RADIUS_OVERFETCH, MAX_FETCH)
+        return [{'collection': self.collection, 'since': self.since, 'until': self.until,
+                 'order_by': 'timestamp', 'limit': limit, 'filters': filters}]
+
+    def matches(self, entry):
+        return all(area.contains(entry) for area in self.areas)
+
+    def fetch(self, db):
+        entries = [entry for entry in super().fetch(db) if self.matches(entry)]
+        return entries[:self.limit] if self.limit else entries
+
+
+class FirestoreRouteStore:
+    """Индекс в коллекции routes"""
+
+    def __init__(self, db, collection=ROUTES_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def apply(self, entries):
+        for chunk in chunked(entries, MAX_BATCH_SIZE):
+            batch = self.db.batch()
+            for cargo_id, entry in chunk:
+                batch.set(self.db.collection(self.collection).document(cargo_id), entry)
+            batch.commit()
+
+    def search(self, query):
+        query.collection = self.collection
+        return query.fetch(self.db)
+
+
+class LocalRouteStore:
+    """Индекс в локальном JSON файле (режим без Firestore): поиск перебором"""
+
+    def __init__(self, path='data/routes.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def apply(self, entries):
+        with self._lock:
+            routes = self._load()
+            for cargo_id, entry in entries:
+                routes[cargo_id] = json.loads(json.dumps(entry, default=json_default))
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(routes, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def search(self, query):
+        plan = query.plans()[0]
+        result = []
+        for entry in self._load().values():
+            timestamp = parse_timestamp(entry.get('timestamp'))
+            if query.since is not None and (timestamp is None or timestamp < query.since):
+                continue
+            if query.until is not None and (timestamp is None or timestamp >= query.until):
+                continue
+            if not all(_local_filter(entry, field, op, value) for field, op, value in plan['filters']):
+                continue
+            if query.matches(entry):
+                result.append(entry)
+        result.sort(key=lambda entry: entry.get('timestamp') or '', reverse=True)
+        return result[:query.limit] if query.limit else result
+
+
+def _local_filter(entry, field, op, value):
+    if op == 'array_contains_any':
+        return bool(set(entry.get(field) or []) & set(value))
+    return entry.get(field) == value
+
+
+class RouteIndex:
+    """Накопление записей индекса в памяти и периодический сброс в хранилище"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, message_data):
+        """Учет заявок сохраненного сообщения; возвращает число проиндексированных маршрутов"""
+        entries = route_entries(message_data)
+        with self._lock:
+            self._pending.update(entries)
+        return len(entries)
+
+    def pending(self):
+        """Сколько записей ждет сброса"""
+        return len(self._pending)
+
+    def flush(self):
+        """Запись накопленных записей; при ошибке они возвращаются в очередь"""
+        with self._lock:
+            entries, self._pending = self._pending, {}
+        if not entries:
+            return 0
+        try:
+            self.store.apply(list(entries.items()))
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи индекса маршрутов: {e}")
+            with self._lock:
+                for cargo_id, entry in entries.items():
+                    self._pending.setdefault(cargo_id, entry)
+            return 0
+        return len(entries)
+
+
+class _PatternArea(RouteArea):
+    """Условие с условными значениями для перечисления планов"""
+
+    def __init__(self, side, kind):
+        self.side = side
+        self.kind = kind
+        self.value = kind
+        self.radius_km = None
+        self.cells = ['cell']
+
+
+def route_access_patterns(collection=ROUTES_COLLECTION):
+    """Все комбинации условий поиска маршрутов (для проверки индексов)"""
+    kinds = (None, 'id', 'region', 'country', 'radius')
+    patterns = []
+    for origin in kinds:
+        for destination in kinds:
+            if origin is None and destination is None:
+                continue
+            query = RouteQuery(since='since', collection=collection)
+            query.areas = [_PatternArea(side, kind) for side, kind in zip(SIDES, (origin, destination)) if kind]
+            patterns.append(query)
+    return patterns
@@ -0,0 +1,64 @@
+"""
+Параллельное постраничное сканирование коллекции Firestore
+
+Коллекция делится на непересекающиеся разделы (partition queries),
+каждый раздел читается своим потоком страницами по SCAN_PAGE_SIZE
+документов. Используется очисткой, backfill и переобработкой архива.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Сколько документов читать за один запрос при сканировании раздела
+SCAN_PAGE_SIZE = 1000
+
+
+class CollectionScanner:
+    """Сканер коллекции: вызывает handle_page(snapshots) для каждой страницы"""
+
+    def __init__(self, db, collection, workers=4, fields=None, page_size=SCAN_PAGE_SIZE):
+        self.db = db
+        self.collection = collection
+        self.workers = max(1, workers)
+        self.fields = fields
+        self.page_size = page_size
+
+    def partitions(self):
+        """Запросы по непересекающимся разделам коллекции"""
+        if self.workers > 1:
+            try:
+                group = self.db.collection_group(self.collection)
+                return [partition.query() for partition in group.get_partitions(self.workers)]
+            except Exception as e:
+                logger.warning(f"⚠️  Разделы недоступны ({e}), сканируем одним потоком")
+        return [self.db.collection(self.collection).order_by('__name__')]
+
+    def run(self, handle_page):
+        """Сканирование всех разделов; возвращает число разделов"""
+        queries = self.partitions()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(self._scan, query, handle_page) for query in queries]:
+                future.result()
+        return len(queries)
+
+    def _is_own_document(self, snapshot):
+        """collection_group захватывает и подколлекции с тем же именем - отсекаем их"""
+        parent = snapshot.reference.parent
+        return parent.id == self.collection and parent.parent is None
+
+    def _scan(self, query, handle_page):
+        last = None
+        while True:
+            page_query = query.select(self.fields) if self.fields is not None else query
+            page_query = page_query.limit(self.page_size)
+            if last is not None:
+                page_query = page_query.start_after(last)
+            page = list(page_query.stream())
+            if not page:
+                break
+            last = page[-1]
+            handle_page([snapshot for snapshot in page if self._is_own_document(snapshot)])
+            if len(page) < self.page_size:
+                break
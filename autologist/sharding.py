@@ -0,0 +1,280 @@
+"""
+Распределение чатов между несколькими воркерами парсера
+
+Каждый воркер - отдельный процесс со своей сессией Telegram
+(TELEGRAM_SESSION_NAME) и идентификатором PARSER_WORKER_ID. Воркеры
+регистрируются в реестре (коллекция parser_workers или локальный файл) и
+периодически обновляют запись; запись, не обновлявшаяся дольше
+SHARD_WORKER_TTL_SECONDS, считается выбывшей.
+
+Чаты раскладываются по живым воркерам консистентным хешированием: при
+появлении или выбытии воркера переезжает только его доля чатов. Воркер
+публикует список чатов, в которых состоит его аккаунт, поэтому чат
+достается ближайшему по кольцу воркеру, который его действительно видит.
+
+На стыке перебалансировки один чат какое-то время могут обрабатывать два
+воркера, а несколько аккаунтов могут состоять в одном чате. Поэтому перед
+сохранением hash сообщения атомарно занимается в общем хранилище
+дедупликации (create документа в Firestore или O_EXCL файл локально) -
+сохраняет тот воркер, который занял его первым.
+"""
+
+import os
+import json
+import time
+import bisect
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+WORKERS_COLLECTION = 'parser_workers'
+DEDUP_COLLECTION = 'dedup'
+
+# Как часто воркер обновляет запись в реестре и сколько она живет без обновлений
+SHARD_HEARTBEAT_SECONDS = int(os.getenv('SHARD_HEARTBEAT_SECONDS', '15'))
+SHARD_WORKER_TTL_SECONDS = int(os.getenv('SHARD_WORKER_TTL_SECONDS', '60'))
+
+# Сколько хранить отметки дедупликации (повторы позже уже не встречаются)
+DEDUP_TTL_HOURS = int(os.getenv('DUPLICATE_THRESHOLD_HOURS', '24'))
+
+# Виртуальных точек на воркера: сглаживает неравномерность долей
+RING_REPLICAS = 64
+
+
+def canonical_chat_id(chat_id):
+    """ID чата без префиксов -100 и '-': Telethon и настройки хранят его по-разному"""
+    value = str(chat_id)
+    if value.startswith('-100'):
+        return value[4:]
+    return value.lstrip('-')
+
+
+def _ring_hash(value):
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными точками"""
+
+    def __init__(self, workers, replicas=RING_REPLICAS):
+        self.workers = sorted(set(workers))
+        self._points = sorted((_ring_hash(f"{worker}#{i}"), worker)
+                              for worker in self.workers for i in range(replicas))
+        self._hashes = [point for point, _ in self._points]
+
+    def owner(self, key, eligible=None):
+        """
+        Воркер для ключа: первый по часовой стрелке.
+        eligible - множество допустимых воркеров; None - любой.
+        """
+        if not self._points:
+            return None
+        start = bisect.bisect(self._hashes, _ring_hash(str(key)))
+        for i in range(len(self._points)):
+            worker = self._points[(start + i) % len(self._points)][1]
+            if eligible is None or worker in eligible:
+                return worker
+        return None
+
+    def assign(self, keys, eligible_for=None):
+        """Раскладка ключей: {воркер: [ключи]}; eligible_for(ключ) -> допустимые воркеры"""
+        assignment = {worker: [] for worker in self.workers}
+        for key in keys:
+            worker = self.owner(key, eligible_for(key) if eligible_for else None)
+            if worker is not None:
+                assignment[worker].append(key)
+        return assignment
+
+
+class FirestoreWorkerRegistry:
+    """Реестр воркеров в коллекции parser_workers"""
+
+    def __init__(self, db, collection=WORKERS_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def heartbeat(self, worker_id, info):
+        self.db.collection(self.collection).document(worker_id).set(
+            dict(info, worker_id=worker_id, last_seen=datetime.now(timezone.utc)), merge=True)
+
+    def leave(self, worker_id):
+        self.db.collection(self.collection).document(worker_id).delete()
+
+    def workers(self):
+        return {snapshot.id: snapshot.to_dict() for snapshot in self.db.collection(self.collection).stream()}
+
+
+class LocalWorkerRegistry:
+    """Реестр воркеров в локальном JSON файле (процессы на одной машине)"""
+
+    def __init__(self, path='data/parser_workers.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def _update(self, change):
+        with self._lock:
+            workers = self._load()
+            change(workers)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(workers, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def heartbeat(self, worker_id, info):
+        entry = dict(info, worker_id=worker_id, last_seen=datetime.now(timezone.utc).isoformat())
+        self._update(lambda workers: workers.setdefault(worker_id, {}).update(entry))
+
+    def leave(self, worker_id):
+        self._update(lambda workers: workers.pop(worker_id, None))
+
+    def workers(self):
+        return self._load()
+
+
+def _last_seen(entry):
+    value = entry.get('last_seen')
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value
+
+
+class ShardMembership:
+    """Участие воркера в кольце: регистрация, список живых воркеров и владение чатами"""
+
+    def __init__(self, worker_id, registry, ttl_seconds=SHARD_WORKER_TTL_SECONDS):
+        self.worker_id = worker_id
+        self.registry = registry
+        self.ttl_seconds = ttl_seconds
+        self.chats = []
+        self.visible = {}
+        self.ring = HashRing([worker_id])
+
+    def refresh(self, info=None):
+        """
+        Обновление своей записи и состава кольца.
+        Возвращает True, если состав воркеров изменился (нужна перебалансировка).
+        """
+        self.registry.heartbeat(self.worker_id, dict(info or {}, chats=self.chats))
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        alive = {}
+        for worker_id, entry in self.registry.workers().items():
+            last_seen = _last_seen(entry)
+            if worker_id == self.worker_id or (last_seen is not None and last_seen >= cutoff):
+                alive[worker_id] = set(entry.get('chats') or [])
+        changed = sorted(alive) != self.ring.workers
+        self.visible = alive
+        if changed:
+            self.ring = HashRing(alive)
+        return changed
+
+    def set_chats(self, chat_ids):
+        """Чаты, в которых состоит аккаунт воркера (публикуются в реестре)"""
+        self.chats = sorted({canonical_chat_id(chat_id) for chat_id in chat_ids})
+
+    def _eligible(self, chat_id):
+        # Воркеры, еще не опубликовавшие список чатов, считаются видящими все чаты
+        eligible = {worker for worker, chats in self.visible.items() if not chats or chat_id in chats}
+        return eligible or None
+
+    def owner(self, chat_id):
+        chat_id = canonical_chat_id(chat_id)
+        return self.ring.owner(chat_id, self._eligible(chat_id))
+
+    def owns(self, chat_id):
+        return self.owner(chat_id) == self.worker_id
+
+    def assignment(self, chat_ids):
+        """Текущая раскладка чатов по воркерам"""
+        keys = [canonical_chat_id(chat_id) for chat_id in chat_ids]
+        return self.ring.assign(keys, self._eligible)
+
+    def leave(self):
+        self.registry.leave(self.worker_id)
+
+
+class FirestoreDedupStore:
+    """
+    Общая дедупликация через create документа dedup/{hash}: create падает,
+    если документ уже есть. Для очистки старых отметок на поле expires_at
+    настраивается TTL политика Firestore.
+    """
+
+    def __init__(self, db, collection=DEDUP_COLLECTION, ttl_hours=DEDUP_TTL_HOURS):
+        self.db = db
+        self.collection = collection
+        self.ttl_hours = ttl_hours
+
+    def claim(self, message_hash, worker_id=None):
+        """True - hash занят этим вызовом (сообщение нужно сохранить), False - уже занят другим"""
+        from google.api_core.exceptions import AlreadyExists
+
+        now = datetime.now(timezone.utc)
+        try:
+            self.db.collection(self.collection).document(message_hash).create({
+                'worker_id': worker_id,
+                'claimed_at': now,
+                'expires_at': now + timedelta(hours=self.ttl_hours)
+            })
+        except AlreadyExists:
+            return False
+        return True
+
+    def release(self, message_hash):
+        """Снять отметку, если сохранить сообщение не удалось: повтор сохранит его снова"""
+        self.db.collection(self.collection).document(message_hash).delete()
+
+
+class LocalDedupStore:
+    """Общая дедупликация для процессов на одной машине: файл на hash, создаваемый с O_EXCL"""
+
+    def __init__(self, directory='data/dedup', ttl_hours=DEDUP_TTL_HOURS):
+        self.directory = directory
+        self.ttl_hours = ttl_hours
+        os.makedirs(directory, exist_ok=True)
+
+    def claim(self, message_hash, worker_id=None):
+        path = os.path.join(self.directory, message_hash)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(path) < self.ttl_hours * 3600:
+                return False
+            # Отметка устарела: занимаем заново
+            os.utime(path)
+            return True
+        with os.fdopen(fd, 'w') as f:
+            f.write(worker_id or '')
+        return True
+
+    def release(self, message_hash):
+        try:
+            os.remove(os.path.join(self.directory, message_hash))
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Удаление устаревших отметок; возвращает число удаленных"""
+        cutoff = time.time() - self.ttl_hours * 3600
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
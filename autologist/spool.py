@@ -0,0 +1,284 @@
+"""
+Журнал предзаписи сообщений (спул) перед отправкой в Firestore
+
+Парсер не пишет сообщения в Firestore напрямую: каждое принятое сообщение
+сначала дописывается строкой JSON в текущий сегмент data/spool/ (с fsync),
+и только после этого считается сохраненным. Фоновый SpoolDrainer
+запечатывает текущий сегмент, пишет его записи в Firestore пакетами до 500
+операций и удаляет сегмент только после успешного коммита всех пакетов.
+При ошибке сегмент остается на диске, а повтор выполняется с
+экспоненциальной задержкой. Сегменты, оставшиеся после падения или
+остановки, дописываются при следующем запуске.
+
+Если сегмент не отправляется SPOOL_MAX_ATTEMPTS раз подряд, его пакет
+делится пополам до отдельных записей: записи, которые Firestore отклоняет
+окончательно (InvalidArgument и другие ошибки 4xx, ошибки сериализации),
+переносятся в rejected_<номер сегмента>.jsonl рядом со спулом, остальные
+отправляются, и очередь идет дальше. При временной ошибке (недоступность,
+квоты) сегмент просто ждет следующей попытки. Формат rejected-файла тот же,
+что у сегмента (плюс текст ошибки), поэтому после исправления его можно
+вернуть в очередь, переименовав в segment_*.jsonl.
+
+append блокирует поток на fsync, поэтому из asyncio его вызывают через
+run_in_executor.
+
+ID документа - hash сообщения, поэтому повторная отправка сегмента
+(например, после падения между коммитом и удалением файла) перезаписывает
+те же документы, а не создает копии.
+"""
+
+import os
+import json
+import glob
+import logging
+import threading
+
+from autologist.metrics import REGISTRY
+from autologist.migration import MAX_BATCH_SIZE, chunked
+from autologist.timebuckets import json_default, with_native_times
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'data/spool')
+
+# Размер сегмента, после которого запись переходит в новый файл
+SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', str(4 * 1024 * 1024)))
+
+# fsync после каждой записи: сообщение переживает падение процесса и ОС
+SPOOL_FSYNC = os.getenv('SPOOL_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+
+# Пауза между попытками отправки и предел экспоненциальной задержки (секунды)
+SPOOL_DRAIN_SECONDS = float(os.getenv('SPOOL_DRAIN_SECONDS', '1'))
+SPOOL_MAX_BACKOFF_SECONDS = float(os.getenv('SPOOL_MAX_BACKOFF_SECONDS', '300'))
+
+# Неудачных попыток подряд, после которых сегмент отправляется по одной записи
+SPOOL_MAX_ATTEMPTS = int(os.getenv('SPOOL_MAX_ATTEMPTS', '3'))
+
+SEGMENT_PATTERN = 'segment_*.jsonl'
+
+WRITE_SECONDS = REGISTRY.histogram('autologist_firestore_write_seconds', 'Длительность коммита пакета спула в Firestore')
+WRITTEN_TOTAL = REGISTRY.counter('autologist_spool_sent_total', 'Сообщения, отправленные из спула в Firestore')
+FAILURES_TOTAL = REGISTRY.counter('autologist_spool_failures_total', 'Неудачные попытки отправки спула')
+REJECTED_TOTAL = REGISTRY.counter('autologist_spool_rejected_total', 'Записи спула, отклоненные Firestore и перенесенные в rejected')
+
+
+def is_permanent(error):
+    """Ошибка, которую повтор не исправит: неверные данные документа, а не сбой сети или квоты"""
+    if isinstance(error, (ValueError, TypeError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, exceptions.ClientError) and \
+        not isinstance(error, (exceptions.TooManyRequests, exceptions.Conflict))
+
+
+def segment_number(path):
+    """Порядковый номер сегмента из имени файла"""
+    return int(os.path.basename(path)[len('segment_'):-len('.jsonl')])
+
+
+def read_segment(path):
+    """
+    Записи сегмента [(doc_id, данные)].
+    Оборванная последняя строка (падение во время записи) пропускается:
+    такое сообщение не было подтверждено.
+    """
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    for number, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if number < len(lines) - 1:
+                logger.error(f"❌ Поврежденная запись в {path}, строка {number + 1} пропущена")
+            continue
+        records.append((record['id'], record['data']))
+    return records
+
+
+class MessageSpool:
+    """Сегментированный журнал сообщений на диске"""
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, fsync=SPOOL_FSYNC):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = None
+        self._current_path = None
+        self._current_size = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Сегменты прошлого запуска запечатаны: запись всегда идет в новый файл
+        existing = self.sealed_segments()
+        self.pending = sum(len(read_segment(path)) for path in existing)
+        self._next_number = segment_number(existing[-1]) + 1 if existing else 1
+        if self.pending:
+            logger.info(f"📥 В спуле {self.pending} неотправленных сообщений в {len(existing)} сегментах")
+
+    def _open_segment(self):
+        self._current_path = os.path.join(self.directory, f"segment_{self._next_number:010d}.jsonl")
+        self._next_number += 1
+        self._file = open(self._current_path, 'a', encoding='utf-8')
+        self._current_size = 0
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._current_path = None
+        self._current_size = 0
+
+    def append(self, doc_id, data):
+        """
+        Дописывает сообщение; после возврата оно не потеряется при падении.
+        Блокирует поток на fsync: из обработчиков asyncio - через run_in_executor.
+        """
+        line = json.dumps({'id': doc_id, 'data': data}, ensure_ascii=False, default=json_default) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._current_size += len(line.encode('utf-8'))
+            self.pending += 1
+            if self._current_size >= self.segment_bytes:
+                self._close_segment()
+
+    def seal(self):
+        """Закрывает текущий сегмент, чтобы его можно было отправить"""
+        with self._lock:
+            self._close_segment()
+
+    def sealed_segments(self):
+        """Закрытые сегменты по порядку записи"""
+        paths = sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)), key=segment_number)
+        return [path for path in paths if path != self._current_path]
+
+    def reject(self, path, failed):
+        """Перенос окончательно отклоненных записей сегмента в rejected_<номер>.jsonl"""
+        rejected_path = os.path.join(self.directory, f"rejected_{segment_number(path):010d}.jsonl")
+        with open(rejected_path, 'a', encoding='utf-8') as f:
+            for (doc_id, data), error in failed:
+                f.write(json.dumps({'id': doc_id, 'data': data, 'error': str(error)},
+                                   ensure_ascii=False, default=json_default) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return rejected_path
+
+    def remove(self, path, count):
+        """Удаление полностью отправленного сегмента"""
+        os.remove(path)
+        with self._lock:
+            self.pending = max(0, self.pending - count)
+
+    def close(self):
+        self.seal()
+
+
+class FirestoreSpoolSink:
+    """Запись сообщений из спула в коллекцию messages с ID = hash"""
+
+    def __init__(self, db, collection='messages'):
+        self.db = db
+        self.collection = collection
+
+    def write(self, records):
+        collection_ref = self.db.collection(self.collection)
+        for chunk in chunked(records, MAX_BATCH_SIZE):
+            batch = self.db.batch()
+            for doc_id, data in chunk:
+                batch.set(collection_ref.document(doc_id), with_native_times(data))
+            with WRITE_SECONDS.time():
+                batch.commit()
+
+
+class SpoolDrainer:
+    """Отправка сегментов спула с повторами и экспоненциальной задержкой"""
+
+    def __init__(self, spool, sink, interval=SPOOL_DRAIN_SECONDS, max_backoff=SPOOL_MAX_BACKOFF_SECONDS,
+                 max_attempts=SPOOL_MAX_ATTEMPTS):
+        self.spool = spool
+        self.sink = sink
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.delay = interval
+        self.stats = {'sent': 0, 'failed_attempts': 0, 'rejected': 0}
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _write_isolated(self, records, failed):
+        """
+        Отправка с делением пакета пополам; окончательно отклоненные записи
+        собираются в failed, временная ошибка прерывает отправку сегмента
+        """
+        try:
+            self.sink.write(records)
+            return len(records)
+        except Exception as e:
+            if not is_permanent(e):
+                raise
+            if len(records) == 1:
+                failed.append((records[0], e))
+                return 0
+        middle = len(records) // 2
+        return self._write_isolated(records[:middle], failed) + self._write_isolated(records[middle:], failed)
+
+    def _send(self, path, records):
+        """Отправка сегмента; после max_attempts неудач - по частям с переносом отклоненных записей"""
+        if self._attempts.get(path, 0) < self.max_attempts:
+            self.sink.write(records)
+            return len(records)
+        failed = []
+        written = self._write_isolated(records, failed)
+        if failed:
+            rejected_path = self.spool.reject(path, failed)
+            self.stats['rejected'] += len(failed)
+            REJECTED_TOTAL.inc(len(failed))
+            logger.error(f"❌ Firestore отклонил {len(failed)} сообщений спула, перенесены в {rejected_path}: "
+                         f"{failed[0][1]}")
+        return written
+
+    def drain(self):
+        """
+        Отправка всех закрытых сегментов по порядку; возвращает число отправленных сообщений.
+        На первой ошибке останавливается: сегмент остается в спуле до следующей попытки,
+        а после max_attempts неудач подряд отклоненные записи переносятся в rejected.
+        """
+        with self._lock:
+            self.spool.seal()
+            sent = 0
+            for path in self.spool.sealed_segments():
+                records = read_segment(path)
+                try:
+                    written = self._send(path, records) if records else 0
+                except Exception as e:
+                    self._attempts[path] = self._attempts.get(path, 0) + 1
+                    self.stats['failed_attempts'] += 1
+                    FAILURES_TOTAL.inc()
+                    self.stats['sent'] += sent
+                    self.delay = min(max(self.delay, self.interval) * 2, self.max_backoff)
+                    logger.error(f"❌ Ошибка отправки спула ({self.spool.pending} сообщений ждут), "
+                                 f"повтор через {self.delay:.0f} с: {e}")
+                    return sent
+                self._attempts.pop(path, None)
+                self.spool.remove(path, len(records))
+                WRITTEN_TOTAL.inc(written)
+                sent += written
+            self.stats['sent'] += sent
+            self.delay = self.interval
+            if sent:
+                logger.info(f"✅ Из спула отправлено в Firebase {sent} сообщений")
+            return sent
+
+    def next_delay(self):
+        """Пауза до следующей попытки: обычный интервал или текущая задержка после ошибок"""
+        return self.delay
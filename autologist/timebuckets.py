@@ -0,0 +1,89 @@
+"""
+Время сообщений: приведение к нативным datetime и поля временных корзин
+
+Каждое сообщение хранит timestamp/created_at как Firestore Timestamp
+и заранее вычисленные корзины day / week / month. Статистика за день,
+неделю или месяц - это запрос на равенство по корзине, а не сравнение строк.
+Граница суток задается STATS_UTC_OFFSET_HOURS (по умолчанию UTC).
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+
+def stats_timezone():
+    """Часовой пояс, в котором считаются корзины"""
+    return timezone(timedelta(hours=float(os.getenv('STATS_UTC_OFFSET_HOURS', '0'))))
+
+
+def parse_timestamp(value):
+    """Приведение timestamp (datetime или ISO строка) к aware datetime в UTC"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    # Значения без зоны писались через datetime.now(), т.е. в локальном времени машины -
+    # astimezone() для naive datetime именно так их и интерпретирует
+    return value.astimezone(timezone.utc)
+
+
+def day_bucket(value):
+    """Корзина дня: '2025-10-30'"""
+    return parse_timestamp(value).astimezone(stats_timezone()).strftime('%Y-%m-%d')
+
+
+def week_bucket(value):
+    """Корзина ISO недели: '2025-W44'"""
+    year, week, _ = parse_timestamp(value).astimezone(stats_timezone()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def month_bucket(value):
+    """Корзина месяца: '2025-10'"""
+    return parse_timestamp(value).astimezone(stats_timezone()).strftime('%Y-%m')
+
+
+def time_buckets(value):
+    """Все корзины для момента времени"""
+    return {'day': day_bucket(value), 'week': week_bucket(value), 'month': month_bucket(value)}
+
+
+def current_buckets():
+    """Корзины текущего момента"""
+    return time_buckets(datetime.now(timezone.utc))
+
+
+def with_native_times(message):
+    """
+    Копия сообщения с нативными timestamp/created_at и полями корзин.
+    Используется при переносе локальных сообщений и в backfill.
+    """
+    converted = dict(message)
+    timestamp = parse_timestamp(message.get('timestamp')) or parse_timestamp(message.get('created_at'))
+    if timestamp is None:
+        return converted
+    converted['timestamp'] = timestamp
+    created_at = parse_timestamp(message.get('created_at'))
+    if created_at is not None:
+        converted['created_at'] = created_at
+    converted.update(time_buckets(timestamp))
+    return converted
+
+
+def needs_backfill(message):
+    """Нужно ли конвертировать сообщение (строковое время или нет корзин)"""
+    return (isinstance(message.get('timestamp'), str)
+            or isinstance(message.get('created_at'), str)
+            or any(field not in message for field in ('day', 'week', 'month')))
+
+
+def json_default(value):
+    """Сериализация datetime для локальных JSON файлов"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Объект {type(value).__name__} не сериализуется в JSON")
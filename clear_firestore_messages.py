@@ -1,17 +1,75 @@
-# Скрипт для удаления всех сообщений из коллекции Firestore
+# Скрипт для очистки коллекции сообщений Firestore
 # Просто запустите: python clear_firestore_messages.py
+#
+# По умолчанию удаляет сообщения старше MESSAGE_RETENTION_DAYS дней (из .env, по умолчанию 7).
+# Удаляемые сообщения выбираются запросом по индексу (timestamp, chat_id + timestamp),
+# удаление идет пакетами по 500 документов.
+#
+#   --all                удалить все сообщения
+#   --older-than-days N  удалить сообщения старше N дней
+#   --chat ID            удалить сообщения чата (можно указать несколько раз)
+#   --dry-run            только посчитать, сколько документов будет удалено
+#   --legacy-scan        сканировать всю коллекцию по разделам: нужно для старых документов
+#                        со строковым timestamp (или сначала запустите backfill_message_times.py)
+#   --workers N          число параллельных запросов / разделов (по умолчанию 4)
+#   --rate N             не больше N удалений в секунду
+#   --every-hours N      повторять очистку каждые N часов (для запуска как сервис)
+#
+# Для запуска по расписанию без --every-hours достаточно cron / планировщика задач:
+#   0 3 * * *  cd /path/to/Autologist && python clear_firestore_messages.py
 
-from google.cloud import firestore
+import argparse
+import logging
+import time
+from datetime import timedelta
 
-print('⏳ Подключение к Firestore...')
-db = firestore.Client()
-print('✅ Firestore готов')
+from dotenv import load_dotenv
 
-messages_ref = db.collection('messages')
-docs = messages_ref.stream()
-count = 0
-for doc in docs:
-    doc.reference.delete()
-    count += 1
+from autologist.retention import RetentionJob, retention_from_env
 
-print(f'✅ Удалено сообщений: {count}')
+
+def build_job(db, args):
+    """Создание задания очистки по аргументам командной строки"""
+    options = dict(workers=args.workers, rate=args.rate, dry_run=args.dry_run, legacy_scan=args.legacy_scan)
+    if args.all:
+        return RetentionJob(db, delete_all=True, **options)
+    if args.older_than_days is None and not args.chat:
+        return retention_from_env(db, **options)
+    older_than = timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+    return RetentionJob(db, older_than=older_than, chat_ids=args.chat, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Очистка сообщений в Firestore')
+    parser.add_argument('--all', action='store_true')
+    parser.add_argument('--older-than-days', type=float)
+    parser.add_argument('--chat', action='append')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--legacy-scan', action='store_true')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float)
+    parser.add_argument('--every-hours', type=float)
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    from google.cloud import firestore
+    print('⏳ Подключение к Firestore...')
+    db = firestore.Client()
+    print('✅ Firestore готов')
+
+    while True:
+        stats = build_job(db, args).run()
+        if args.dry_run:
+            print(f"🔎 Будет удалено сообщений: {stats['matched']} из {stats['scanned']}")
+        else:
+            print(f"✅ Удалено сообщений: {stats['deleted']} из {stats['scanned']} "
+                  f"(ошибок: {stats['errors']}, {stats['elapsed']} с)")
+        if not args.every_hours:
+            break
+        time.sleep(args.every_hours * 3600)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,75 @@
 # Скрипт для переноса всех локальных сообщений в Firestore
 # Просто запустите: python migrate_local_to_firestore.py
+#
+# Сообщения пишутся пакетами по 500 в несколько потоков, ID документа - hash
+# сообщения, поэтому повторный запуск не создает дубликатов. Время переводится
+# в нативные timestamp и дополняется корзинами day / week / month.
+# Прерванный перенос продолжается с контрольной точки.
+#
+#   --dry-run            только посчитать, что будет записано
+#   --workers N          число параллельных писателей (по умолчанию 4)
+#   --batch-size N       размер пакета, не больше 500
+#   --no-verify          не проверять наличие документов после переноса
+#   --reset-checkpoint   начать перенос заново
 
-import os
-import json
-from google.cloud import firestore
-
-# Папка с локальными сообщениями
-LOCAL_MESSAGES_DIR = 'data/messages'
-
-# Инициализация Firestore
-print('⏳ Подключение к Firestore...')
-db = firestore.Client()
-print('✅ Firestore готов')
-
-count = 0
-
-if os.path.exists(LOCAL_MESSAGES_DIR):
-    for filename in os.listdir(LOCAL_MESSAGES_DIR):
-        if filename.endswith('.json'):
-            filepath = os.path.join(LOCAL_MESSAGES_DIR, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    message = json.load(f)
-                # Проверяем, нет ли уже такого сообщения (по id или timestamp+chat_id)
-                # Можно доработать под вашу структуру
-                doc_id = message.get('id') or f"{message.get('chat_id','')}_{message.get('timestamp','')}"
-                db.collection('messages').document(doc_id).set(message)
-                count += 1
-            except Exception as e:
-                print(f'Ошибка при обработке {filename}: {e}')
-else:
-    print('Папка с локальными сообщениями не найдена!')
-
-print(f'✅ Перенос завершён. Загружено сообщений: {count}')
+import argparse
+import logging
+
+from autologist.local_store import LOCAL_MESSAGES_DIR, iter_local_messages
+from autologist.migration import MAX_BATCH_SIZE, MigrationEngine, message_doc_id
+from autologist.timebuckets import with_native_times
+
+CHECKPOINT_PATH = 'data/.migration_messages_checkpoint.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос локальных сообщений в Firestore')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--no-verify', action='store_true')
+    parser.add_argument('--reset-checkpoint', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    messages = [message for _, message in iter_local_messages(LOCAL_MESSAGES_DIR)]
+    if not messages:
+        print('Папка с локальными сообщениями не найдена или пуста!')
+        return
+
+    db = None
+    if not args.dry_run:
+        from google.cloud import firestore
+        print('⏳ Подключение к Firestore...')
+        db = firestore.Client()
+        print('✅ Firestore готов')
+
+    engine = MigrationEngine(db, 'messages', message_doc_id,
+                             batch_size=args.batch_size, workers=args.workers,
+                             checkpoint_path=CHECKPOINT_PATH, transform=with_native_times)
+    if args.reset_checkpoint:
+        engine.checkpoint.reset()
+
+    if args.dry_run:
+        report = engine.dry_run(messages)
+        print(f"🔎 Найдено сообщений: {report['total']}, уникальных: {report['unique']} "
+              f"(дубликатов: {report['duplicates']})")
+        print(f"🔎 Уже перенесено: {report['already_done']}, к записи: {report['pending']} "
+              f"в {report['batches']} пакетах")
+        return
+
+    report = engine.run(messages)
+    print(f"✅ Перенос завершён. Загружено сообщений: {report['written']}, "
+          f"пропущено (уже перенесены): {report['already_done']}, ошибок: {report['failed']}")
+
+    if not args.no_verify:
+        missing = engine.verify({message_doc_id(m) for m in messages})
+        if missing:
+            print(f"❌ В Firestore отсутствует {len(missing)} документов, например: {missing[:5]}")
+        else:
+            print('✅ Проверка пройдена: все сообщения есть в Firestore')
+
+
+if __name__ == '__main__':
+    main()
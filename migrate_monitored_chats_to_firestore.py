@@ -1,23 +1,47 @@
 # Скрипт для переноса monitored_chats.json в Firestore
 # Просто запустите: python migrate_monitored_chats_to_firestore.py
+# Использует тот же движок, что и migrate_local_to_firestore.py (--dry-run поддерживается)
 
+import argparse
 import json
-from google.cloud import firestore
+import logging
+
+from autologist.migration import MigrationEngine, chat_doc_id
 
 # Путь к monitored_chats.json
 MONITORED_CHATS_PATH = 'config/monitored_chats.json'
 
-print('⏳ Подключение к Firestore...')
-db = firestore.Client()
-print('✅ Firestore готов')
 
-with open(MONITORED_CHATS_PATH, 'r', encoding='utf-8') as f:
-    chats = json.load(f)
+def main():
+    parser = argparse.ArgumentParser(description='Перенос monitored_chats.json в Firestore')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    with open(MONITORED_CHATS_PATH, 'r', encoding='utf-8') as f:
+        chats = [chat for chat in json.load(f) if chat.get('chat_id')]
+
+    db = None
+    if not args.dry_run:
+        from google.cloud import firestore
+        print('⏳ Подключение к Firestore...')
+        db = firestore.Client()
+        print('✅ Firestore готов')
+
+    engine = MigrationEngine(db, 'monitored_chats', chat_doc_id, workers=1)
+
+    if args.dry_run:
+        report = engine.dry_run(chats)
+        print(f"🔎 Чатов к записи: {report['pending']} (дубликатов: {report['duplicates']})")
+        return
+
+    report = engine.run(chats)
+    missing = engine.verify({chat_doc_id(chat) for chat in chats})
+    print(f"✅ Перенос завершён. Загружено чатов: {report['written']}, ошибок: {report['failed']}")
+    if missing:
+        print(f"❌ В Firestore отсутствуют чаты: {missing}")
 
-count = 0
-for chat in chats:
-    doc_id = str(chat.get('chat_id'))
-    db.collection('monitored_chats').document(doc_id).set(chat)
-    count += 1
 
-print(f'✅ Перенос завершён. Загружено чатов: {count}')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Запуск нескольких воркеров Telegram парсера
+
+Каждой сессии Telegram соответствует свой процесс telegram_parser_v2.py
+(файл сессии Telethon нельзя открыть из двух процессов). Воркеры делят
+отслеживаемые чаты консистентным хешированием (autologist.sharding) и
+отсекают дубликаты через общее хранилище, поэтому для увеличения объема
+достаточно авторизовать еще один аккаунт (parsers/telegram_auth.py с другим
+TELEGRAM_SESSION_NAME) и добавить его сессию в список.
+
+Упавший воркер перезапускается с растущей паузой; пока он не поднялся,
+его чаты по истечении SHARD_WORKER_TTL_SECONDS переходят к остальным.
+
+Запуск:
+    python parsers/run_sharded.py --sessions account_a,account_b
+    PARSER_SESSIONS=account_a,account_b python parsers/run_sharded.py
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+from dotenv import load_dotenv
+
+PARSER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telegram_parser_v2.py')
+
+# Пауза перед перезапуском упавшего воркера: удваивается до предела
+RESTART_DELAY_SECONDS = 5
+MAX_RESTART_DELAY_SECONDS = 300
+
+# Воркер, проработавший дольше, считается стабильным: пауза сбрасывается
+STABLE_RUN_SECONDS = 600
+
+
+class Worker:
+    """Процесс парсера для одной сессии"""
+
+    def __init__(self, session, worker_id, metrics_port=0):
+        self.session = session
+        self.worker_id = worker_id
+        self.metrics_port = metrics_port
+        self.process = None
+        self.started_at = None
+        self.restart_delay = RESTART_DELAY_SECONDS
+        self.restart_at = 0
+
+    def start(self):
+        env = dict(os.environ, TELEGRAM_SESSION_NAME=self.session, PARSER_WORKER_ID=self.worker_id,
+                   METRICS_PORT=str(self.metrics_port))
+        self.process = subprocess.Popen([sys.executable, PARSER_SCRIPT], env=env)
+        self.started_at = time.time()
+        print(f"🚀 Воркер {self.worker_id} запущен (сессия {self.session}, PID {self.process.pid})")
+
+    def check(self):
+        """Перезапуск завершившегося процесса с экспоненциальной паузой"""
+        now = time.time()
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            if now - self.started_at >= STABLE_RUN_SECONDS:
+                self.restart_delay = RESTART_DELAY_SECONDS
+            print(f"⚠️  Воркер {self.worker_id} завершился с кодом {code}, перезапуск через {self.restart_delay} с")
+            self.process = None
+            self.restart_at = now + self.restart_delay
+            self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY_SECONDS)
+        if now >= self.restart_at:
+            self.start()
+
+    def stop(self, timeout=30):
+        if self.process is None or self.process.poll() is not None:
+            return
+        # SIGINT: парсер сбрасывает спул и индексы и выходит из реестра воркеров
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        print(f"🛑 Воркер {self.worker_id} остановлен")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Запуск нескольких воркеров Telegram парсера')
+    parser.add_argument('--sessions', default=os.getenv('PARSER_SESSIONS', ''),
+                        help='сессии Telegram через запятую (по умолчанию PARSER_SESSIONS)')
+    args = parser.parse_args()
+
+    sessions = [session.strip() for session in args.sessions.split(',') if session.strip()]
+    if not sessions:
+        print("❌ Укажите сессии: --sessions a,b или PARSER_SESSIONS в .env")
+        sys.exit(1)
+
+    # У каждого воркера свой порт метрик: METRICS_PORT, METRICS_PORT + 1, ...
+    base_port = int(os.getenv('METRICS_PORT', '9108'))
+    workers = [Worker(session, f"worker-{session}", base_port + i if base_port else 0)
+               for i, session in enumerate(sessions)]
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    print(f"🧩 Запуск {len(workers)} воркеров: {', '.join(sessions)}")
+    try:
+        while not stopping:
+            for worker in workers:
+                worker.check()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("🛑 Остановка воркеров...")
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    main()
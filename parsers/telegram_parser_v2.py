@@ -2,41 +2,71 @@
 Telegram парсер для сбора сообщений из групповых чатов
 Использует Telethon для подключения к Telegram API
 Версия 2.0 - улучшенная обработка и мониторинг
+
+Telethon и firebase_admin импортируются при первом использовании, а лог
+настраивается в main(): импорт модуля (бенчмарк, воспроизведение потока,
+переобработка архива) не тянет тяжелые зависимости и не создает logs/.
 """
 
 import asyncio
 import os
-import hashlib
 import json
-from datetime import datetime, timedelta
-from telethon import TelegramClient, events
-from telethon.errors import SessionPasswordNeededError, FloodWaitError
-import firebase_admin
-from firebase_admin import credentials, firestore
+import sys
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import logging
 import time
 
+# Общие модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autologist.capture import CaptureWriter, capture_record
+from autologist.chatstats import ChatStatsEngine, FirestoreChatStatsStore, LocalChatStatsStore
+from autologist.contacts import ContactIndex, FirestoreContactStore, LocalContactStore
+from autologist.dedup import DuplicateFilter, FirestoreMessageLookup, LocalMessageLookup
+from autologist.entities import EntityCache, entity_cache_path
+from autologist.extraction import extract_cargos
+from autologist.heartbeat import (HEARTBEAT_SECONDS, FirestoreHeartbeatStore, LocalHeartbeatStore, PipelineMeter,
+                                  build_heartbeat)
+from autologist.keywords import matcher_for_chat
+from autologist.logsetup import ChatTrace, setup_logging, stop_logging
+from autologist.metrics import REGISTRY, start_metrics_server
+from autologist.normalize import fold, message_hash, normalize_message, normalize_text
+from autologist.rollups import FirestoreRollupStore, LocalRollupStore, RollupEngine
+from autologist.routes import FirestoreRouteStore, LocalRouteStore, RouteIndex
+from autologist.sharding import (SHARD_HEARTBEAT_SECONDS, FirestoreDedupStore, FirestoreWorkerRegistry,
+                                 LocalDedupStore, LocalWorkerRegistry, ShardMembership)
+from autologist.spool import SPOOL_DIR, FirestoreSpoolSink, MessageSpool, SpoolDrainer
+from autologist.timebuckets import json_default, time_buckets
+
 # Загружаем переменные окружения
 load_dotenv()
 
-# Создаем папку для логов если её нет
-os.makedirs('logs', exist_ok=True)
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/telegram_parser.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Как часто сбрасывать накопленную статистику в хранилище (секунды)
+ROLLUP_FLUSH_SECONDS = int(os.getenv('ROLLUP_FLUSH_SECONDS', '10'))
+
+# Метрики этапов обработки сообщения (GET /metrics на METRICS_PORT)
+STAGE_SECONDS = REGISTRY.histogram('autologist_parser_stage_seconds', 'Длительность этапов обработки сообщения',
+                                   ['stage'])
+STAGES = ('get_chat', 'normalize', 'dedup', 'dedup_store', 'dedup_shared', 'keyword_match', 'get_sender', 'extract',
+          'store_write', 'message_total')
+STAGE = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES}
+MESSAGES_TOTAL = REGISTRY.counter('autologist_parser_messages_total', 'Сообщения по результату обработки',
+                                  ['outcome'])
+OUTCOME = {outcome: MESSAGES_TOTAL.labels(outcome) for outcome in
+           ('received', 'duplicate', 'duplicate_shared', 'not_cargo', 'saved', 'error')}
+QUEUE_DEPTH = REGISTRY.gauge('autologist_parser_queue_depth', 'Записи, ожидающие отправки', ['queue'])
+CACHE_SIZE = REGISTRY.gauge('autologist_parser_cache_size', 'Размеры кэшей парсера', ['cache'])
+
 class TelegramParser:
-    def __init__(self):
-        """Инициализация парсера"""
+    def __init__(self, client=None, db=None, monitored_chats=None, clock=None):
+        """
+        Инициализация парсера.
+        client, db, monitored_chats и clock подставляются бенчмарком и воспроизведением
+        потоков; по умолчанию - клиент Telethon, Firestore, чаты из настроек и системное время.
+        """
         logger.info("🚀 Инициализация Telegram парсера...")
         
         # Telegram API данные
@@ -44,21 +74,108 @@ class TelegramParser:
         self.api_hash = os.getenv('TELEGRAM_API_HASH')
         self.session_name = os.getenv('TELEGRAM_SESSION_NAME', 'autologist_session')
         
-        if not self.api_id or not self.api_hash:
-            logger.error("❌ TELEGRAM_API_ID и TELEGRAM_API_HASH должны быть установлены в .env файле")
-            raise ValueError("Отсутствуют API данные Telegram")
+        # Текущее время для created_at (при воспроизведении - виртуальные часы)
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
         
-        # Инициализация Telegram клиента
-        self.client = TelegramClient(self.session_name, int(self.api_id), self.api_hash)
+        # Запись входящего потока для воспроизведения (scripts/replay_capture.py)
+        self.capture = CaptureWriter() if os.getenv('PARSER_CAPTURE', 'false').lower() in ('1', 'true', 'yes') else None
+        
+        # Идентификатор воркера при запуске нескольких парсеров (parsers/run_sharded.py)
+        self.worker_id = os.getenv('PARSER_WORKER_ID')
+        
+        if client is not None:
+            self.client = client
+        else:
+            if not self.api_id or not self.api_hash:
+                logger.error("❌ TELEGRAM_API_ID и TELEGRAM_API_HASH должны быть установлены в .env файле")
+                raise ValueError("Отсутствуют API данные Telegram")
+            
+            # Инициализация Telegram клиента
+            from telethon import TelegramClient
+            
+            self.client = TelegramClient(self.session_name, int(self.api_id), self.api_hash)
+        
+        # Аккаунт и чаты сессии: после перезапуска не нужно заново обходить диалоги
+        # (у подставленного клиента - только в памяти)
+        self.entities = EntityCache(entity_cache_path(self.session_name) if client is None else None)
         
         # Инициализация Firebase
-        self.init_firebase()
+        if db is not None:
+            self.db = db
+            self.use_local_storage = False
+        else:
+            self.init_firebase()
+        
+        # Статистика грузов по дням (счетчики копятся в памяти и периодически сбрасываются)
+        rollup_store = LocalRollupStore() if self.use_local_storage else FirestoreRollupStore(self.db)
+        self.rollups = RollupEngine(rollup_store)
+        
+        # Индекс контактов: телефон -> объявления (сбрасывается вместе со статистикой)
+        contact_store = LocalContactStore() if self.use_local_storage else FirestoreContactStore(self.db)
+        self.contacts = ContactIndex(contact_store)
+        
+        # Индекс маршрутов для поиска заявок по откуда / куда
+        route_store = LocalRouteStore() if self.use_local_storage else FirestoreRouteStore(self.db)
+        self.routes = RouteIndex(route_store)
+        
+        # Статистика по чатам: сколько сообщений пришло, сохранено и отсеяно
+        chat_stats_store = LocalChatStatsStore() if self.use_local_storage else FirestoreChatStatsStore(self.db)
+        self.chat_stats = ChatStatsEngine(chat_stats_store)
+        
+        # Журнал предзаписи: сообщения для Firebase сначала попадают на диск,
+        # в Firestore их отправляет фоновая задача (в том числе оставшиеся с прошлого запуска)
+        self.spool = None
+        self.spool_drainer = None
+        if not self.use_local_storage:
+            # У каждого воркера свой спул: сегменты процессов не пересекаются
+            self.spool = MessageSpool(os.path.join(SPOOL_DIR, self.worker_id) if self.worker_id else SPOOL_DIR)
+            self.spool_drainer = SpoolDrainer(self.spool, FirestoreSpoolSink(self.db))
+        
+        # Чаты делятся между воркерами по кольцу, дубликаты отсекаются общим хранилищем
+        self.shard = None
+        self.dedup = None
+        if self.worker_id:
+            if self.use_local_storage:
+                self.shard = ShardMembership(self.worker_id, LocalWorkerRegistry())
+                self.dedup = LocalDedupStore()
+            else:
+                self.shard = ShardMembership(self.worker_id, FirestoreWorkerRegistry(self.db))
+                self.dedup = FirestoreDedupStore(self.db)
+            logger.info(f"🧩 Воркер {self.worker_id} (сессия {self.session_name})")
+        
+        # Пульс: периодический отчет о скорости, задержке и очередях для API
+        self.heartbeats = LocalHeartbeatStore() if self.use_local_storage else FirestoreHeartbeatStore(self.db)
+        self.meter = PipelineMeter()
+        self.started_at = datetime.now(timezone.utc)
+        
+        # Датчики очередей и кэшей читаются при каждом опросе метрик
+        if self.spool:
+            QUEUE_DEPTH.set_function(lambda: self.spool.pending, 'spool')
+        QUEUE_DEPTH.set_function(self.rollups.pending, 'rollups')
+        QUEUE_DEPTH.set_function(self.contacts.pending, 'contacts')
+        QUEUE_DEPTH.set_function(self.routes.pending, 'routes')
+        QUEUE_DEPTH.set_function(self.chat_stats.pending, 'chat_stats')
+        CACHE_SIZE.set_function(lambda: len(self.duplicates), 'dedup_filter')
+        CACHE_SIZE.set_function(lambda: len(self.keyword_matchers), 'keyword_matchers')
+        CACHE_SIZE.set_function(lambda: len(self.entities.chats), 'entities')
+        CACHE_SIZE.set_function(lambda: normalize_text.cache_info().currsize, 'normalized_texts')
         
         # Список чатов для мониторинга
-        self.monitored_chats = self.load_monitored_chats()
+        self.monitored_chats = monitored_chats if monitored_chats is not None else self.load_monitored_chats()
+        
+        # Предвычисленные основы ключевых слов по настройкам чатов
+        self.keyword_matchers = {}
         
-        # Кэш для предотвращения дубликатов
-        self.processed_messages = set()
+        # Чаты с подробной трассировкой (config/debug_chats.json или LOG_TRACE_CHATS, меняется на ходу)
+        self.trace = ChatTrace()
+        
+        # Дубликаты: фильтр Блума за DUPLICATE_THRESHOLD_HOURS, хранилище - только для возможных дубликатов
+        # (у подставленной базы - только фильтр и недавно сохраненные hash)
+        if db is not None:
+            lookup = None
+        else:
+            lookup = LocalMessageLookup() if self.use_local_storage else FirestoreMessageLookup(self.db)
+        self.duplicates = DuplicateFilter(lookup, clock=self.clock)
         
         # Статистика
         self.stats = {
@@ -71,6 +188,9 @@ class TelegramParser:
     def init_firebase(self):
         """Инициализация Firebase"""
         try:
+            import firebase_admin
+            from firebase_admin import firestore
+            
             if not firebase_admin._apps:
                 # Используем упрощенную инициализацию для работы с публичными данными
                 project_id = os.getenv('FIREBASE_PROJECT_ID', 'autologist-91ecf')
@@ -137,43 +257,68 @@ class TelegramParser:
         return self.load_monitored_chats(force_update=True)
     
     def create_message_hash(self, text, sender_id, chat_id):
-        """Создание хеша для дедупликации сообщений"""
-        hash_string = f"{text}_{sender_id}_{chat_id}"
-        return hashlib.md5(hash_string.encode()).hexdigest()
+        """Создание хеша для дедупликации сообщений (text - нормализованная форма)"""
+        return message_hash(text, sender_id, chat_id)
     
-    def is_cargo_related(self, text, keywords):
-        """Проверка содержит ли сообщение ключевые слова о грузах"""
+    def is_cargo_related(self, text, chat_config, normalized=None):
+        """
+        Проверка содержит ли сообщение ключевые слова о грузах.
+        Режим поиска берется из match_mode чата: substring (подстрока) или stem (по основам слов)
+        """
         if not text:
             return False, []
         
-        text_lower = text.lower()
-        found_keywords = []
-        
-        for keyword in keywords:
-            kw = keyword.lower().strip()
-            if kw and kw in text_lower:
-                found_keywords.append(keyword)
+        matcher = matcher_for_chat(chat_config, self.keyword_matchers)
+        found_keywords = matcher.match(text, normalized or normalize_text(text))
         
         return len(found_keywords) > 0, found_keywords
     
     async def start(self):
         """Запуск парсера"""
         logger.info("🚀 Запуск Telegram парсера...")
+        from telethon.errors import SessionPasswordNeededError
         
         try:
             # Подключение к Telegram
             await self.client.start()
             
-            # Проверяем авторизацию
-            me = await self.client.get_me()
-            logger.info(f"✅ Подключен как: {me.first_name} (@{me.username})")
+            # Фильтр дубликатов - сообщениями, сохраненными за окно дедупликации
+            await asyncio.get_event_loop().run_in_executor(None, self.duplicates.warm)
             
-            # Получаем список доступных чатов
-            await self.discover_chats()
+            # Аккаунт и чаты из кэша сущностей: обход диалогов уйдет в фон
+            warm = bool(self.entities.me and self.entities.chats)
+            if warm:
+                me = self.entities.me
+                logger.info(f"✅ Подключен как: {me['first_name']} (@{me['username']}), "
+                            f"{len(self.entities.chats)} чатов из кэша")
+                if self.shard:
+                    self.shard.set_chats(list(self.entities.chats))
+            else:
+                # Холодный старт: аккаунт и список чатов нужны до подписки на сообщения
+                me = await self.client.get_me()
+                self.entities.set_me(me)
+                logger.info(f"✅ Подключен как: {me.first_name} (@{me.username})")
+                await self.discover_chats()
+            
+            # Регистрируемся среди воркеров до подписки на сообщения
+            if self.shard:
+                await self.refresh_shard()
+                self.shard_task = asyncio.create_task(self.refresh_shard_periodically())
             
             # Настраиваем обработчик новых сообщений
             self.setup_message_handlers()
             
+            # HTTP сервер метрик (у воркеров run_sharded.py свои порты)
+            self.metrics_server = start_metrics_server()
+            
+            # Периодический сброс статистики
+            self.rollup_task = asyncio.create_task(self.flush_rollups_periodically())
+            self.heartbeat_task = asyncio.create_task(self.publish_heartbeat_periodically())
+            if self.spool_drainer:
+                self.spool_task = asyncio.create_task(self.drain_spool_periodically())
+            if warm:
+                self.discovery_task = asyncio.create_task(self.refresh_entities())
+            
             # Запускаем мониторинг
             logger.info("👁️  Начинаем мониторинг сообщений...")
             await self.client.run_until_disconnected()
@@ -185,40 +330,80 @@ class TelegramParser:
             raise
     
     async def discover_chats(self):
-        """Получение списка доступных чатов и каналов"""
-        logger.info("🔍 Ищем доступные чаты и каналы...")
+        """
+        Получение списка доступных чатов и каналов.
+        Обходит только диалоги, изменившиеся с прошлого обхода (см. autologist.entities);
+        все диалоги - при пустом кэше и раз в ENTITY_FULL_WALK_HOURS.
+        """
+        full = self.entities.needs_full_walk()
+        logger.info(f"🔍 Ищем доступные чаты и каналы ({'полный обход' if full else 'только изменения'})...")
         
         cargo_keywords = ['груз', 'перевозка', 'доставка', 'транспорт', 'логистика', 'фура', 'тонн']
-        found_chats = []
+        seen = []
         
         async for dialog in self.client.iter_dialogs():
-            if dialog.is_group or dialog.is_channel:
-                title_lower = dialog.title.lower()
-                is_cargo_chat = any(keyword in title_lower for keyword in cargo_keywords)
-                
-                chat_info = {
-                    'id': dialog.id,
-                    'title': dialog.title,
-                    'type': 'канал' if dialog.is_channel else 'группа',
-                    'participants': getattr(dialog.entity, 'participants_count', 'неизвестно'),
-                    'cargo_related': is_cargo_chat
-                }
-                
-                found_chats.append(chat_info)
-                
-                status = "🚛" if is_cargo_chat else "💬"
-                logger.info(f"{status} {chat_info['type']}: {chat_info['title']} (ID: {chat_info['id']}, участников: {chat_info['participants']})")
+            if not (dialog.is_group or dialog.is_channel):
+                continue
+            top_message = dialog.message.id if dialog.message else None
+            unchanged = self.entities.remember(dialog.entity, top_message)
+            seen.append(dialog.id)
+            if not unchanged:
+                title_lower = fold(dialog.title)
+                status = "🚛" if any(keyword in title_lower for keyword in cargo_keywords) else "💬"
+                logger.info(f"{status} {'канал' if dialog.is_channel else 'группа'}: {dialog.title} (ID: {dialog.id}, "
+                            f"участников: {getattr(dialog.entity, 'participants_count', 'неизвестно')})")
+            # Диалоги идут от новых к старым: дальше только не изменившиеся (закрепленные идут первыми)
+            if unchanged and not full and not dialog.pinned:
+                break
+        
+        if full:
+            removed = self.entities.retain(seen)
+            if removed:
+                logger.info(f"🚪 Аккаунт больше не состоит в {len(removed)} чатах")
+        
+        found_chats = []
+        for record in self.entities.chats.values():
+            found_chats.append({
+                'id': record['id'],
+                'title': record['title'],
+                'type': 'канал' if record['type'] != 'group' else 'группа',
+                'participants': record.get('participants') or 'неизвестно',
+                'cargo_related': any(keyword in fold(record['title'] or '') for keyword in cargo_keywords)
+            })
         
         # Сохраняем найденные чаты
         os.makedirs('config', exist_ok=True)
         with open('config/discovered_chats.json', 'w', encoding='utf-8') as f:
             json.dump(found_chats, f, ensure_ascii=False, indent=2)
+        self.entities.save()
+        
+        if self.shard:
+            self.shard.set_chats([chat['id'] for chat in found_chats])
         
         cargo_chats = [chat for chat in found_chats if chat['cargo_related']]
-        logger.info(f"📊 Найдено {len(found_chats)} чатов, из них {len(cargo_chats)} связанных с грузоперевозками")
+        logger.info(f"📊 Найдено {len(found_chats)} чатов (просмотрено диалогов {len(seen)}), "
+                    f"из них {len(cargo_chats)} связанных с грузоперевозками")
+    
+    async def refresh_entities(self):
+        """Фоновая проверка аккаунта и диалогов после старта из кэша"""
+        try:
+            self.entities.set_me(await self.client.get_me())
+            await self.discover_chats()
+        except Exception as e:
+            logger.warning(f"⚠️  Не удалось обновить кэш сущностей: {e}")
+    
+    async def resolve_chat(self, event):
+        """Чат события: из кэша сущностей, без кэша - запросом к Telegram (и в кэш)"""
+        chat = self.entities.get(getattr(event, 'chat_id', None))
+        if chat is None:
+            chat = await event.get_chat()
+            self.entities.remember(chat)
+        return chat
     
     def setup_message_handlers(self):
         """Настройка обработчиков сообщений только для выбранных чатов"""
+        from telethon import events
+        
         # Получаем список chat_id для мониторинга
         monitored_ids = set()
         for chat in self.monitored_chats:
@@ -232,11 +417,21 @@ class TelegramParser:
         
         @self.client.on(events.NewMessage())
         async def handle_new_message(event):
-            chat = await event.get_chat()
+            with STAGE['get_chat'].time():
+                chat = await self.resolve_chat(event)
             chat_id_str = str(getattr(chat, 'id', ''))
             if chat_id_str not in monitored_ids:
                 return
-            await self.process_message(event)
+            if self.shard and not self.shard.owns(chat_id_str):
+                return
+            if self.capture:
+                # Отправитель загружается здесь; Telethon кэширует его, save_message не запрашивает повторно
+                with STAGE['get_sender'].time():
+                    sender = await event.message.get_sender()
+                self.capture.write(capture_record(chat, event.message, sender))
+            OUTCOME['received'].inc()
+            with STAGE['message_total'].time():
+                await self.process_message(event)
         
         logger.info(f"✅ Обработчики сообщений настроены только для чатов: {[c['chat_id'] for c in self.monitored_chats if c.get('enabled', True)]}")
     
@@ -244,17 +439,18 @@ class TelegramParser:
         """Обработка нового сообщения"""
         try:
             message = event.message
-            chat = await event.get_chat()
+            chat = await self.resolve_chat(event)
+            traced = self.trace.traced(chat.id)
             
-            # Отладочная информация о всех сообщениях
-            logger.info(f"📨 Получено сообщение от чата: {getattr(chat, 'title', 'Без названия')} (ID: {chat.id})")
+            # Частое событие: в лог попадает выборка (LOG_SAMPLE_RATES)
+            logger.info("📨 Получено сообщение от чата: %s (ID: %s)", getattr(chat, 'title', 'Без названия'), chat.id,
+                        extra={'sample': 'message_received', 'chat_id': str(chat.id)})
             
-            # Дополнительная отладка для тестового чата
-            if hasattr(chat, 'title') and ("тест" in chat.title.lower() or "автологист" in chat.title.lower()):
-                logger.info(f"🧪 ТЕСТОВЫЙ ЧАТ: {chat.title}")
-                logger.info(f"🧪 ID: {chat.id}")
-                logger.info(f"🧪 Тип чата: megagroup={getattr(chat, 'megagroup', None)}, broadcast={getattr(chat, 'broadcast', None)}")
-                logger.info(f"🧪 Текст: {message.text[:100] if message.text else 'Нет текста'}...")
+            if traced:
+                logger.info("🧪 Трассировка чата %s (ID: %s): megagroup=%s, broadcast=%s, текст: %s",
+                            getattr(chat, 'title', None), chat.id, getattr(chat, 'megagroup', None),
+                            getattr(chat, 'broadcast', None), (message.text or 'Нет текста')[:100],
+                            extra={'chat_id': str(chat.id), 'trace': True})
             
             # Пропускаем личные сообщения  
             if not (hasattr(chat, 'title') and (getattr(chat, 'megagroup', False) or getattr(chat, 'broadcast', False) or hasattr(chat, 'participants_count'))):
@@ -263,7 +459,8 @@ class TelegramParser:
                     return  # Точно личное сообщение
                 
                 # Дополнительная отладка для отклоненных чатов
-                logger.debug(f"🚫 Пропускаем чат {getattr(chat, 'title', 'Без названия')}: megagroup={getattr(chat, 'megagroup', None)}, broadcast={getattr(chat, 'broadcast', None)}")
+                logger.debug("🚫 Пропускаем чат %s: megagroup=%s, broadcast=%s", getattr(chat, 'title', 'Без названия'),
+                             getattr(chat, 'megagroup', None), getattr(chat, 'broadcast', None))
                 return
             
             # Пропускаем пустые сообщения
@@ -271,37 +468,42 @@ class TelegramParser:
                 return
             
             self.stats['messages_processed'] += 1
+            self.meter.observe(message.date)
+            
+            # Нормализация один раз: дальше ее используют хеш, ключевые слова и извлечение заявок
+            with STAGE['normalize'].time():
+                normalized = normalize_message(message)
             
             # Создаем хеш для дедупликации
             message_hash = self.create_message_hash(
-                message.text, 
+                normalized.dedup_key(), 
                 str(message.sender_id), 
                 str(chat.id)
             )
             
-            # Пропускаем уже обработанные сообщения
-            if message_hash in self.processed_messages:
+            # Пропускаем уже сохраненные сообщения: к хранилищу - только если фильтр Блума не уверен
+            with STAGE['dedup'].time():
+                seen = self.duplicates.might_contain(message_hash)
+            if seen:
+                with STAGE['dedup_store'].time():
+                    seen = await asyncio.get_event_loop().run_in_executor(None, self.duplicates.confirm, message_hash)
+            if seen:
+                OUTCOME['duplicate'].inc()
+                self.chat_stats.record(chat, message, 'duplicate')
                 return
             
-            self.processed_messages.add(message_hash)
-            
             # Ищем настройки для данного чата СРАЗУ
             chat_config = None
             chat_id_str = str(chat.id)
             
-            # Отладочное логирование для тестового чата
-            if "тест автологист" in chat.title.lower():
-                logger.info(f"🔍 DEBUG: Ищем настройки для '{chat.title}' с ID: {chat_id_str}")
+            if traced:
                 config_list = [f"{c.get('title')} ({c.get('chat_id')})" for c in self.monitored_chats]
-                logger.info(f"🔍 DEBUG: Доступные чаты в конфигурации: {config_list}")
+                logger.info("🔍 Ищем настройки для '%s' с ID %s среди: %s", chat.title, chat_id_str, config_list,
+                            extra={'chat_id': chat_id_str, 'trace': True})
             
             for monitored_chat in self.monitored_chats:
                 config_chat_id = str(monitored_chat.get('chat_id', ''))
                 
-                # Отладочная информация для тестового чата
-                if "тест автологист" in chat.title.lower():
-                    logger.info(f"🔍 DEBUG: Сравниваем '{chat_id_str}' с конфигурацией '{config_chat_id}'")
-                
                 # Сравниваем ID с учетом возможных префиксов -100 и знаков
                 if (chat_id_str == config_chat_id or 
                     chat_id_str == config_chat_id.replace('-100', '') or
@@ -309,38 +511,69 @@ class TelegramParser:
                     f'-{chat_id_str}' == config_chat_id or
                     chat_id_str == config_chat_id.replace('-', '')):
                     chat_config = monitored_chat
-                    logger.info(f"🎯 Найдены настройки для чата {chat.title}: {config_chat_id}")
                     break
             
             # ПРОПУСКАЕМ чаты, которые НЕ в списке мониторинга
             if not chat_config or not chat_config.get('enabled', True):
-                logger.debug(f"⏭️ Пропускаем чат {chat.title} - не в списке мониторинга или отключен")
+                logger.debug("⏭️ Пропускаем чат %s - не в списке мониторинга или отключен", chat.title)
                 return
-            # Используем ключевые слова из настроек чата (чат уже проверен выше)
-            keywords_to_check = chat_config.get('keywords', [])
-            logger.info(f"🔑 Используем ключевые слова чата {chat.title}: {keywords_to_check}")
-            
-            # Подробное логирование для чата Калжат
-            if "калжат" in chat.title.lower():
-                logger.info(f"🔎 [Калжат] Текст сообщения: {message.text}")
-            is_cargo, found_keywords = self.is_cargo_related(message.text, keywords_to_check)
-            if "калжат" in chat.title.lower():
-                logger.info(f"🔎 [Калжат] Ключевые слова найдены: {found_keywords}")
+            
+            if traced:
+                logger.info("🔑 Настройки чата %s: %s, ключевые слова: %s, текст: %s", chat.title,
+                            chat_config.get('chat_id'), chat_config.get('keywords', []), message.text,
+                            extra={'chat_id': chat_id_str, 'trace': True})
+            with STAGE['keyword_match'].time():
+                is_cargo, found_keywords = self.is_cargo_related(message.text, chat_config, normalized)
+            if traced:
+                logger.info("🔎 Ключевые слова найдены: %s", found_keywords, extra={'chat_id': chat_id_str, 'trace': True})
+            if is_cargo:
+                # Отмечаем до первого await: такое же сообщение, пришедшее следом, уже будет дубликатом
+                self.duplicates.add(message_hash)
+            if is_cargo and self.dedup:
+                # Сообщение мог уже сохранить другой воркер (общий чат или перебалансировка)
+                loop = asyncio.get_event_loop()
+                with STAGE['dedup_shared'].time():
+                    claimed = await loop.run_in_executor(None, self.dedup.claim, message_hash, self.worker_id)
+                if not claimed:
+                    OUTCOME['duplicate_shared'].inc()
+                    self.chat_stats.record(chat, message, 'duplicate')
+                    logger.debug("⏭️ Сообщение %s уже сохранено другим воркером", message_hash[:8])
+                    return
             if is_cargo:
-                await self.save_message(message, chat, message_hash, found_keywords)
-                logger.info(f"💾 Сохранено сообщение из {chat.title} по ключевым словам: {', '.join(found_keywords)}")
+                if await self.save_message(message, chat, message_hash, found_keywords):
+                    logger.info("💾 Сохранено сообщение из %s по ключевым словам: %s", chat.title,
+                                ', '.join(found_keywords), extra={'chat_id': chat_id_str, 'hash': message_hash})
+                else:
+                    # Не сохранено: повтор этого сообщения не должен считаться дубликатом
+                    await self.forget_message(message_hash)
             else:
-                logger.debug(f"❌ Сообщение из {chat.title} не содержит ключевых слов: {message.text[:50]}...")
+                OUTCOME['not_cargo'].inc()
+                self.chat_stats.record(chat, message, 'filtered', chat_config.get('title'))
+                logger.debug("❌ Сообщение из %s не содержит ключевых слов: %s...", chat.title, message.text[:50],
+                             extra={'sample': 'keywords'})
             
         except Exception as e:
             self.stats['errors'] += 1
-            logger.error(f"❌ Ошибка обработки сообщения: {e}")
+            OUTCOME['error'].inc()
+            logger.exception("❌ Ошибка обработки сообщения: %s", e)
+    
+    async def forget_message(self, message_hash):
+        """Снять отметки дедупликации с сообщения, которое не удалось сохранить"""
+        self.duplicates.discard(message_hash)
+        if self.dedup:
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self.dedup.release, message_hash)
+            except Exception as e:
+                # Отметка останется до истечения TTL
+                logger.error(f"❌ Не удалось снять отметку дедупликации {message_hash[:8]}: {e}")
     
     async def save_message(self, message, chat, message_hash, found_keywords=None):
-        """Сохранение сообщения в Firebase или локально"""
+        """Сохранение сообщения в Firebase или локально; False - сообщение не записано"""
+        written = False
         try:
             # Получаем информацию об отправителе
-            sender = await message.get_sender()
+            with STAGE['get_sender'].time():
+                sender = await message.get_sender()
             sender_name = ""
             sender_username = ""
             
@@ -367,29 +600,121 @@ class TelegramParser:
                 'sender_id': str(message.sender_id) if message.sender_id else None,
                 'sender_name': sender_name,
                 'sender_username': sender_username,
-                'timestamp': message.date.isoformat() if message.date else datetime.now().isoformat(),
+                'timestamp': message.date or self.clock(),
                 'processed': False,
                 'hash': message_hash,
-                'created_at': datetime.now().isoformat(),
+                'created_at': self.clock(),
                 'keywords_found': found_keywords or []
             }
+            # Корзины day / week / month для статистики запросами на равенство
+            message_data.update(time_buckets(message_data['timestamp']))
             
-            if hasattr(self, 'use_local_storage') and self.use_local_storage:
-                # Сохраняем локально в JSON файл
-                filename = f"data/messages/message_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{message_hash[:8]}.json"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(message_data, f, ensure_ascii=False, indent=2)
-                logger.info(f"💾 Сообщение сохранено локально: {filename}")
-            else:
-                # Сохраняем в Firebase
-                doc_ref = self.db.collection('messages').add(message_data)
-                logger.info(f"✅ Сообщение сохранено в Firebase: {doc_ref[1].id}")
+            # Заявки, извлеченные правилами (маршрут, тип груза, вес, объем, ставка)
+            normalized = normalize_message(message)
+            with STAGE['extract'].time():
+                cargos = extract_cargos(normalized.clean)
+            message_data['cargos'] = cargos
+            message_data['phones'] = list(normalized.phones)
+            
+            with STAGE['store_write'].time():
+                if hasattr(self, 'use_local_storage') and self.use_local_storage:
+                    # Сохраняем локально в JSON файл
+                    filename = f"data/messages/message_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{message_hash[:8]}.json"
+                    with open(filename, 'w', encoding='utf-8') as f:
+                        json.dump(message_data, f, ensure_ascii=False, indent=2, default=json_default)
+                    logger.debug("💾 Сообщение сохранено локально: %s", filename)
+                else:
+                    # Записываем в спул; в Firebase (документ messages/{hash}) отправит фоновая задача.
+                    # fsync выполняется в пуле потоков, чтобы не останавливать цикл событий
+                    await asyncio.get_event_loop().run_in_executor(None, self.spool.append, message_hash, message_data)
+                    logger.debug("📥 Сообщение записано в спул для Firebase: %s", message_hash[:8])
+            written = True
             
             self.stats['messages_saved'] += 1
+            OUTCOME['saved'].inc()
+            self.rollups.record(message_data, cargos)
+            self.contacts.record(message_data, normalized.phones)
+            self.routes.record(message_data)
+            self.chat_stats.record(chat, message, 'saved')
             
         except Exception as e:
             self.stats['errors'] += 1
-            logger.error(f"❌ Ошибка сохранения сообщения: {e}")
+            OUTCOME['error'].inc()
+            logger.exception("❌ Ошибка сохранения сообщения: %s", e)
+        # Ошибка после записи (статистика, индексы) не отменяет сохранение
+        return written
+    
+    async def flush_rollups_periodically(self):
+        """Фоновый сброс накопленной статистики и индексов, не блокируя обработку сообщений"""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(ROLLUP_FLUSH_SECONDS)
+            await loop.run_in_executor(None, self.rollups.flush)
+            await loop.run_in_executor(None, self.contacts.flush)
+            await loop.run_in_executor(None, self.routes.flush)
+            await loop.run_in_executor(None, self.chat_stats.flush)
+            await loop.run_in_executor(None, self.entities.save)
+    
+    async def drain_spool_periodically(self):
+        """Фоновая отправка спула в Firestore; при ошибках пауза растет экспоненциально"""
+        loop = asyncio.get_event_loop()
+        while True:
+            await loop.run_in_executor(None, self.spool_drainer.drain)
+            await asyncio.sleep(self.spool_drainer.next_delay())
+    
+    async def refresh_shard(self):
+        """Обновление записи воркера и состава кольца; при изменении - новая раскладка чатов"""
+        loop = asyncio.get_event_loop()
+        try:
+            changed = await loop.run_in_executor(None, self.shard.refresh)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления реестра воркеров: {e}")
+            return
+        if changed:
+            chat_ids = [chat['chat_id'] for chat in self.monitored_chats
+                        if chat.get('enabled', True) and chat.get('chat_id')]
+            assignment = self.shard.assignment(chat_ids)
+            own = len(assignment.get(self.worker_id, []))
+            logger.info(f"🧩 Перебалансировка: воркеры {', '.join(self.shard.ring.workers)}; "
+                        f"{self.worker_id} обрабатывает {own} из {len(chat_ids)} чатов")
+    
+    async def refresh_shard_periodically(self):
+        """Периодическая регистрация воркера: выбывшие воркеры отпадают по TTL"""
+        while True:
+            await asyncio.sleep(SHARD_HEARTBEAT_SECONDS)
+            await self.refresh_shard()
+    
+    def heartbeat(self, status='running'):
+        """Документ пульса: счетчики, скорости, задержка, очереди и кэши"""
+        counters = {key: self.stats[key] for key in ('messages_processed', 'messages_saved', 'errors')}
+        queues = {
+            'spool': self.spool.pending if self.spool else 0,
+            'rollups': self.rollups.pending(),
+            'contacts': self.contacts.pending(),
+            'routes': self.routes.pending(),
+            'chat_stats': self.chat_stats.pending()
+        }
+        caches = {
+            'dedup_filter': len(self.duplicates),
+            'keyword_matchers': len(self.keyword_matchers),
+            'entities': len(self.entities.chats),
+            'normalized_texts': normalize_text.cache_info().currsize
+        }
+        return build_heartbeat(self.worker_id or 'main', self.session_name, status, self.started_at,
+                               counters, self.meter, queues, caches)
+    
+    async def publish_heartbeat(self, status='running'):
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.heartbeats.publish, self.heartbeat(status))
+        except Exception as e:
+            logger.warning(f"⚠️  Не удалось отправить пульс: {e}")
+    
+    async def publish_heartbeat_periodically(self):
+        """Пульс из цикла событий: если цикл завис, отчеты прекращаются и API это видит"""
+        while True:
+            await self.publish_heartbeat()
+            await asyncio.sleep(HEARTBEAT_SECONDS)
     
     async def get_stats(self):
         """Получение статистики работы"""
@@ -397,7 +722,10 @@ class TelegramParser:
         return {
             **self.stats,
             'uptime': str(uptime),
-            'cache_size': len(self.processed_messages)
+            'cache_size': len(self.duplicates),
+            'dedup': dict(self.duplicates.stats),
+            'spool_pending': self.spool.pending if self.spool else 0,
+            'metrics': REGISTRY.snapshot()
         }
     
     async def stop(self):
@@ -405,11 +733,32 @@ class TelegramParser:
         logger.info("🛑 Остановка парсера...")
         stats = await self.get_stats()
         logger.info(f"📊 Статистика: {stats}")
+        self.rollups.flush()
+        self.contacts.flush()
+        self.routes.flush()
+        self.chat_stats.flush()
+        self.entities.save()
+        await self.publish_heartbeat('stopped')
+        if self.spool_drainer:
+            # Что не удалось отправить, останется на диске до следующего запуска
+            self.spool_drainer.drain()
+            self.spool.close()
+        if self.shard:
+            # Чаты воркера сразу переходят к остальным, не дожидаясь TTL
+            try:
+                self.shard.leave()
+            except Exception as e:
+                logger.error(f"❌ Ошибка выхода из реестра воркеров: {e}")
+        if self.capture:
+            self.capture.close()
         await self.client.disconnect()
+        stop_logging()
 
 # Функция для запуска парсера
 async def main():
     """Основная функция запуска"""
+    # Логирование через очередь: JSON в logs/telegram_parser.log и текст в консоль пишет фоновый поток
+    setup_logging('logs/telegram_parser.log')
     parser = TelegramParser()
     
     try:
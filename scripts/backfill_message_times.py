@@ -0,0 +1,104 @@
+"""
+Конвертация существующих сообщений Firestore к нативному времени
+
+Для документов, где timestamp/created_at хранятся ISO строками или нет
+полей корзин, записывает нативные Timestamp и поля day / week / month.
+Коллекция сканируется параллельно по разделам, обновления коммитятся
+пакетами по 500. Уже сконвертированные документы не трогаются,
+поэтому скрипт можно безопасно перезапускать.
+
+Запуск:
+    python scripts/backfill_message_times.py --dry-run
+    python scripts/backfill_message_times.py --workers 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autologist.migration import MAX_BATCH_SIZE, chunked
+from autologist.scan import CollectionScanner
+from autologist.timebuckets import needs_backfill, with_native_times
+
+logger = logging.getLogger(__name__)
+
+TIME_FIELDS = ['timestamp', 'created_at', 'day', 'week', 'month']
+
+
+class TimeBackfill:
+    """Пакетное обновление полей времени"""
+
+    def __init__(self, db, collection='messages', workers=4, dry_run=False):
+        self.db = db
+        self.collection = collection
+        self.workers = workers
+        self.dry_run = dry_run
+        self.stats = {'scanned': 0, 'converted': 0, 'skipped': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def run(self):
+        started = time.time()
+        CollectionScanner(self.db, self.collection, workers=self.workers,
+                          fields=TIME_FIELDS).run(self._process_page)
+        self.stats['elapsed'] = round(time.time() - started, 2)
+        return self.stats
+
+    def _process_page(self, snapshots):
+        updates = []
+        skipped = 0
+        for snapshot in snapshots:
+            data = snapshot.to_dict() or {}
+            if not needs_backfill(data):
+                continue
+            converted = with_native_times(data)
+            if 'day' not in converted:
+                # Время не распознано - оставляем документ как есть
+                skipped += 1
+                continue
+            updates.append((snapshot.reference, {field: converted[field] for field in TIME_FIELDS
+                                                 if field in converted}))
+
+        errors = 0
+        if not self.dry_run:
+            for chunk in chunked(updates, MAX_BATCH_SIZE):
+                try:
+                    batch = self.db.batch()
+                    for ref, fields in chunk:
+                        batch.update(ref, fields)
+                    batch.commit()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обновления пакета из {len(chunk)} документов: {e}")
+                    errors += len(chunk)
+
+        with self._lock:
+            self.stats['scanned'] += len(snapshots)
+            self.stats['converted'] += len(updates) - errors
+            self.stats['skipped'] += skipped
+            self.stats['errors'] += errors
+            logger.info(f"⏳ просмотрено {self.stats['scanned']}, сконвертировано {self.stats['converted']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перевод времени сообщений в нативный формат')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--collection', default='messages')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    from google.cloud import firestore
+    db = firestore.Client()
+    stats = TimeBackfill(db, args.collection, workers=args.workers, dry_run=args.dry_run).run()
+    action = 'Будет сконвертировано' if args.dry_run else 'Сконвертировано'
+    print(f"✅ {action}: {stats['converted']} из {stats['scanned']} "
+          f"(без распознанного времени: {stats['skipped']}, ошибок: {stats['errors']})")
+
+
+if __name__ == '__main__':
+    main()
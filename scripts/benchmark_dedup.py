@@ -0,0 +1,177 @@
+"""
+Бенчмарк фильтра дубликатов (autologist.dedup) против запроса на каждое сообщение
+
+Поток сообщений с виртуальным временем: DEDUP_EXPECTED_PER_DAY сообщений в
+сутки, доля повторов внутри окна дедупликации и доля повторов старше окна
+(они снова считаются новыми). Каждое новое сообщение сохраняется в
+Firestore в памяти (messages/{hash}), как это делает парсер.
+
+Сравнение:
+    по запросу     прежний is_duplicate - обращение к хранилищу на каждое сообщение
+    фильтр Блума   обращение только для возможных дубликатов
+
+Отчет: обращений к хранилищу и их доля, наблюдаемая доля ложных
+срабатываний (на hash, которых еще не было) против целевой, память фильтра
+против множества hash и оценка времени ожидания хранилища при --rtt-ms на
+обращение. Результат
+сверяется с точным эталоном: пропущенный дубликат - ошибка. С порогами
+--min-reduction / --max-fp-rate скрипт завершается с кодом 1 при регрессии.
+
+Запуск:
+    python scripts/benchmark_dedup.py
+    python scripts/benchmark_dedup.py --messages 500000 --per-day 100000 --false-positive 0.001
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autologist.dedup import DuplicateFilter, FirestoreMessageLookup
+from autologist.memstore import MemoryFirestore
+
+
+class VirtualClock:
+    def __init__(self, start):
+        self.current = start
+
+    def __call__(self):
+        return self.current
+
+
+def set_size_bytes(hashes):
+    """Память множества hash: таблица множества и сами строки"""
+    return sys.getsizeof(hashes) + sum(sys.getsizeof(value) for value in hashes)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    clock = VirtualClock(datetime(2025, 11, 1, tzinfo=timezone.utc))
+    window = timedelta(hours=args.window_hours)
+    step = timedelta(seconds=86400 / args.per_day)
+
+    db = MemoryFirestore()
+    duplicates = DuplicateFilter(FirestoreMessageLookup(db), window_hours=args.window_hours, clock=clock,
+                                 expected_per_day=args.per_day, error_rate=args.false_positive,
+                                 partitions=args.partitions)
+    saved = {}
+    history = []
+    counts = {'new': 0, 'duplicate': 0, 'stale_repost': 0, 'missed': 0, 'false_duplicate': 0,
+              'bloom_false_positive': 0}
+
+    started = time.perf_counter()
+    for index in range(args.messages):
+        clock.current += step
+        roll = rng.random()
+        if history and roll < args.duplicate_share:
+            message_hash, _ = history[rng.randrange(max(0, len(history) - int(args.per_day * args.window_hours / 24)),
+                                                    len(history))]
+        elif history and roll < args.duplicate_share + args.stale_share and \
+                clock.current - history[0][1] > window:
+            message_hash, _ = rng.choice([item for item in history[:256] if clock.current - item[1] > window])
+        else:
+            message_hash = hashlib.md5(f"{args.seed}:{index}".encode()).hexdigest()
+
+        expected = message_hash in saved and saved[message_hash] >= clock.current - window
+        maybe = duplicates.might_contain(message_hash)
+        actual = maybe and duplicates.confirm(message_hash)
+        if maybe and message_hash not in saved:
+            counts['bloom_false_positive'] += 1
+        if expected and not actual:
+            counts['missed'] += 1
+        elif actual and not expected:
+            counts['false_duplicate'] += 1
+        if expected:
+            counts['duplicate'] += 1
+            continue
+        counts['stale_repost' if message_hash in saved else 'new'] += 1
+        duplicates.add(message_hash)
+        db.collection('messages').document(message_hash).set({'hash': message_hash, 'created_at': clock.current})
+        saved[message_hash] = clock.current
+        history.append((message_hash, clock.current))
+        if len(history) > args.per_day * 3:
+            del history[:args.per_day]
+    elapsed = time.perf_counter() - started
+
+    stats = duplicates.stats
+    backend_lookups = db.rpcs
+    recent = {message_hash for message_hash, saved_at in saved.items() if saved_at >= clock.current - window}
+    return {
+        'messages': args.messages,
+        'simulated_days': round(args.messages / args.per_day, 2),
+        'per_day': args.per_day,
+        'target_false_positive': args.false_positive,
+        'counts': counts,
+        'naive_lookups': args.messages,
+        'bloom_lookups': stats['lookups'],
+        'backend_lookups': backend_lookups,
+        'lookup_reduction': round(1 - backend_lookups / args.messages, 4),
+        'false_positive_rate': round(counts['bloom_false_positive'] / max(counts['new'], 1), 5),
+        'naive_wait_s': round(args.messages * args.rtt_ms / 1000, 1),
+        'bloom_wait_s': round(backend_lookups * args.rtt_ms / 1000, 1),
+        'bloom_memory_kb': round(duplicates.bloom.memory_bytes() / 1024, 1),
+        'exact_set_memory_kb': round(set_size_bytes(recent) / 1024, 1),
+        'filter_ops_per_s': round(args.messages / elapsed),
+        'elapsed_s': round(elapsed, 2)
+    }
+
+
+def print_report(report):
+    counts = report['counts']
+    print(f"📨 {report['messages']} сообщений ({report['simulated_days']} сут. по {report['per_day']}): новых "
+          f"{counts['new']}, дубликатов {counts['duplicate']}, повторов старше окна {counts['stale_repost']}")
+    print(f"🔎 Обращений к хранилищу: по запросу {report['naive_lookups']}, с фильтром {report['backend_lookups']} "
+          f"(проверок возможных дубликатов {report['bloom_lookups']}), меньше на {report['lookup_reduction']:.1%}")
+    print(f"🎯 Ложные срабатывания фильтра: {report['false_positive_rate']:.3%} "
+          f"(цель {report['target_false_positive']:.3%})")
+    print(f"⏱️  Ожидание хранилища: {report['naive_wait_s']} с -> {report['bloom_wait_s']} с")
+    print(f"🧠 Память: фильтр {report['bloom_memory_kb']} КБ, множество hash за окно {report['exact_set_memory_kb']} КБ; "
+          f"{report['filter_ops_per_s']} проверок/с")
+    print(f"✔️  Сверка с эталоном: пропущено дубликатов {counts['missed']}, лишних {counts['false_duplicate']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк фильтра дубликатов')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--per-day', type=int, default=50000, help='ожидаемое число сообщений в сутки')
+    parser.add_argument('--duplicate-share', type=float, default=0.1, help='доля повторов внутри окна')
+    parser.add_argument('--stale-share', type=float, default=0.02, help='доля повторов старше окна')
+    parser.add_argument('--window-hours', type=float, default=24)
+    parser.add_argument('--false-positive', type=float, default=0.01, help='целевая доля ложных срабатываний')
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--rtt-ms', type=float, default=30, help='время обращения к хранилищу для оценки')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--min-reduction', type=float, default=0.8, help='минимальная доля сэкономленных обращений')
+    parser.add_argument('--max-fp-rate', type=float, help='максимум ложных срабатываний (по умолчанию 2x цели)')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if report['counts']['missed'] or report['counts']['false_duplicate']:
+        failures.append(f"расхождение с эталоном: {report['counts']['missed']} пропущено, "
+                        f"{report['counts']['false_duplicate']} лишних")
+    if report['lookup_reduction'] < args.min_reduction:
+        failures.append(f"сэкономлено {report['lookup_reduction']:.1%} < {args.min_reduction:.0%} обращений")
+    max_fp_rate = args.max_fp_rate if args.max_fp_rate is not None else args.false_positive * 2
+    if report['false_positive_rate'] > max_fp_rate:
+        failures.append(f"ложных срабатываний {report['false_positive_rate']:.3%} > {max_fp_rate:.3%}")
+    if failures:
+        print("❌ Регрессия: " + '; '.join(failures))
+        sys.exit(1)
+    print("✅ Бенчмарк пройден")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Нагрузочный бенчмарк парсера без Telegram
+
+Генератор создает поток событий, похожих на события Telethon: набор чатов
+и отправителей, объявления о грузах (тексты из data/messages и шаблоны по
+справочнику городов), обычную переписку и повторные публикации (тот же
+текст в том же чате - дубликат, в другом чате - новое сообщение). События
+подаются в TelegramParser.process_message; запись идет через спул в
+Firestore в памяти (autologist.memstore).
+
+Отчет: сообщений в секунду, p50/p99 задержки на сообщение, время этапов
+по метрикам парсера и рост памяти по ходу прогона. С порогами
+--min-rate / --max-p99-ms скрипт завершается с кодом 1 при регрессии.
+
+Запуск:
+    python scripts/benchmark_parser.py                          # 5000 сообщений с максимальной скоростью
+    python scripts/benchmark_parser.py --messages 20000 --rate 500
+    python scripts/benchmark_parser.py --min-rate 300 --max-p99-ms 20 --json bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'parsers'))
+
+from autologist.replay import FakeChat, FakeClient, FakeEvent, FakeMessage, FakeSender
+
+DEFAULT_KEYWORDS = ["груз", "перевозка", "доставка", "транспорт", "тонн", "маршрут", "погрузка", "выгрузка", "фрахт"]
+
+CARGO_TYPES = ['тент', 'реф', 'изотерм', 'трал', 'контейнер', 'мебель', 'стройматериалы', 'продукты', 'металл']
+
+CHATTER = [
+    "Доброе утро всем!",
+    "Кто знает, открыта ли граница сегодня?",
+    "Спасибо, вопрос решен",
+    "Админ, удалите спам пожалуйста",
+    "Какая погода на трассе М-36?",
+    "Продам шины 315/80 R22.5, состояние отличное",
+    "Ищу работу водителем, стаж {n} лет",
+    "Сколько сейчас стоит солярка?",
+    "+",
+    "Созвонимся после обеда",
+]
+
+CARGO_TEMPLATES = [
+    "{origin} - {destination}\n{cargo} {weight} т\n{price} $\n{phone}",
+    "Груз {origin} → {destination}, {weight} тонн, {cargo}. Ставка {price} тг. Тел {phone}",
+    "Нужна фура {origin} {destination} {weight}т {cargo}, погрузка завтра, {phone}",
+    "🚛 {origin} - {destination}\n{weight} тонн / {volume} м3\n{cargo}\nцена договорная\n{phone}",
+]
+
+
+def sample_texts():
+    """Настоящие объявления из data/messages (если есть)"""
+    from autologist.local_store import LOCAL_MESSAGES_DIR, iter_local_messages
+
+    if not os.path.isdir(LOCAL_MESSAGES_DIR):
+        return []
+    return [message['text'] for _, message in iter_local_messages(LOCAL_MESSAGES_DIR) if message.get('text')]
+
+
+class LoadGenerator:
+    """Детерминированный (по seed) поток событий со смесью грузов, переписки и повторов"""
+
+    def __init__(self, chats=50, senders=500, cargo_share=0.6, repost_share=0.15, seed=1):
+        from autologist.gazetteer import PLACES
+
+        self.random = random.Random(seed)
+        self.cities = [row[1] for row in PLACES if not row[0].startswith('country_')]
+        self.samples = sample_texts()
+        self.chats = [FakeChat(1000000000 + i * 7919, f"Грузоперевозки #{i}") for i in range(chats)]
+        self.senders = [FakeSender(500000 + i, f"user{i}", f"Имя{i}", f"Фамилия{i}") for i in range(senders)]
+        self.cargo_share = cargo_share
+        self.repost_share = repost_share
+        self.posted = []
+        self.message_id = 0
+
+    def monitored_chats(self):
+        """Настройки чатов: половина с поиском по основам, половина - по подстроке"""
+        return [{'chat_id': str(-1000000000000 - chat.id), 'title': chat.title, 'keywords': DEFAULT_KEYWORDS,
+                 'match_mode': 'stem' if i % 2 else 'substring', 'enabled': True}
+                for i, chat in enumerate(self.chats)]
+
+    def phone(self):
+        return f"+7 70{self.random.randint(0, 9)} {self.random.randint(100, 999)} {self.random.randint(1000, 9999)}"
+
+    def cargo_text(self):
+        if self.samples and self.random.random() < 0.5:
+            return self.random.choice(self.samples)
+        origin, destination = self.random.sample(self.cities, 2)
+        return self.random.choice(CARGO_TEMPLATES).format(
+            origin=origin, destination=destination, cargo=self.random.choice(CARGO_TYPES),
+            weight=self.random.randint(1, 25), volume=self.random.choice([82, 86, 90, 120]),
+            price=self.random.randrange(300, 5000, 50), phone=self.phone())
+
+    def event(self):
+        self.message_id += 1
+        roll = self.random.random()
+        if self.posted and roll < self.repost_share:
+            chat, sender, text = self.random.choice(self.posted)
+            # Половина повторов - в другой чат (новое сообщение), половина - дубликат в том же чате
+            if self.random.random() < 0.5:
+                chat = self.random.choice(self.chats)
+        else:
+            chat = self.random.choice(self.chats)
+            sender = self.random.choice(self.senders)
+            if roll < self.repost_share + self.cargo_share:
+                text = self.cargo_text()
+                self.posted.append((chat, sender, text))
+            else:
+                text = self.random.choice(CHATTER).format(n=self.random.randint(1, 30))
+        date = datetime.now(timezone.utc) - timedelta(seconds=self.random.uniform(0, 5))
+        return FakeEvent(chat, FakeMessage(self.message_id, text, date, sender))
+
+
+def memory_mb():
+    """Текущий RSS процесса (МБ); без /proc - пиковый RSS"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, quantile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))] if ordered else 0.0
+
+
+async def run(args):
+    from autologist.memstore import MemoryFirestore
+    from autologist.metrics import REGISTRY
+    import telegram_parser_v2
+
+    generator = LoadGenerator(args.chats, args.senders, args.cargo_share, args.repost_share, args.seed)
+    db = MemoryFirestore()
+    parser = telegram_parser_v2.TelegramParser(client=FakeClient(), db=db,
+                                               monitored_chats=generator.monitored_chats())
+    background = [asyncio.ensure_future(parser.flush_rollups_periodically()),
+                  asyncio.ensure_future(parser.drain_spool_periodically())]
+
+    latencies = []
+    memory = [(0, memory_mb(), 0)]
+    started = time.perf_counter()
+    for i in range(args.messages):
+        if args.rate:
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        event = generator.event()
+        begin = time.perf_counter()
+        await parser.process_message(event)
+        latencies.append(time.perf_counter() - begin)
+        if (i + 1) % args.sample_every == 0:
+            memory.append((i + 1, memory_mb(), len(parser.duplicates)))
+            # Отдаем управление фоновым задачам сброса и отправки спула
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    for task in background:
+        task.cancel()
+    flush_started = time.perf_counter()
+    parser.rollups.flush()
+    parser.contacts.flush()
+    parser.routes.flush()
+    parser.chat_stats.flush()
+    parser.spool_drainer.drain()
+    flush_seconds = time.perf_counter() - flush_started
+
+    stages = REGISTRY.snapshot().get('autologist_parser_stage_seconds', {})
+    return {
+        'messages': args.messages,
+        'elapsed_s': round(elapsed, 3),
+        'messages_per_s': round(args.messages / elapsed, 1),
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'latency_max_ms': round(max(latencies) * 1000, 3),
+        'saved': parser.stats['messages_saved'],
+        'errors': parser.stats['errors'],
+        'stored_messages': db.count('messages'),
+        'final_flush_s': round(flush_seconds, 3),
+        'stages': stages,
+        'memory': [{'messages': count, 'rss_mb': round(rss, 1), 'dedup_cache': cache} for count, rss, cache in memory],
+        'memory_growth_mb_per_10k': round((memory[-1][1] - memory[0][1]) / max(args.messages, 1) * 10000, 2)
+    }
+
+
+def print_report(report):
+    print(f"📊 {report['messages']} сообщений за {report['elapsed_s']} с: {report['messages_per_s']} сообщ./с")
+    print(f"⏱️  Задержка: p50 {report['latency_p50_ms']} мс, p99 {report['latency_p99_ms']} мс, "
+          f"max {report['latency_max_ms']} мс")
+    print(f"💾 Сохранено {report['saved']}, в хранилище {report['stored_messages']}, ошибок {report['errors']}, "
+          f"финальный сброс {report['final_flush_s']} с")
+    print("🔬 Этапы (среднее / p95, мс):")
+    for stage, summary in sorted(report['stages'].items(), key=lambda item: -item[1].get('total_s', 0)):
+        print(f"   {stage:<14} {summary['count']:>8}  {summary['mean_ms']:>8.3f} / {summary['p95_ms']:>8.3f}"
+              f"  всего {summary['total_s']} с")
+    print("🧠 Память:")
+    for point in report['memory']:
+        print(f"   {point['messages']:>8} сообщ.  RSS {point['rss_mb']:>7.1f} МБ  кэш дедупликации {point['dedup_cache']}")
+    print(f"   Рост: {report['memory_growth_mb_per_10k']} МБ на 10 тыс. сообщений")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк Telegram парсера')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0, help='сообщений в секунду (0 - максимально быстро)')
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--senders', type=int, default=500)
+    parser.add_argument('--cargo-share', type=float, default=0.6, help='доля объявлений о грузах')
+    parser.add_argument('--repost-share', type=float, default=0.15, help='доля повторных публикаций')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sample-every', type=int, default=1000, help='шаг замера памяти (сообщений)')
+    parser.add_argument('--no-fsync', action='store_true', help='спул без fsync на каждое сообщение')
+    parser.add_argument('--min-rate', type=float, help='минимум сообщений в секунду')
+    parser.add_argument('--max-p99-ms', type=float, help='максимум p99 задержки, мс')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args()
+
+    # Окружение парсера задается до импорта: спул во временной папке, без шума в логе
+    workdir = tempfile.mkdtemp(prefix='autologist_bench_')
+    os.environ['SPOOL_DIR'] = os.path.join(workdir, 'spool')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.no_fsync:
+        os.environ['SPOOL_FSYNC'] = 'false'
+    os.environ.pop('PARSER_WORKER_ID', None)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.min_rate and report['messages_per_s'] < args.min_rate:
+        failures.append(f"скорость {report['messages_per_s']} < {args.min_rate} сообщ./с")
+    if args.max_p99_ms and report['latency_p99_ms'] > args.max_p99_ms:
+        failures.append(f"p99 {report['latency_p99_ms']} > {args.max_p99_ms} мс")
+    if report['errors']:
+        failures.append(f"ошибок обработки: {report['errors']}")
+    if failures:
+        print("❌ Регрессия: " + '; '.join(failures))
+        sys.exit(1)
+    print("✅ Бенчмарк пройден")
+
+
+if __name__ == '__main__':
+    main()
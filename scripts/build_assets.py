@@ -0,0 +1,43 @@
+"""
+Сборка статики веб-интерфейса в frontend/dist
+
+Встроенные стили и скрипты страниц выносятся в файлы с хешем содержимого
+в имени, все файлы заранее сжимаются (gzip, brotli - если установлен пакет
+brotli). app.py отдает собранные файлы с долгим кэшем, а страницы - с
+проверкой по ETag. Запускайте перед деплоем (npm run vercel-build делает это сам).
+
+Запуск:
+    python scripts/build_assets.py
+    python scripts/build_assets.py --output /tmp/dist
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from autologist.assets import ASSETS_DIR, FRONTEND_DIR, AssetBuilder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка статики веб-интерфейса')
+    parser.add_argument('--source', default=os.path.join(ROOT, FRONTEND_DIR))
+    parser.add_argument('--output', default=os.path.join(ROOT, ASSETS_DIR))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    manifest = AssetBuilder(args.source, args.output).build()
+    for name, info in sorted(manifest['files'].items()):
+        size = os.path.getsize(os.path.join(args.output, name))
+        compressed = ', '.join(f"{encoding} {os.path.getsize(os.path.join(args.output, name + ('.br' if encoding == 'br' else '.gz')))} Б"
+                               for encoding in info['encodings'])
+        print(f"   {name}: {size} Б{' (' + compressed + ')' if compressed else ''}")
+    print(f"✅ Статика собрана в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
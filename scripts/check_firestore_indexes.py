@@ -0,0 +1,132 @@
+"""
+Проверка индексов Firestore для запросов API
+
+1. Для всех комбинаций фильтров из autologist.queries и поиска маршрутов
+   (autologist.routes) проверяет, что нужные составные индексы объявлены
+   в firestore.indexes.json.
+2. Если задан FIRESTORE_EMULATOR_HOST, создает тестовые сообщения в эмуляторе
+   и выполняет каждый запрос, сверяя результат с ожидаемым.
+   Эмулятор не требует составных индексов, поэтому пропущенный индекс
+   ловит шаг 1.
+3. С флагом --live выполняет те же запросы (limit 1) в реальном проекте:
+   Firestore отвечает FailedPrecondition, если индекс не создан.
+
+Запуск:
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python scripts/check_firestore_indexes.py
+
+Код возврата 1 - есть проблемы.
+"""
+
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autologist.queries import MessageQuery, access_patterns, all_plans, missing_indexes
+from autologist.routes import route_access_patterns
+from autologist.timebuckets import time_buckets
+
+TEST_COLLECTION = 'messages_index_check'
+
+
+def check_declared():
+    """Шаг 1: все планы покрыты объявленными индексами"""
+    plans = all_plans() + [plan for query in route_access_patterns() for plan in query.plans()]
+    missing = missing_indexes(plans)
+    for index in missing:
+        fields = ', '.join(f"{f['fieldPath']} {f.get('order') or f.get('arrayConfig')}" for f in index['fields'])
+        print(f"❌ Не объявлен индекс {index['collectionGroup']}: {fields}")
+    if not missing:
+        print(f"✅ Все {len(plans)} планов запросов покрыты firestore.indexes.json")
+    return not missing
+
+
+def seed(db):
+    """Тестовые сообщения: 3 чата по 4 сообщения с шагом в час"""
+    now = datetime.now(timezone.utc)
+    batch = db.batch()
+    messages = []
+    for chat in range(3):
+        for hour in range(4):
+            message = {
+                'chat_id': str(chat),
+                'hash': f'h{chat}_{hour}',
+                'timestamp': now - timedelta(hours=hour),
+                'text': f'груз {chat} {hour}'
+            }
+            message.update(time_buckets(message['timestamp']))
+            messages.append(message)
+            batch.set(db.collection(TEST_COLLECTION).document(message['hash']), message)
+    batch.commit()
+    return now, messages
+
+
+def check_emulator(db):
+    """Шаг 2: запросы выполняются и возвращают ожидаемые документы"""
+    now, messages = seed(db)
+    since = now - timedelta(hours=2, minutes=30)
+    cases = [
+        (MessageQuery(limit=100), messages),
+        (MessageQuery(chat_ids=['1'], limit=100), [m for m in messages if m['chat_id'] == '1']),
+        (MessageQuery(chat_ids=['0', '2'], since=since, limit=100),
+         [m for m in messages if m['chat_id'] in ('0', '2') and m['timestamp'] >= since]),
+        (MessageQuery(message_hash='h2_1', since=since, limit=1), [m for m in messages if m['hash'] == 'h2_1']),
+        (MessageQuery(chat_ids=['1'], day=messages[0]['day'], limit=100),
+         [m for m in messages if m['chat_id'] == '1' and m['day'] == messages[0]['day']]),
+    ]
+    ok = True
+    for query, expected in cases:
+        query.collection = TEST_COLLECTION
+        got = sorted(m['hash'] for m in query.fetch(db))
+        want = sorted(m['hash'] for m in expected)
+        if got != want:
+            print(f"❌ {query.plans()[0]}: ожидалось {want}, получено {got}")
+            ok = False
+        if query.count(db) != len(want) and not query.message_hash:
+            print(f"❌ count() для {query.plans()[0]} не совпал с выборкой")
+            ok = False
+    for doc in db.collection(TEST_COLLECTION).stream():
+        doc.reference.delete()
+    if ok:
+        print(f"✅ Эмулятор: {len(cases)} запросов вернули ожидаемые документы")
+    return ok
+
+
+def check_live(db):
+    """Шаг 3: запросы в реальном проекте не требуют несозданных индексов"""
+    ok = True
+    since = datetime.now(timezone.utc) - timedelta(days=1)
+    for query in access_patterns():
+        query.limit = 1
+        query.since = since if query.since else None
+        query.until = since + timedelta(days=1) if query.until else None
+        try:
+            query.fetch(db)
+        except Exception as e:
+            print(f"❌ {query.plans()[0]}: {e}")
+            ok = False
+    if ok:
+        print('✅ Все запросы выполняются в проекте')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка индексов Firestore')
+    parser.add_argument('--live', action='store_true', help='проверить запросы в реальном проекте')
+    args = parser.parse_args()
+
+    ok = check_declared()
+    if os.getenv('FIRESTORE_EMULATOR_HOST') or args.live:
+        from google.cloud import firestore
+        db = firestore.Client(project=os.getenv('FIREBASE_PROJECT_ID', 'autologist-91ecf'))
+        ok = (check_live(db) if args.live else check_emulator(db)) and ok
+    else:
+        print('ℹ️  FIRESTORE_EMULATOR_HOST не задан, проверка в эмуляторе пропущена')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
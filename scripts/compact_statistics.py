@@ -0,0 +1,56 @@
+"""
+Сжатие дневной статистики в недельные и месячные документы
+
+Пересобирает statistics/week_* и statistics/month_* из дневных документов
+(операция идемпотентна) и при необходимости удаляет старые дневные документы.
+Запускайте раз в сутки, например из cron:
+    15 0 * * *  cd /path/to/Autologist && python scripts/compact_statistics.py
+
+    --weeks N       сколько последних недель пересобрать (по умолчанию 2)
+    --months N      сколько последних месяцев пересобрать (по умолчанию 2)
+    --keep-days N   удалить дневные документы старше N дней (по умолчанию не удалять)
+    --local         работать с data/statistics.json вместо Firestore
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autologist.rollups import (FirestoreRollupStore, LocalRollupStore, bucket_doc_id, compact,
+                                previous_buckets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сжатие статистики грузов')
+    parser.add_argument('--weeks', type=int, default=2)
+    parser.add_argument('--months', type=int, default=2)
+    parser.add_argument('--keep-days', type=int)
+    parser.add_argument('--local', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.local:
+        store = LocalRollupStore()
+    else:
+        from google.cloud import firestore
+        store = FirestoreRollupStore(firestore.Client())
+
+    for period, count in (('week', args.weeks), ('month', args.months)):
+        for bucket in previous_buckets(period, count):
+            doc = compact(store, period, bucket)
+            print(f"✅ {bucket_doc_id(period, bucket)}: сообщений {doc.get('messages', 0)}, "
+                  f"заявок {doc.get('cargos', 0)}")
+
+    if args.keep_days:
+        # Дневные документы за 62 дня до границы хранения - этого достаточно при ежедневном запуске
+        stale = previous_buckets('day', args.keep_days + 62)[:62]
+        store.delete([bucket_doc_id('day', day) for day in stale])
+        print(f"🧹 Удалены дневные документы с {stale[0]} по {stale[-1]}")
+
+
+if __name__ == '__main__':
+    main()
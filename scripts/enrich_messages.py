@@ -0,0 +1,180 @@
+"""
+Пакетная дообработка сообщений через ИИ
+
+Берет необработанные сообщения (processed == False), дополняет заявки,
+которые правила разобрали не полностью, и записывает результат обратно
+в сообщение (cargos, processed = True), а полные заявки - в processed_cargos.
+Запросы к модели идут пачками, ответы кэшируются по тексту.
+
+Если запрос к модели не удался, сообщение остается processed = False и
+получает enrichment_attempts + 1: следующая порция повторит его. После
+ENRICHMENT_MAX_ATTEMPTS неудач сообщение помечается processed = True с
+enrichment_failed = True и заявками правил. При ошибках цикл --loop ждет
+BATCH_PROCESSING_INTERVAL, а не повторяет порцию сразу.
+
+Запуск:
+    python scripts/enrich_messages.py                   # одна порция MAX_MESSAGES_PER_BATCH
+    python scripts/enrich_messages.py --loop            # каждые BATCH_PROCESSING_INTERVAL секунд
+    python scripts/enrich_messages.py --local --backend stub --dry-run
+
+    --backend gemini|stub   бэкенд модели (по умолчанию ENRICHMENT_BACKEND или gemini)
+    --local                 data/messages вместо Firestore
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from autologist.enrichment import (ENRICHMENT_MAX_ATTEMPTS, Enricher, FirestoreEnrichmentCache, GeminiBackend,
+                                   LocalEnrichmentCache, StubBackend)
+from autologist.extraction import extract_cargos, is_complete
+from autologist.local_store import LOCAL_MESSAGES_DIR, iter_local_messages
+from autologist.migration import MAX_BATCH_SIZE, chunked
+from autologist.normalize import normalize_text
+from autologist.timebuckets import json_default
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ['text', 'cargos', 'hash', 'chat_id', 'timestamp', 'enrichment_attempts']
+
+
+def rule_cargos(message):
+    """Заявки правил: сохраненные парсером или извлеченные заново для старых сообщений"""
+    if 'cargos' in message:
+        return message['cargos']
+    return extract_cargos(normalize_text(message.get('text') or '').clean)
+
+
+def processed_cargo_docs(message, cargos):
+    """Документы processed_cargos для полностью разобранных заявок"""
+    docs = {}
+    for number, cargo in enumerate(cargos):
+        if not is_complete(cargo):
+            continue
+        doc = dict(cargo, original_message_id=message.get('hash'), chat_id=message.get('chat_id'),
+                   timestamp=message.get('timestamp'), status='новый')
+        doc.pop('missing', None)
+        docs[f"{message.get('hash')}:{number}"] = doc
+    return docs
+
+
+def failed_update(message):
+    """Поля сообщения после неудачного запроса к модели: повтор или отказ после ENRICHMENT_MAX_ATTEMPTS"""
+    attempts = (message.get('enrichment_attempts') or 0) + 1
+    if attempts >= ENRICHMENT_MAX_ATTEMPTS:
+        return {'enrichment_attempts': attempts, 'enrichment_failed': True}
+    return {'enrichment_attempts': attempts, 'processed': False}
+
+
+def enrich_firestore(db, enricher, limit, dry_run):
+    """Одна порция необработанных сообщений Firestore; возвращает (обработано, отложено после ошибки)"""
+    from google.cloud.firestore import SERVER_TIMESTAMP
+
+    snapshots = list(db.collection('messages').where('processed', '==', False)
+                     .select(FIELDS).limit(limit).stream())
+    if not snapshots:
+        return 0, 0
+    messages = {snapshot.id: snapshot.to_dict() for snapshot in snapshots}
+    results, failed = enricher.enrich([(doc_id, message.get('text'), rule_cargos(message))
+                                       for doc_id, message in messages.items()])
+    if dry_run:
+        return len(snapshots) - len(failed), len(failed)
+
+    writes = []
+    retried = 0
+    for snapshot in snapshots:
+        cargos = results[snapshot.id]
+        update = {'cargos': cargos, 'processed': True, 'enriched_at': SERVER_TIMESTAMP}
+        if snapshot.id in failed:
+            retry = failed_update(messages[snapshot.id])
+            if not retry.get('enrichment_failed'):
+                # Повтор в следующей порции: меняется только счетчик попыток
+                retried += 1
+                writes.append(('update', snapshot.reference, retry))
+                continue
+            update.update(retry)
+        writes.append(('update', snapshot.reference, update))
+        for cargo_id, doc in processed_cargo_docs(messages[snapshot.id], cargos).items():
+            writes.append(('set', db.collection('processed_cargos').document(cargo_id), doc))
+    for chunk in chunked(writes, MAX_BATCH_SIZE):
+        batch = db.batch()
+        for op, ref, data in chunk:
+            batch.update(ref, data) if op == 'update' else batch.set(ref, data)
+        batch.commit()
+    return len(snapshots) - retried, retried
+
+
+def enrich_local(enricher, limit, dry_run):
+    """Одна порция необработанных локальных сообщений"""
+    messages = {}
+    for filename, message in iter_local_messages(LOCAL_MESSAGES_DIR):
+        if not message.get('processed'):
+            messages[filename] = message
+        if len(messages) >= limit:
+            break
+    if not messages:
+        return 0, 0
+    results, failed = enricher.enrich([(filename, message.get('text'), rule_cargos(message))
+                                       for filename, message in messages.items()])
+    if dry_run:
+        return len(messages) - len(failed), len(failed)
+    retried = 0
+    for filename, message in messages.items():
+        message.update(cargos=results[filename], processed=True)
+        if filename in failed:
+            message.update(failed_update(message))
+            retried += 0 if message.get('enrichment_failed') else 1
+        with open(os.path.join(LOCAL_MESSAGES_DIR, filename), 'w', encoding='utf-8') as f:
+            json.dump(message, f, ensure_ascii=False, indent=2, default=json_default)
+    return len(messages) - retried, retried
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Дообработка заявок через ИИ')
+    parser.add_argument('--backend', choices=['gemini', 'stub'], default=os.getenv('ENRICHMENT_BACKEND', 'gemini'))
+    parser.add_argument('--limit', type=int, default=int(os.getenv('MAX_MESSAGES_PER_BATCH', '200')))
+    parser.add_argument('--loop', action='store_true', help='повторять каждые BATCH_PROCESSING_INTERVAL секунд')
+    parser.add_argument('--local', action='store_true')
+    parser.add_argument('--dry-run', action='store_true', help='не записывать результат')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    backend = StubBackend() if args.backend == 'stub' else GeminiBackend()
+    if args.local:
+        enricher = Enricher(backend, LocalEnrichmentCache())
+        run_batch = lambda: enrich_local(enricher, args.limit, args.dry_run)
+    else:
+        from google.cloud import firestore
+        db = firestore.Client()
+        enricher = Enricher(backend, FirestoreEnrichmentCache(db))
+        run_batch = lambda: enrich_firestore(db, enricher, args.limit, args.dry_run)
+
+    interval = int(os.getenv('BATCH_PROCESSING_INTERVAL', '3600'))
+    while True:
+        processed, retried = run_batch()
+        stats = enricher.stats
+        print(f"✅ Обработано {processed} сообщений: разобраны правилами {stats['rules_complete']}, "
+              f"из кэша {stats['cache_hits']}, отправлено в ИИ {stats['llm_messages']} "
+              f"за {stats['llm_calls']} запросов, ошибок {stats['failed']}")
+        if retried:
+            print(f"⚠️  {retried} сообщений отложено: запрос к ИИ не удался, повтор в следующей порции")
+        # В разовом режиме и в dry-run (сообщения не помечаются) - одна порция
+        if not args.loop or args.dry_run:
+            break
+        # Полная порция без ошибок - сразу следующая; при ошибках модели - пауза
+        if processed + retried >= args.limit and not retried:
+            continue
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    main()
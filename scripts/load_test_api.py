@@ -0,0 +1,211 @@
+"""
+Нагрузочный тест API под одновременными клиентами дашборда
+
+Каждый клиент повторяет то, что делает открытая страница дашборда: опрос
+/api/status, статистики, последних сообщений и списка чатов, с короткой
+паузой между обходами. По умолчанию API запускается в этом же процессе
+(многопоточный werkzeug, как в разработке) поверх Firestore в памяти с
+задержкой --latency-ms на каждое обращение, чтобы время ответа было похоже
+на настоящее. С --url нагрузка идет на уже запущенный сервер.
+
+Отчет: запросов в секунду, p50/p99 по маршрутам, коды ответов, а для
+сервера в процессе - сколько вызовов реально ушло в хранилище и сколько
+запросов получили общий результат (singleflight). --no-coalesce отключает
+объединение запросов для сравнения. С порогами --min-rps / --max-p99-ms
+скрипт завершается с кодом 1 при регрессии.
+
+Запуск:
+    python scripts/load_test_api.py                              # 100 клиентов, 20 с
+    python scripts/load_test_api.py --clients 100 --duration 30 --latency-ms 80
+    python scripts/load_test_api.py --no-coalesce
+    python scripts/load_test_api.py --url http://localhost:8080 --min-rps 200 --max-p99-ms 500
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Что запрашивает одна открытая страница дашборда за один обход
+DASHBOARD_REQUESTS = (
+    '/api/status',
+    '/api/statistics?period=day&limit=14',
+    '/api/statistics?period=week&limit=1',
+    '/api/messages/recent',
+    '/api/chats/monitored',
+)
+
+
+def percentile(values, quantile):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+def seed(db, messages, chats):
+    """Сообщения, чаты и пульс парсера в Firestore в памяти"""
+    from autologist.timebuckets import time_buckets
+
+    now = datetime.now(timezone.utc)
+    for index in range(chats):
+        db.collection('monitored_chats').document(str(-1000 - index)).set({
+            'chat_id': str(-1000 - index), 'title': f'Грузы {index}', 'enabled': index % 5 != 0,
+            'keywords': ['груз', 'перевозка'], 'match_mode': 'stem'})
+    for index in range(messages):
+        timestamp = now - timedelta(minutes=index * 7)
+        db.collection('messages').document(f'hash{index}').set(dict(
+            time_buckets(timestamp), hash=f'hash{index}', chat_id=str(-1000 - index % chats),
+            message_id=index, text=f'Груз {index} т, Алматы - Астана', timestamp=timestamp))
+    db.collection('parser_heartbeats').document('worker-1').set({
+        'worker_id': 'worker-1', 'updated_at': now, 'messages_total': messages, 'errors': 0})
+
+
+def start_local_server(args):
+    """API в этом процессе поверх Firestore в памяти; возвращает (url, модуль app, хранилище)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from autologist.memstore import MemoryFirestore
+    import app as api
+
+    db = MemoryFirestore(latency=args.latency_ms / 1000)
+    seed(db, args.messages, args.chats)
+    api._firestore_client = db
+    api.backend.coalesce = not args.no_coalesce
+    api.app.logger.disabled = True
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, api.app, threaded=True, request_handler=QuietHandler)
+    server.request_queue_size = max(128, args.clients * 2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', api, db
+
+
+def dashboard_client(url, deadline, think_seconds, results, lock, rng):
+    """Один клиент: обходы дашборда до deadline"""
+    local = []
+    while time.perf_counter() < deadline:
+        for path in DASHBOARD_REQUESTS:
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url + path, timeout=60) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception:
+                status = 'error'
+            local.append((path.split('?')[0], status, time.perf_counter() - started))
+        time.sleep(think_seconds * rng.uniform(0.5, 1.5))
+    with lock:
+        results.extend(local)
+
+
+def run(args):
+    api = db = None
+    url = args.url.rstrip('/') if args.url else None
+    if url is None:
+        url, api, db = start_local_server(args)
+
+    results = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=dashboard_client,
+                                args=(url, deadline, args.think_ms / 1000, results, lock, random.Random(index)))
+               for index in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    statuses = {}
+    for route, status, seconds in results:
+        routes.setdefault(route, []).append(seconds)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = [seconds for _, _, seconds in results]
+    report = {
+        'url': args.url or 'in-process',
+        'clients': args.clients,
+        'elapsed_s': round(elapsed, 2),
+        'requests': len(results),
+        'requests_per_s': round(len(results) / elapsed, 1),
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'statuses': statuses,
+        'routes': {route: {'count': len(values),
+                           'p50_ms': round(percentile(values, 0.5) * 1000, 1),
+                           'p99_ms': round(percentile(values, 0.99) * 1000, 1)}
+                   for route, values in sorted(routes.items())},
+    }
+    if api is not None:
+        report['backend'] = dict(api.backend.stats, coalescing=api.backend.coalesce,
+                                 storage_rpcs=db.rpcs, latency_ms=args.latency_ms)
+    return report
+
+
+def print_report(report):
+    print(f"🌐 {report['clients']} клиентов дашборда, {report['url']}, {report['elapsed_s']} с")
+    print(f"📊 {report['requests']} запросов: {report['requests_per_s']} запр./с, "
+          f"p50 {report['latency_p50_ms']} мс, p99 {report['latency_p99_ms']} мс")
+    print(f"   Коды ответов: {report['statuses']}")
+    for route, summary in report['routes'].items():
+        print(f"   {route:<24} {summary['count']:>7}  p50 {summary['p50_ms']:>8} мс  p99 {summary['p99_ms']:>8} мс")
+    backend = report.get('backend')
+    if backend:
+        print(f"🧵 Пул: вызовов {backend['calls']}, объединено {backend['coalesced']} "
+              f"(singleflight {'вкл' if backend['coalescing'] else 'выкл'}), таймаутов {backend['timeouts']}, "
+              f"отказов {backend['rejected']}; обращений к хранилищу {backend['storage_rpcs']} "
+              f"по {backend['latency_ms']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест API дашборда')
+    parser.add_argument('--url', help='адрес запущенного сервера (по умолчанию - сервер в этом процессе)')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=20, help='секунд')
+    parser.add_argument('--think-ms', type=float, default=500, help='пауза клиента между обходами дашборда')
+    parser.add_argument('--latency-ms', type=float, default=50, help='задержка обращения к Firestore в памяти')
+    parser.add_argument('--messages', type=int, default=2000, help='сообщений в Firestore в памяти')
+    parser.add_argument('--chats', type=int, default=40, help='чатов в Firestore в памяти')
+    parser.add_argument('--no-coalesce', action='store_true', help='без объединения одинаковых запросов')
+    parser.add_argument('--min-rps', type=float, help='минимум запросов в секунду')
+    parser.add_argument('--max-p99-ms', type=float, help='максимум p99 задержки, мс')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.min_rps and report['requests_per_s'] < args.min_rps:
+        failures.append(f"{report['requests_per_s']} < {args.min_rps} запр./с")
+    if args.max_p99_ms and report['latency_p99_ms'] > args.max_p99_ms:
+        failures.append(f"p99 {report['latency_p99_ms']} > {args.max_p99_ms} мс")
+    errors = sum(count for status, count in report['statuses'].items() if status != '200')
+    if errors:
+        failures.append(f"ответов с ошибкой: {errors}")
+    if failures:
+        print("❌ Регрессия: " + '; '.join(failures))
+        sys.exit(1)
+    print("✅ Нагрузочный тест пройден")
+
+
+if __name__ == '__main__':
+    main()
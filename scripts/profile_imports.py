@@ -0,0 +1,121 @@
+"""
+Время импорта app.py и парсера на холодном старте
+
+Каждый замер - отдельный процесс python -X importtime: модуль импортируется
+с нуля, как при холодном старте на Vercel. Отчет: полное время импорта
+модуля (медиана по --runs запускам) и самые тяжелые зависимости. Модули,
+которые загружает сам интерпретатор (site, .pth файлы), не учитываются.
+
+Проверка бюджета: скрипт завершается с кодом 1, если время импорта больше
+бюджета или при импорте загрузилась тяжелая зависимость, которая должна
+подключаться только при первом использовании (google.cloud.firestore,
+telethon, firebase_admin).
+
+Запуск:
+    python scripts/profile_imports.py                    # отчет и проверка бюджетов по умолчанию
+    python scripts/profile_imports.py --top 30 --runs 7
+    python scripts/profile_imports.py --budget app=300 --budget telegram_parser_v2=150
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модуль -> (папка для sys.path, бюджет импорта в мс)
+TARGETS = {
+    'app': (ROOT, 400),
+    'telegram_parser_v2': (os.path.join(ROOT, 'parsers'), 250),
+}
+
+# Зависимости, которые при импорте загружаться не должны
+LAZY_MODULES = ('google.cloud.firestore', 'telethon', 'firebase_admin')
+
+
+def importtime(code, path):
+    """{модуль: (собственное время, накопленное время)} в микросекундах и порядок импорта"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [path, ROOT, os.getenv('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise SystemExit(f"❌ Не удалось выполнить {code}:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def profile(module, path, runs):
+    """Медиана времени импорта модуля и самые тяжелые зависимости последнего запуска"""
+    baseline = set(importtime('pass', path))
+    totals = []
+    for _ in range(runs):
+        modules = importtime(f'import {module}', path)
+        totals.append(modules[module][1] / 1000)
+    own = {name: times for name, times in modules.items() if name not in baseline}
+    totals.sort()
+    return {
+        'module': module,
+        'import_ms': round(totals[len(totals) // 2], 1),
+        'runs_ms': [round(total, 1) for total in totals],
+        'modules': len(own),
+        'lazy_loaded': [name for name in LAZY_MODULES if name in own],
+        'heaviest': sorted(((name, round(times[1] / 1000, 1), round(times[0] / 1000, 1))
+                            for name, times in own.items() if name != module),
+                           key=lambda item: -item[1])
+    }
+
+
+def parse_budgets(values):
+    budgets = {module: budget for module, (_, budget) in TARGETS.items()}
+    for value in values or []:
+        module, _, budget = value.partition('=')
+        if module not in TARGETS or not budget:
+            raise SystemExit(f"❌ Неверный бюджет {value}: ожидается <{'|'.join(TARGETS)}>=<мс>")
+        budgets[module] = float(budget)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Профиль времени импорта на холодном старте')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='сколько тяжелых зависимостей показать')
+    parser.add_argument('--budget', action='append', help='бюджет модуля: app=400 (мс), можно несколько')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args()
+
+    budgets = parse_budgets(args.budget)
+    reports = []
+    failures = []
+    for module, (path, _) in TARGETS.items():
+        report = profile(module, path, max(1, args.runs))
+        report['budget_ms'] = budgets[module]
+        reports.append(report)
+
+        print(f"📦 {module}: {report['import_ms']} мс (бюджет {budgets[module]} мс, "
+              f"запуски {report['runs_ms']}), модулей {report['modules']}")
+        for name, cumulative, own in report['heaviest'][:args.top]:
+            print(f"   {cumulative:>8.1f} мс  {own:>7.1f} мс  {name}")
+        if report['import_ms'] > budgets[module]:
+            failures.append(f"{module}: {report['import_ms']} > {budgets[module]} мс")
+        if report['lazy_loaded']:
+            failures.append(f"{module} загружает при импорте {', '.join(report['lazy_loaded'])}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    if failures:
+        print("❌ Бюджет превышен: " + '; '.join(failures))
+        sys.exit(1)
+    print("✅ Время импорта в пределах бюджета")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Воспроизведение записанного потока сообщений через весь конвейер парсера
+
+Записи autologist.capture (PARSER_CAPTURE=true в парсере) подаются в
+TelegramParser.process_message с текущими или заданными настройками
+чатов: ключевые слова, дедупликация, извлечение заявок, спул и индексы.
+Запись идет в Firestore в памяти, "текущее время" парсера - время
+получения воспроизводимого сообщения, поэтому результат не зависит от
+момента прогона и двух прогонов можно сравнивать построчно.
+
+Запуск:
+    python scripts/replay_capture.py                                  # data/capture, максимальная скорость
+    python scripts/replay_capture.py --speed 1                        # в исходном темпе
+    python scripts/replay_capture.py --speed 60 --since 2025-11-01    # в 60 раз быстрее
+    python scripts/replay_capture.py --output before.jsonl
+    python scripts/replay_capture.py --chats new_chats.json --output after.jsonl --compare before.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'parsers'))
+
+from autologist.capture import CAPTURE_DIR, iter_capture
+from autologist.replay import FakeClient, ReplayClock, event_from_record
+from autologist.timebuckets import json_default, parse_timestamp
+
+CHAT_CONFIG_FILES = ('config/monitored_chats_cache.json', 'config/monitored_chats.json')
+
+RESULT_FIELDS = ('hash', 'chat_id', 'message_id', 'sender_id', 'keywords_found', 'cargos', 'phones')
+
+
+def load_chats(path=None):
+    """Настройки чатов: указанный файл или локальный кэш парсера"""
+    for candidate in ([path] if path else CHAT_CONFIG_FILES):
+        if candidate and os.path.exists(candidate):
+            with open(candidate, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get('chats', data) if isinstance(data, dict) else data
+    raise SystemExit(f"❌ Не найдены настройки чатов: {path or ', '.join(CHAT_CONFIG_FILES)}")
+
+
+def result_key(result):
+    return f"{result.get('chat_id')}:{result.get('message_id')}"
+
+
+async def replay(records, chats, speed):
+    from autologist.memstore import MemoryFirestore
+    import telegram_parser_v2
+
+    db = MemoryFirestore()
+    clock = ReplayClock()
+    parser = telegram_parser_v2.TelegramParser(client=FakeClient(), db=db, monitored_chats=chats, clock=clock)
+
+    first_received = None
+    started = time.perf_counter()
+    count = 0
+    for record in records:
+        received_at = parse_timestamp(record.get('received_at'))
+        if first_received is None:
+            first_received = received_at
+        if speed and received_at is not None:
+            delay = started + (received_at - first_received).total_seconds() / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        clock.advance(received_at)
+        await parser.process_message(event_from_record(record))
+        count += 1
+    elapsed = time.perf_counter() - started
+
+    parser.rollups.flush()
+    parser.contacts.flush()
+    parser.routes.flush()
+    parser.chat_stats.flush()
+    parser.spool_drainer.drain()
+
+    results = []
+    for snapshot in db.collection('messages').stream():
+        message = snapshot.to_dict()
+        results.append({field: message.get(field) for field in RESULT_FIELDS})
+    results.sort(key=result_key)
+    span = (clock.current - first_received).total_seconds() if first_received else None
+    return {'replayed': count, 'saved': len(results), 'errors': parser.stats['errors'],
+            'elapsed_s': round(elapsed, 2), 'span_s': span, 'results': results}
+
+
+def compare(results, previous):
+    """Различия с прошлым прогоном: новые, пропавшие и изменившиеся сохраненные сообщения"""
+    before = {result_key(result): result for result in previous}
+    after = {result_key(result): result for result in results}
+    added = sorted(set(after) - set(before))
+    removed = sorted(set(before) - set(after))
+    changed = sorted(key for key in set(after) & set(before)
+                     if json.dumps(after[key], sort_keys=True, default=json_default) !=
+                     json.dumps(before[key], sort_keys=True, default=json_default))
+    return added, removed, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного потока сообщений')
+    parser.add_argument('path', nargs='?', default=CAPTURE_DIR, help='папка сегментов или glob шаблон')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='1 - исходный темп, N - в N раз быстрее, 0 - без пауз')
+    parser.add_argument('--since', help='начало периода (ISO)')
+    parser.add_argument('--until', help='конец периода (ISO)')
+    parser.add_argument('--chats', help='JSON с настройками чатов (по умолчанию config/monitored_chats*.json)')
+    parser.add_argument('--output', help='сохранить результат (JSONL) для сравнения')
+    parser.add_argument('--compare', help='результат прошлого прогона для сравнения')
+    parser.add_argument('--examples', type=int, default=10, help='сколько различий показать')
+    args = parser.parse_args()
+
+    # Окружение парсера задается до импорта: спул во временной папке, без шума в логе
+    os.environ['SPOOL_DIR'] = os.path.join(tempfile.mkdtemp(prefix='autologist_replay_'), 'spool')
+    os.environ['SPOOL_FSYNC'] = 'false'
+    os.environ['PARSER_CAPTURE'] = 'false'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.pop('PARSER_WORKER_ID', None)
+
+    since = parse_timestamp(args.since) if args.since else None
+    until = parse_timestamp(args.until) if args.until else None
+    records = iter_capture(args.path, since, until)
+    report = asyncio.run(replay(records, load_chats(args.chats), args.speed))
+
+    speedup = ''
+    if report['span_s'] and report['elapsed_s']:
+        speedup = f" (в {report['span_s'] / report['elapsed_s']:.0f} раз быстрее реального времени)"
+    print(f"📼 Воспроизведено {report['replayed']} сообщений за {report['elapsed_s']} с{speedup}")
+    print(f"💾 Сохранено {report['saved']}, ошибок {report['errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for result in report['results']:
+                f.write(json.dumps(result, ensure_ascii=False, default=json_default) + '\n')
+        print(f"✅ Результат сохранен в {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = [json.loads(line) for line in f if line.strip()]
+        # Сравнение в JSON представлении: даты и числа как в файле
+        results = [json.loads(json.dumps(result, default=json_default)) for result in report['results']]
+        added, removed, changed = compare(results, previous)
+        print(f"🔀 Сравнение с {args.compare}: новых {len(added)}, пропавших {len(removed)}, изменившихся {len(changed)}")
+        for title, keys in (('➕ новые', added), ('➖ пропавшие', removed), ('✏️  изменились', changed)):
+            for key in keys[:args.examples]:
+                print(f"   {title}: {key}")
+
+
+if __name__ == '__main__':
+    main()
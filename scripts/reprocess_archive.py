@@ -0,0 +1,120 @@
+"""
+Переобработка архива сообщений текущими настройками чатов
+
+После изменения ключевых слов (update_chat_keywords) прогоняет сохраненные
+сообщения и/или запись входящего потока (data/capture) через текущие
+фильтры и записывает только различия: обновленные keywords_found / cargos /
+phones, добавленные сообщения из записи потока, а с --delete-rejected -
+удаление сообщений, которые больше не проходят фильтр (сообщения
+отключенных и удаленных из настроек чатов не удаляются). Прерванный прогон
+продолжается с контрольной точки; после смены фильтров и после успешного
+прогона точка не используется.
+
+Запуск:
+    python scripts/reprocess_archive.py --dry-run               # что изменится
+    python scripts/reprocess_archive.py --workers 8
+    python scripts/reprocess_archive.py --source capture --since 2025-11-01
+    python scripts/reprocess_archive.py --local --chats new_chats.json --delete-rejected
+
+    --source archive|capture|all   что переобрабатывать (по умолчанию archive)
+    --chats FILE                   настройки чатов из файла вместо monitored_chats
+    --no-indexes                   не обновлять статистику, контакты и маршруты
+    --reset-checkpoint             начать заново
+"""
+
+import os
+import sys
+import json
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autologist.capture import CAPTURE_DIR, iter_capture
+from autologist.reprocess import REPROCESS_CHECKPOINT_PATH, FirestoreArchive, LocalArchive, ReprocessEngine
+from autologist.timebuckets import json_default, parse_timestamp
+
+LOCAL_CHAT_FILES = ('config/monitored_chats.json', 'config/monitored_chats_cache.json')
+
+
+def load_chats(path, db):
+    """Настройки чатов: файл, локальная конфигурация или коллекция monitored_chats"""
+    paths = [path] if path else (LOCAL_CHAT_FILES if db is None else [])
+    for candidate in paths:
+        if os.path.exists(candidate):
+            with open(candidate, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get('chats', data) if isinstance(data, dict) else data
+    if db is None:
+        raise SystemExit(f"❌ Не найдены настройки чатов: {', '.join(paths)}")
+    return [doc.to_dict() for doc in db.collection('monitored_chats').stream()]
+
+
+def build_indexes(db):
+    from autologist.contacts import ContactIndex, FirestoreContactStore, LocalContactStore
+    from autologist.rollups import FirestoreRollupStore, LocalRollupStore, RollupEngine
+    from autologist.routes import FirestoreRouteStore, LocalRouteStore, RouteIndex
+
+    if db is None:
+        return RollupEngine(LocalRollupStore()), ContactIndex(LocalContactStore()), RouteIndex(LocalRouteStore())
+    return (RollupEngine(FirestoreRollupStore(db)), ContactIndex(FirestoreContactStore(db)),
+            RouteIndex(FirestoreRouteStore(db)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Переобработка архива сообщений текущими фильтрами')
+    parser.add_argument('--source', choices=['archive', 'capture', 'all'], default='archive')
+    parser.add_argument('--capture-path', default=CAPTURE_DIR, help='папка сегментов записи потока')
+    parser.add_argument('--since', help='начало периода записи потока (ISO)')
+    parser.add_argument('--until', help='конец периода записи потока (ISO)')
+    parser.add_argument('--chats', help='JSON с настройками чатов')
+    parser.add_argument('--local', action='store_true', help='data/messages вместо Firestore')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--delete-rejected', action='store_true',
+                        help='удалять сообщения, которые больше не проходят фильтр, и дубликаты')
+    parser.add_argument('--no-indexes', action='store_true')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать различия')
+    parser.add_argument('--reset-checkpoint', action='store_true', help='не продолжать прерванный прогон')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    db = None
+    if not args.local:
+        from google.cloud import firestore
+        db = firestore.Client()
+    archive = LocalArchive() if args.local else FirestoreArchive(db)
+    rollups = contacts = routes = None
+    if not args.no_indexes:
+        rollups, contacts, routes = build_indexes(db)
+
+    engine = ReprocessEngine(archive, load_chats(args.chats, db), workers=args.workers,
+                             checkpoint_path=REPROCESS_CHECKPOINT_PATH, delete_rejected=args.delete_rejected,
+                             dry_run=args.dry_run, rollups=rollups, contacts=contacts, routes=routes)
+    if args.reset_checkpoint:
+        engine.checkpoint.reset()
+
+    # Сначала архив: иначе только что добавленные из записи потока сообщения попали бы в сканирование
+    if args.source in ('archive', 'all'):
+        engine.run_archive()
+    if args.source in ('capture', 'all'):
+        since = parse_timestamp(args.since) if args.since else None
+        until = parse_timestamp(args.until) if args.until else None
+        engine.run_capture(iter_capture(args.capture_path, since, until))
+
+    stats = engine.stats
+    action = 'Будет' if args.dry_run else 'Готово'
+    rate = stats['scanned'] / stats['elapsed'] if stats.get('elapsed') else 0
+    print(f"✅ {action}: просмотрено {stats['scanned']} за {stats.get('elapsed', 0)} с ({rate:.0f} сообщ./с), "
+          f"пропущено по контрольной точке {stats['skipped_done']}, чаты отключены или удалены "
+          f"{stats['skipped_chat']}")
+    print(f"   без изменений {stats['unchanged']}, изменено {stats['updated']}, добавлено из записи потока "
+          f"{stats['added']} (уже в архиве {stats['in_archive']})")
+    print(f"   не проходят фильтр {stats['rejected']}, дубликатов {stats['duplicates']}, удалено {stats['deleted']}, "
+          f"ошибок {stats['errors']}")
+    for example in engine.examples[:10]:
+        print(f"   • {json.dumps(example, ensure_ascii=False, default=json_default)[:200]}")
+
+
+if __name__ == '__main__':
+    main()